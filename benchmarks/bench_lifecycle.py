@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+'''
+Benchmarks of instant-mongo lifecycle and helper hot paths:
+
+- start and stop of a standalone mongod, a single-member and a three-member replica set
+  (total and per phase, see InstantMongoDB.timings)
+- PortGuard.get_available_port() with many processes allocating ports at once
+- drop_everything() (drop_all_dbs) with many databases
+- MongoClient creation - cached im.client and new get_client()
+
+Runs against a real mongod if one is installed, otherwise (or with --mongod fake)
+against benchmarks/fake_mongod.py, so the overhead of instant-mongo itself
+can be measured anywhere (the fake mongod doesn't do elections, so the three-member
+replica set is measured only with a real mongod). Results (in seconds) are written as JSON:
+
+    python3 benchmarks/bench_lifecycle.py --output before.json
+    ... change something ...
+    python3 benchmarks/bench_lifecycle.py --output after.json --compare before.json
+'''
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from json import dump, load
+from pathlib import Path
+from platform import platform, python_version
+from shutil import which
+from statistics import mean, median
+from sys import path as sys_path, stdout
+from tempfile import TemporaryDirectory
+from time import monotonic_ns
+
+here = Path(__file__).resolve().parent
+sys_path.insert(0, str(here.parent))
+
+import pymongo  # noqa: E402
+
+from instant_mongo import InstantMongoDB, __version__  # noqa: E402
+from instant_mongo.data_template import get_mongod_version  # noqa: E402
+from instant_mongo.port_guard import PortGuard  # noqa: E402
+
+
+fake_mongod_path = here / 'fake_mongod.py'
+
+
+def measure(fn):
+    '''
+    Calls fn() and returns its duration in seconds.
+    '''
+    start_ns = monotonic_ns()
+    fn()
+    return (monotonic_ns() - start_ns) / 1e9
+
+
+def bench_start_stop(results, label, repeat, mongod_bin, **kwargs):
+    with TemporaryDirectory(prefix='instant-mongo-bench.') as temp_dir:
+        for _ in range(repeat):
+            im = InstantMongoDB(temp_dir, mongod_bin=mongod_bin, **kwargs)
+            im.start()
+            im.stop()
+            for phase, seconds in im.timings.items():
+                results.setdefault(f'{label}.{phase}', []).append(seconds)
+
+
+def _allocate_ports(count):
+    durations = []
+    with PortGuard() as port_guard:
+        for _ in range(count):
+            durations.append(measure(port_guard.get_available_port))
+    return durations
+
+
+def bench_port_guard(results, repeat, processes=16, ports_per_process=8):
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # warm up the worker processes
+        list(executor.map(_allocate_ports, [0] * processes))
+        for _ in range(repeat):
+            for durations in executor.map(_allocate_ports, [ports_per_process] * processes):
+                results.setdefault(f'port_guard.get_available_port.{processes}_processes', []).extend(durations)
+
+
+def bench_helpers(results, repeat, mongod_bin, db_count=50):
+    with InstantMongoDB(mongod_bin=mongod_bin) as im:
+        for strategy in ('drop', 'truncate'):
+            for _ in range(repeat):
+                for n in range(db_count):
+                    im.client[f'bench_{n}']['coll'].insert_one({'n': n})
+                results.setdefault(f'drop_everything.{strategy}.{db_count}_dbs', []).append(
+                    measure(lambda: im.drop_everything(strategy=strategy)))
+        im.drop_everything()
+
+        def cached_client():
+            im.close_client()
+            im.client.admin.command('ping')
+
+        def new_client():
+            with im.get_client() as client:
+                client.admin.command('ping')
+
+        for _ in range(repeat):
+            results.setdefault('client.cached_first_use', []).append(measure(cached_client))
+            results.setdefault('client.cached_reuse', []).append(measure(lambda: im.client.admin.command('ping')))
+            results.setdefault('get_client.create_ping_close', []).append(measure(new_client))
+
+
+def summarize(durations):
+    return {
+        'n': len(durations),
+        'min': min(durations),
+        'median': median(durations),
+        'mean': mean(durations),
+        'max': max(durations),
+    }
+
+
+def print_results(summary, baseline=None):
+    stdout.write(f'{"benchmark":60} {"median ms":>10} {"min ms":>10}' + (f' {"vs baseline":>12}' if baseline else '') + '\n')
+    for name, stats in summary.items():
+        line = f'{name:60} {stats["median"] * 1000:10.2f} {stats["min"] * 1000:10.2f}'
+        base = (baseline or {}).get(name)
+        if base and base['median']:
+            line += f' {stats["median"] / base["median"]:11.2f}x'
+        stdout.write(line + '\n')
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mongod', choices=['auto', 'real', 'fake'], default='auto',
+                        help='auto = real mongod if found in PATH, otherwise the fake one')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file with baseline results to compare with')
+    args = parser.parse_args()
+
+    use_fake = args.mongod == 'fake' or (args.mongod == 'auto' and not which('mongod'))
+    mongod_bin = str(fake_mongod_path) if use_fake else 'mongod'
+
+    results = {}
+    bench_start_stop(results, 'standalone', args.repeat, mongod_bin)
+    bench_start_stop(results, 'replica_set', args.repeat, mongod_bin, as_replica_set=True)
+    if not use_fake:
+        bench_start_stop(results, 'replica_set_3_members', max(1, args.repeat // 3), mongod_bin, replica_set_members=3)
+    bench_port_guard(results, args.repeat)
+    bench_helpers(results, args.repeat, mongod_bin)
+
+    summary = {name: summarize(durations) for name, durations in results.items()}
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'mongod': 'fake' if use_fake else 'real',
+            'mongod_version': get_mongod_version(mongod_bin).splitlines()[0],
+            'instant_mongo_version': __version__,
+            'pymongo_version': pymongo.version,
+            'python_version': python_version(),
+            'platform': platform(),
+            'repeat': args.repeat,
+        },
+        'results': summary,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = load(f)['results']
+    print_results(summary, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            dump(report, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+'''
+Small stand-in for the mongod binary, used by bench_lifecycle.py to measure
+the overhead of instant-mongo itself on machines without MongoDB installed:
+
+    InstantMongoDB(mongod_bin='benchmarks/fake_mongod.py')
+
+It prints mongod-style JSON log lines (including "Waiting for connections",
+which instant-mongo waits for) and answers just the commands the lifecycle
+benchmark needs: the hello handshake, ping, replSetInitiate of a single-member
+replica set, shutdown, and insert/count/delete/listCollections/listDatabases/
+dropDatabase for drop_everything(). Documents are not stored, only counted.
+
+It is not a database - anything else gets a CommandNotFound error.
+'''
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from json import dumps
+from os import environ, getpid
+from signal import signal, SIGTERM, SIGINT
+from socketserver import ThreadingTCPServer, BaseRequestHandler
+from struct import pack, unpack_from
+from sys import stdout
+from threading import Lock, Thread, Event
+
+import bson
+from bson import ObjectId
+
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+
+version = environ.get('FAKE_MONGOD_VERSION', '7.0.0')
+
+noop_commands = {'ping', 'endsessions', 'killcursors', 'getparameter', 'saslcontinue'}
+
+
+def log(severity, component, log_id, msg, **attr):
+    entry = {
+        't': {'$date': datetime.now(timezone.utc).isoformat(timespec='milliseconds')},
+        's': severity,
+        'c': component,
+        'id': log_id,
+        'ctx': 'main',
+        'msg': msg,
+    }
+    if attr:
+        entry['attr'] = attr
+    stdout.write(dumps(entry) + '\n')
+    stdout.flush()
+
+
+def command_not_found(name):
+    return {'ok': 0, 'errmsg': f'no such command: {name!r}', 'code': 59, 'codeName': 'CommandNotFound'}
+
+
+class FakeServer:
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = Lock()
+        self.counts = {}  # db name -> {collection name: number of documents}
+        self.rs_initiated = False
+        self.shutdown_event = Event()
+
+    def run_command(self, db_name, cmd):
+        name = next(iter(cmd))
+        lname = name.lower()
+        if lname in noop_commands:
+            reply = {}
+        elif hasattr(self, f'cmd_{lname}'):
+            with self.lock:
+                reply = getattr(self, f'cmd_{lname}')(db_name, cmd[name], cmd)
+        else:
+            reply = command_not_found(name)
+        reply.setdefault('ok', 1)
+        return reply
+
+    def cmd_hello(self, db_name, arg, cmd):
+        reply = {
+            'helloOk': True,
+            'ismaster': True,
+            'isWritablePrimary': True,
+            'maxBsonObjectSize': 16 * 1024 * 1024,
+            'maxMessageSizeBytes': 48000000,
+            'maxWriteBatchSize': 100000,
+            'localTime': datetime.now(timezone.utc),
+            'logicalSessionTimeoutMinutes': 30,
+            'connectionId': 1,
+            'minWireVersion': 0,
+            'maxWireVersion': 21,
+            'readOnly': False,
+        }
+        host = f'127.0.0.1:{self.args.port}'
+        if self.args.replSet and self.rs_initiated:
+            reply.update({
+                'setName': self.args.replSet,
+                'setVersion': 1,
+                'hosts': [host],
+                'primary': host,
+                'me': host,
+                'secondary': False,
+                'electionId': ObjectId('7fffffff0000000000000001'),
+            })
+        elif self.args.replSet:
+            reply.update({'ismaster': False, 'isWritablePrimary': False, 'secondary': False, 'isreplicaset': True})
+        return reply
+
+    cmd_ismaster = cmd_hello
+
+    def cmd_shutdown(self, db_name, arg, cmd):
+        self.shutdown_event.set()
+        return {}
+
+    def cmd_replsetinitiate(self, db_name, arg, cmd):
+        if not self.args.replSet:
+            return {'ok': 0, 'errmsg': 'not running with --replSet', 'code': 76, 'codeName': 'NoReplicationEnabled'}
+        self.rs_initiated = True
+        return {}
+
+    def cmd_insert(self, db_name, coll_name, cmd):
+        colls = self.counts.setdefault(db_name, {})
+        colls[coll_name] = colls.get(coll_name, 0) + len(cmd['documents'])
+        return {'n': len(cmd['documents'])}
+
+    def cmd_count(self, db_name, coll_name, cmd):
+        return {'n': self.counts.get(db_name, {}).get(coll_name, 0)}
+
+    def cmd_delete(self, db_name, coll_name, cmd):
+        # only delete_many({}) is supported
+        n = self.counts.get(db_name, {}).get(coll_name, 0)
+        if n:
+            self.counts[db_name][coll_name] = 0
+        return {'n': n}
+
+    def cmd_listcollections(self, db_name, arg, cmd):
+        batch = [{'name': n, 'type': 'collection', 'options': {}} for n in sorted(self.counts.get(db_name, {}))]
+        return {'cursor': {'id': 0, 'ns': f'{db_name}.$cmd.listCollections', 'firstBatch': batch}}
+
+    def cmd_listdatabases(self, db_name, arg, cmd):
+        names = sorted(set(self.counts) | {'admin', 'config', 'local'})
+        return {'databases': [{'name': n, 'sizeOnDisk': 0, 'empty': False} for n in names], 'totalSize': 0}
+
+    def cmd_dropdatabase(self, db_name, arg, cmd):
+        self.counts.pop(db_name, None)
+        return {}
+
+
+def read_exact(sock, n):
+    buf = b''
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+
+def parse_op_query(body):
+    '''
+    pymongo sends the initial handshake as OP_QUERY.
+    '''
+    ns_end = body.index(b'\0', 4)
+    ns = body[4:ns_end].decode()
+    query_start = ns_end + 1 + 8
+    cmd = bson.decode(body[query_start:query_start + unpack_from('<i', body, query_start)[0]])
+    return ns.split('.')[0], cmd.get('$query', cmd)
+
+
+def parse_op_msg(body):
+    '''
+    Returns (flags, command) - document sequences (e.g. documents of insert) are merged into the command.
+    '''
+    flags, = unpack_from('<I', body)
+    pos = 4
+    cmd = None
+    sequences = {}
+    end = len(body) - (4 if flags & 1 else 0)
+    while pos < end:
+        kind = body[pos]
+        pos += 1
+        size, = unpack_from('<i', body, pos)
+        if kind == 0:
+            cmd = bson.decode(body[pos:pos + size])
+        else:
+            ident_end = body.index(b'\0', pos + 4)
+            sequences[body[pos + 4:ident_end].decode()] = list(bson.decode_all(body[ident_end + 1:pos + size]))
+        pos += size
+    cmd.update(sequences)
+    return flags, cmd
+
+
+class Handler(BaseRequestHandler):
+
+    def handle(self):
+        server = self.server.fake
+        while not server.shutdown_event.is_set():
+            header = read_exact(self.request, 16)
+            body = header and read_exact(self.request, unpack_from('<i', header)[0] - 16)
+            if body is None:
+                return
+            _, request_id, _, op_code = unpack_from('<iiii', header)
+            if op_code == OP_QUERY:
+                payload = pack('<iqii', 0, 0, 0, 1) + bson.encode(server.run_command(*parse_op_query(body)))
+                self.request.sendall(pack('<iiii', 16 + len(payload), 0, request_id, OP_REPLY) + payload)
+            elif op_code == OP_MSG:
+                flags, cmd = parse_op_msg(body)
+                reply = server.run_command(cmd.get('$db', 'admin'), cmd)
+                if not flags & 2:
+                    # reply unless moreToCome is set
+                    payload = pack('<IB', 0, 0) + bson.encode(reply)
+                    self.request.sendall(pack('<iiii', 16 + len(payload), 0, request_id, OP_MSG) + payload)
+            else:
+                return
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('--version', action='store_true')
+    parser.add_argument('--dbpath')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--bind_ip', default='127.0.0.1')
+    parser.add_argument('--replSet')
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.version:
+        print(f'db version v{version}')
+        print('Build Info: {"version": "%s", "fake": true}' % version)
+        return
+
+    fake = FakeServer(args)
+
+    def on_signal(signum, frame):
+        fake.shutdown_event.set()
+
+    signal(SIGTERM, on_signal)
+    signal(SIGINT, on_signal)
+
+    log('I', 'CONTROL', 4615611, 'MongoDB starting', pid=getpid(), port=args.port, dbPath=args.dbpath)
+    ThreadingTCPServer.allow_reuse_address = True
+    ThreadingTCPServer.daemon_threads = True
+    servers = []
+    for addr in args.bind_ip.split(','):
+        srv = ThreadingTCPServer((addr, args.port), Handler)
+        srv.fake = fake
+        servers.append(srv)
+        Thread(target=srv.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    log('I', 'NETWORK', 23016, 'Waiting for connections', port=args.port, ssl='off')
+    while not fake.shutdown_event.wait(0.05):
+        pass
+    log('I', 'CONTROL', 23138, 'Shutting down', exitCode=0)
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+    log('I', 'CONTROL', 20565, 'Now exiting')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,14 @@
+from .cluster import InstantMongoCluster
 from .instant_mongo import InstantMongoDB
+from .pool import InstantMongoPool
+from .shared import SharedInstantMongoDB
 
 
 __all__ = [
+    'InstantMongoCluster',
     'InstantMongoDB',
+    'InstantMongoPool',
+    'SharedInstantMongoDB',
 ]
 
 
@@ -0,0 +1,249 @@
+'''
+Local sharded cluster: config server replica set, shard replica sets and mongos.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from os import getpid
+from pathlib import Path
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from shutil import rmtree
+from tempfile import TemporaryDirectory
+from threading import RLock
+from time import time_ns
+from typing import Optional
+
+from bson import MaxKey, MinKey
+
+from .instant_mongo import ClientMixin, InstantMongoDB, MongoDBProcess, logger, stop_processes, wait_until_accepting_conns
+from .port_guard import PortGuard
+from .profiles import get_mongod_profile
+from .replica_set import ReplicaSetMember, default_replica_set_settings, initiate_replica_set, replica_set_config
+from .util import to_path
+
+
+config_replica_set_name = 'test-configrs'
+
+
+class InstantMongoCluster(ClientMixin):
+    '''
+    Usage:
+
+    with InstantMongoCluster(shards=2) as cluster:
+        cluster.shard_collection('test.users', {'user_id': 1}, split_points=[{'user_id': 1000}])
+        cluster.client.test.users.insert_one({'user_id': 42})
+
+    Config server and every shard are single-member replica sets. They are
+    started in parallel, mongos is started as soon as the config server is ready.
+
+    - cluster.mongo_uri is 'mongodb://127.0.0.1:{mongos port}'
+    - cluster.client is pymongo.MongoClient(cluster.mongo_uri)
+    - cluster.db is cluster.client['test']
+    - cluster.drop_everything() drops all databases and collections; intended for tests
+    '''
+
+    wait_timeout = 30
+
+    replica_set_settings = default_replica_set_settings
+
+    def __init__(
+            self, data_parent_dir=None, *, data_dir=None, shards=2, port=None,
+            delete_data_dir_on_exit=None, follow_logs=False,
+            mongod_bin='mongod', mongos_bin='mongos',
+            mongod_profile='default', extra_args=None):
+        if shards < 1:
+            raise ValueError('Cluster needs at least one shard')
+        self.logger = logger
+        self.shards = shards
+        self.port: Optional[int] = port
+        self.delete_data_dir_on_exit = delete_data_dir_on_exit
+        self.follow_logs = follow_logs
+        self.mongod_bin = mongod_bin
+        self.mongos_bin = mongos_bin
+        self.mongod_profile = get_mongod_profile(mongod_profile)
+        self.extra_args = list(extra_args or [])
+        if data_dir:
+            self.data_dir = to_path(data_dir)
+        elif data_parent_dir:
+            self.data_dir = to_path(data_parent_dir) / f'instant-mongo-cluster.{getpid()}.{time_ns()}'
+            if self.delete_data_dir_on_exit is None:
+                self.delete_data_dir_on_exit = True
+        else:
+            self.data_dir = None  # will be created later
+        self.shard_names = [f'test-shard{i}' for i in range(shards)]
+        self._exit_stack = None
+        self._config_server = None
+        self._shard_servers = []
+        self._mongos_process = None
+        self._client: Optional[MongoClient] = None
+        self._client_lock = RLock()
+
+    @property
+    def mongo_uri(self) -> str:
+        if self._mongos_process is None:
+            raise RuntimeError('MongoDB cluster is not running')
+        return f'mongodb://127.0.0.1:{self.port}'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        InstantMongoDB._patch_pymongo_min_heartbeat_interval()
+        assert self._exit_stack is None
+        self._exit_stack = ExitStack()
+        try:
+            self._start()
+        except BaseException:
+            self.close_client()
+            self._exit_stack.close()
+            self._exit_stack = None
+            self._mongos_process = None
+            raise
+
+    def _start(self):
+        if self.data_dir is None:
+            temp_dir = self._exit_stack.enter_context(TemporaryDirectory(prefix=f'instant-mongo.{getpid()}.'))
+            self.data_dir = Path(temp_dir) / 'cluster'
+        port_guard = self._exit_stack.enter_context(PortGuard())
+        self._exit_stack.callback(self._stop_mongod_processes)
+        self._config_server = self._spawn_mongod('config', config_replica_set_name, '--configsvr', port_guard)
+        self._shard_servers = [
+            self._spawn_mongod(name, name, '--shardsvr', port_guard) for name in self.shard_names]
+        if not self.port:
+            self.port = port_guard.get_available_port()
+        with ThreadPoolExecutor(max_workers=self.shards + 1) as executor:
+            config_future = executor.submit(self._init_replica_set, self._config_server, config_replica_set_name, True)
+            shard_futures = [
+                executor.submit(self._init_replica_set, server, name, False)
+                for server, name in zip(self._shard_servers, self.shard_names)]
+            config_future.result()
+            self._start_mongos()
+            for future in shard_futures:
+                future.result()
+        for server, name in zip(self._shard_servers, self.shard_names):
+            self.client.admin.command('addShard', f'{name}/{server.host}', name=name)
+
+    def _spawn_mongod(self, dir_name, replica_set_name, role_arg, port_guard):
+        data_dir = self.data_dir / dir_name
+        data_dir.mkdir(parents=True, exist_ok=True)
+        server = ReplicaSetMember(0, port_guard.get_available_port(), data_dir)
+        server.process = MongoDBProcess(
+            logger=self.logger,
+            data_dir=data_dir,
+            port=server.port,
+            as_replica_set=True,
+            follow_logs=self.follow_logs,
+            mongod_bin=self.mongod_bin,
+            mongod_profile=self.mongod_profile,
+            extra_args=[role_arg] + self.extra_args,
+            replica_set_name=replica_set_name)
+        server.process.start()
+        return server
+
+    def _init_replica_set(self, server, name, configsvr):
+        wait_until_accepting_conns(server.process, self.wait_timeout)
+        config = replica_set_config([server], self.replica_set_settings, name=name)
+        if configsvr:
+            config['configsvr'] = True
+        initiate_replica_set(server, config, self.wait_timeout)
+
+    def _start_mongos(self):
+        data_dir = self.data_dir / 'mongos'
+        data_dir.mkdir(parents=True, exist_ok=True)
+        self._mongos_process = MongosProcess(
+            logger=self.logger,
+            data_dir=data_dir,
+            port=self.port,
+            config_db=f'{config_replica_set_name}/{self._config_server.host}',
+            follow_logs=self.follow_logs,
+            mongos_bin=self.mongos_bin)
+        # stopped before the mongod processes
+        self._exit_stack.callback(self._mongos_process.stop)
+        self._mongos_process.start()
+        wait_until_accepting_conns(self._mongos_process, self.wait_timeout)
+
+    def _stop_mongod_processes(self):
+        stop_processes([s.process for s in [self._config_server] + self._shard_servers if s is not None])
+        self._config_server = None
+        self._shard_servers = []
+
+    def stop(self):
+        self.close_client()
+        if self._exit_stack is not None:
+            self._exit_stack.close()
+            self._exit_stack = None
+        self._mongos_process = None
+        if self.delete_data_dir_on_exit and self.data_dir is not None:
+            rmtree(self.data_dir, ignore_errors=True)
+            self.data_dir = None
+
+    def shard_collection(self, collection, key, unique=False, split_points=None):
+        '''
+        Enables sharding of the database and shards the collection (pymongo
+        Collection or 'db.collection' name) using shard key `key`, e.g. {'user_id': 1}
+        or {'user_id': 'hashed'}. If split_points are given, the collection is
+        pre-split using split_chunks().
+        '''
+        db_name, ns = _namespace(collection)
+        self.client.admin.command('enableSharding', db_name)
+        self.client.admin.command('shardCollection', ns, key=key, unique=unique)
+        if split_points:
+            self.split_chunks(ns, split_points)
+
+    def split_chunks(self, collection, split_points):
+        '''
+        Splits chunks of a sharded collection at the given shard key values
+        (e.g. [{'user_id': 1000}, {'user_id': 2000}]) and distributes
+        the resulting chunks across shards round-robin.
+        '''
+        _, ns = _namespace(collection)
+        split_points = list(split_points)
+        for point in split_points:
+            self.client.admin.command('split', ns, middle=point)
+        lower = [{field: MinKey() for field in split_points[0]}] + split_points
+        upper = split_points + [{field: MaxKey() for field in split_points[0]}]
+        for i, bounds in enumerate(zip(lower, upper)):
+            try:
+                self.client.admin.command('moveChunk', ns, bounds=list(bounds), to=self.shard_names[i % self.shards])
+            except OperationFailure as e:
+                # older MongoDB versions refuse to move a chunk to the shard where it already is
+                if 'already' not in str(e):
+                    raise
+
+
+def _namespace(collection):
+    if isinstance(collection, str):
+        db_name, _ = collection.split('.', 1)
+        return db_name, collection
+    return collection.database.name, collection.full_name
+
+
+class MongosProcess(MongoDBProcess):
+    '''
+    mongos router process; its data_dir is used only for the log files.
+    '''
+
+    def __init__(self, logger, data_dir, port, config_db, follow_logs, mongos_bin='mongos', extra_args=None):
+        self._config_db = config_db
+        super().__init__(
+            logger=logger,
+            data_dir=data_dir,
+            port=port,
+            as_replica_set=False,
+            follow_logs=follow_logs,
+            mongod_bin=mongos_bin,
+            extra_args=extra_args)
+
+    def _build_cmd(self):
+        return [
+            self._mongod_bin,
+            '--configdb', self._config_db,
+            '--port', str(self._port),
+            '--bind_ip', '127.0.0.1',
+            *self._extra_args,
+        ]
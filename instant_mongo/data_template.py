@@ -0,0 +1,121 @@
+from functools import lru_cache
+from hashlib import sha256
+from logging import getLogger
+from os import getpid, rename
+from pathlib import Path
+from shutil import copy2, copystat, copytree, rmtree
+from subprocess import check_output
+from sys import platform
+from tempfile import gettempdir
+from time import time_ns
+
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+
+from .util import locked_file
+
+
+logger = getLogger(__name__)
+
+# Linux ioctl that makes dst share data blocks with src (copy-on-write),
+# supported on btrfs, XFS (with reflink=1), bcachefs and others.
+FICLONE = 0x40049409
+
+# Files that are specific to a single mongod run and must not be part of a template.
+template_ignore_names = ('mongod.lock', 'mongod-stdout.log', 'mongod-stderr.log', 'diagnostic.data')
+
+
+def default_data_template_dir():
+    return Path(gettempdir()) / 'instant-mongo-templates'
+
+
+@lru_cache(maxsize=None)
+def get_mongod_version(mongod_bin='mongod'):
+    '''
+    Returns the output of `mongod --version`; used to tell apart templates
+    created by different mongod builds.
+    '''
+    return check_output([mongod_bin, '--version']).decode(errors='replace').strip()
+
+
+def data_template_key(mongod_version, storage_args):
+    '''
+    Returns a short identifier of a data dir template. Templates are only
+    compatible with the same mongod version and the same storage options.
+    '''
+    h = sha256()
+    h.update(mongod_version.encode())
+    for arg in storage_args:
+        h.update(b'\0' + str(arg).encode())
+    return h.hexdigest()[:16]
+
+
+def ensure_data_template(template_root, key, init_data_dir):
+    '''
+    Returns path to a pre-initialized data dir template identified by `key`.
+
+    If the template does not exist yet, `init_data_dir(path)` is called to
+    populate an empty directory (typically by starting and cleanly stopping
+    mongod in it). Creation is serialized across processes with a lock file
+    and the finished template is moved into place atomically, so concurrent
+    callers either wait for it or see a complete template.
+    '''
+    template_root = Path(template_root)
+    template_path = template_root / key
+    if template_path.is_dir():
+        return template_path
+    template_root.mkdir(parents=True, exist_ok=True)
+    with locked_file(template_root / f'{key}.lock'):
+        if template_path.is_dir():
+            return template_path
+        staging_path = template_root / f'{key}.tmp.{getpid()}.{time_ns()}'
+        try:
+            staging_path.mkdir()
+            logger.debug('Initializing data dir template %s', template_path)
+            init_data_dir(staging_path)
+            for name in template_ignore_names:
+                p = staging_path / name
+                if p.is_dir():
+                    rmtree(p)
+                elif p.exists():
+                    p.unlink()
+            rename(staging_path, template_path)
+        finally:
+            rmtree(staging_path, ignore_errors=True)
+    return template_path
+
+
+def clone_data_dir(template_path, data_dir):
+    '''
+    Copies contents of a data dir template into (existing, empty) data_dir.
+
+    Files are reflinked where the filesystem supports it, otherwise copied.
+    Hardlinks are not used on purpose - WiredTiger modifies its files in place,
+    so a hardlinked clone would corrupt the template.
+    '''
+    # not copytree(dirs_exist_ok=True) - that needs Python 3.8+
+    for src in sorted(Path(template_path).iterdir()):
+        if src.name in template_ignore_names:
+            continue
+        if src.is_dir():
+            copytree(
+                src, Path(data_dir) / src.name,
+                ignore=lambda src, names: [n for n in names if n in template_ignore_names],
+                copy_function=_clone_file)
+        else:
+            _clone_file(src, Path(data_dir) / src.name)
+
+
+def _clone_file(src, dst):
+    if ioctl is not None and platform.startswith('linux'):
+        try:
+            with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+                ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            pass
+        else:
+            copystat(src, dst)
+            return dst
+    return copy2(src, dst)
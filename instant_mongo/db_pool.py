@@ -0,0 +1,213 @@
+'''
+Pool of test databases that are reused instead of being created and dropped for each test.
+
+A database is leased with a schema - collections and their indexes - that is
+created only when no matching database is available in the pool. On release
+the database is emptied (documents are deleted, collections created by the test
+are dropped, changed indexes are rebuilt) and returned to the pool, so the next
+lease of the same schema gets it without creating collections and indexes again.
+Before a pooled database is leased, its collections and indexes are checked
+(reading the catalog only) and rebuilt if they were changed outside the pool.
+
+Usage:
+
+    schema = {
+        'users': [IndexModel([('email', 1)], unique=True)],
+        'orders': [[('user_id', 1), ('created', -1)]],
+        'events': [],
+    }
+    with im.lease_db(schema) as db:
+        db['users'].insert_one({'email': 'joe@example.com'})
+'''
+
+from contextlib import contextmanager
+from json import dumps
+from logging import getLogger
+from threading import Lock
+
+from pymongo import IndexModel
+
+from .util import empty_collection
+
+
+logger = getLogger(__name__)
+
+
+def normalize_schema(schema):
+    '''
+    Returns schema as dict {collection name: list of pymongo.IndexModel}.
+
+    Indexes can be given as IndexModel instances or as keys accepted by IndexModel
+    (field name, list of (field, direction) pairs or a dict {field: direction}).
+    '''
+    normalized = {}
+    for name, indexes in (schema or {}).items():
+        if name.startswith('system.'):
+            raise ValueError(f'Invalid collection name in schema: {name!r}')
+        normalized[name] = [_index_model(index) for index in indexes or []]
+    return normalized
+
+
+def _index_model(index):
+    if isinstance(index, IndexModel):
+        return index
+    if isinstance(index, dict):
+        return IndexModel(list(index.items()))
+    return IndexModel(index)
+
+
+def schema_key(schema):
+    '''
+    Returns string identifying normalized schema - databases with equal schema keys are interchangeable.
+    '''
+    return dumps(sorted((name, [index.document for index in indexes]) for name, indexes in schema.items()), default=str)
+
+
+def create_schema(db, schema):
+    for name, indexes in schema.items():
+        db.create_collection(name)
+        if indexes:
+            db[name].create_indexes(indexes)
+
+
+def expected_index_names(indexes):
+    return {'_id_'} | {index.document['name'] for index in indexes}
+
+
+def schema_in_place(db, schema):
+    '''
+    Returns True if the database has exactly the collections of the schema, each with exactly its indexes.
+    '''
+    existing = {
+        info['name']: info.get('type', 'collection')
+        for info in db.list_collections()
+        if not info['name'].startswith('system.')
+    }
+    if existing != {name: 'collection' for name in schema}:
+        return False
+    return all(
+        {spec['name'] for spec in db[name].list_indexes()} == expected_index_names(indexes)
+        for name, indexes in schema.items())
+
+
+def reset_db(db, schema):
+    '''
+    Brings the database back to the state right after create_schema(db, schema),
+    deleting documents instead of dropping and creating collections where possible.
+    '''
+    existing = {
+        info['name']: info
+        for info in db.list_collections()
+        if not info['name'].startswith('system.')
+    }
+    for name in existing:
+        if name not in schema:
+            db.drop_collection(name)
+    for name, indexes in schema.items():
+        info = existing.get(name)
+        if info is None or info.get('type', 'collection') != 'collection':
+            if info is not None:
+                db.drop_collection(name)
+            create_schema(db, {name: indexes})
+            continue
+        collection = db[name]
+        empty_collection(collection, info.get('options'))
+        if {spec['name'] for spec in collection.list_indexes()} != expected_index_names(indexes):
+            collection.drop_indexes()
+            if indexes:
+                collection.create_indexes(indexes)
+
+
+class DatabasePool:
+    '''
+    Pool of databases grouped by schema, see module docstring.
+
+    `new_db` is a callable returning a new (not yet existing) pymongo.Database,
+    e.g. InstantMongoDB.get_new_test_db; `get_db` returns pymongo.Database by name.
+    Only names are kept in the pool, so that the client may be replaced in the meantime.
+    '''
+
+    def __init__(self, new_db, get_db):
+        self._new_db = new_db
+        self._get_db = get_db
+        self._lock = Lock()
+        self._free = {}  # schema key -> list of database names
+        self._leased = {}  # database name -> (schema key, schema)
+        self._stale = set()  # names of databases changed outside the pool, see invalidate()
+
+    def acquire(self, schema=None):
+        '''
+        Returns a database with the given schema - from the pool if available, otherwise a new one.
+        A pooled database is reset first if its collections or indexes are not as in the schema.
+        '''
+        schema = normalize_schema(schema)
+        key = schema_key(schema)
+        with self._lock:
+            free = self._free.get(key)
+            db_name = free.pop() if free else None
+            stale = db_name in self._stale
+            self._stale.discard(db_name)
+        if db_name is None:
+            db = self._new_db()
+            create_schema(db, schema)
+        else:
+            db = self._get_db(db_name)
+            if stale or not schema_in_place(db, schema):
+                reset_db(db, schema)
+        with self._lock:
+            self._leased[db.name] = (key, schema)
+        return db
+
+    def release(self, db):
+        '''
+        Empties the database and returns it to the pool. If emptying fails, the database is dropped.
+        '''
+        with self._lock:
+            leased = self._leased.pop(db.name, None)
+        if leased is None:
+            # the pool was cleared in the meantime
+            return
+        key, schema = leased
+        try:
+            reset_db(db, schema)
+        except Exception as e:
+            logger.warning('Failed to reset database %s, dropping it: %r', db.name, e)
+            db.client.drop_database(db.name)
+            return
+        with self._lock:
+            self._free.setdefault(key, []).append(db.name)
+
+    @contextmanager
+    def lease(self, schema=None):
+        db = self.acquire(schema)
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def invalidate(self, db_names):
+        '''
+        Marks pooled databases whose collections were dropped or changed outside the pool
+        (e.g. by InstantMongoDB.cleanup_dirty()) - they are reset to their schema before
+        they are leased again.
+        '''
+        with self._lock:
+            known = {name for names in self._free.values() for name in names} | set(self._leased)
+            self._stale.update(known & set(db_names))
+
+    def clear(self):
+        '''
+        Forgets the pooled databases (e.g. when they were dropped); leased databases
+        are not returned to the pool anymore.
+        '''
+        with self._lock:
+            self._free = {}
+            self._leased = {}
+            self._stale = set()
+
+    def __len__(self):
+        '''
+        Number of databases available in the pool.
+        '''
+        with self._lock:
+            return sum(len(dbs) for dbs in self._free.values())
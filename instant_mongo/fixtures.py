@@ -0,0 +1,204 @@
+'''
+Fast loading of seed data (fixtures) from JSON, JSON Lines and BSON files.
+
+Each file is loaded into a collection named after the file:
+
+- `users.json` - a JSON array of documents (parsed incrementally, not read into memory whole)
+  or a single document, MongoDB Extended JSON is supported
+- `users.jsonl` (or `.ndjson`) - one JSON document per line
+- `users.bson` - concatenated BSON documents, e.g. from mongodump
+- `users.metadata.json` - mongodump metadata; its "options" are used when creating
+  the collection and its "indexes" are built after the documents are loaded
+
+Documents are sent in large unordered insert_many() batches as raw BSON, different
+collections are loaded in parallel. JSON files are converted to BSON once and the
+result is cached (keyed by hash of the file contents), so subsequent runs skip parsing.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from hashlib import sha256
+from itertools import islice
+from json import JSONDecoder, JSONDecodeError
+from logging import getLogger
+from pathlib import Path
+from re import compile as re_compile
+from struct import unpack
+from tempfile import NamedTemporaryFile, gettempdir
+
+from bson import encode
+from bson.json_util import loads as json_util_loads, object_pairs_hook as json_util_object_pairs_hook
+from bson.raw_bson import RawBSONDocument
+from .util import index_model, to_path
+
+
+logger = getLogger(__name__)
+
+data_suffixes = ('.json', '.jsonl', '.ndjson', '.bson')
+metadata_suffix = '.metadata.json'
+
+# JSON arrays are parsed from chunks of this size, so that large files are not read into memory whole
+json_chunk_size = 1024 * 1024
+
+
+def default_fixture_cache_dir():
+    return Path(gettempdir()) / 'instant-mongo-fixture-cache'
+
+
+def load_fixtures(db, path, batch_size=5000, max_workers=4, use_cache=True, cache_dir=None):
+    '''
+    Loads fixture file(s) into database `db`. `path` can be a single file or a directory.
+
+    Returns dict {collection name: number of inserted documents}.
+    '''
+    cache_dir = (to_path(cache_dir) if cache_dir else default_fixture_cache_dir()) if use_cache else None
+    collections = find_fixture_files(to_path(path))
+
+    def load(item):
+        coll_name, (data_paths, metadata_path) = item
+        return coll_name, _load_collection(db, coll_name, data_paths, metadata_path, cache_dir, batch_size)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(load, sorted(collections.items())))
+
+
+def _load_collection(db, coll_name, data_paths, metadata_path, cache_dir, batch_size):
+    metadata = _read_metadata(metadata_path) if metadata_path else {}
+    if metadata.get('options') and coll_name not in db.list_collection_names(filter={'name': coll_name}):
+        db.create_collection(coll_name, **metadata['options'])
+    collection = db[coll_name]
+    count = 0
+    for data_path in data_paths:
+        docs = iter_raw_documents(data_path, cache_dir)
+        while True:
+            batch = list(islice(docs, batch_size))
+            if not batch:
+                break
+            collection.insert_many(batch, ordered=False, bypass_document_validation=True)
+            count += len(batch)
+    # building indexes once after all documents are inserted is faster than updating them on every insert
+    indexes = [index_model(spec) for spec in metadata.get('indexes', []) if spec.get('name') != '_id_']
+    if indexes:
+        collection.create_indexes(indexes)
+    return count
+
+
+def find_fixture_files(path):
+    '''
+    Returns dict {collection name: ([data file paths], metadata file path or None)}.
+    '''
+    collections = {}
+    paths = sorted(p for p in path.iterdir() if p.is_file()) if path.is_dir() else [path]
+    for p in paths:
+        if p.name.endswith(metadata_suffix):
+            coll_name = p.name[:-len(metadata_suffix)]
+            collections.setdefault(coll_name, ([], None))
+            collections[coll_name] = (collections[coll_name][0], p)
+        elif p.suffix in data_suffixes:
+            collections.setdefault(p.stem, ([], None))[0].append(p)
+        elif not path.is_dir():
+            raise ValueError(f'Unsupported fixture file type: {p}')
+    return collections
+
+
+def iter_raw_documents(path, cache_dir=None):
+    '''
+    Yields documents from a fixture file as RawBSONDocument instances.
+
+    JSON files are converted to BSON; if cache_dir is given, the converted
+    BSON is stored there and reused as long as the file contents don't change.
+    '''
+    path = to_path(path)
+    if path.suffix == '.bson':
+        yield from _iter_bson_file(path)
+        return
+    if cache_dir is None:
+        for doc in _iter_json_documents(path):
+            yield RawBSONDocument(encode(doc))
+        return
+    cache_path = to_path(cache_dir) / f'{_file_hash(path)}.bson'
+    if not cache_path.is_file():
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # unique temporary file - files with the same content may be converted by multiple threads at once
+        f = NamedTemporaryFile(dir=cache_path.parent, prefix=f'{cache_path.name}.', suffix='.tmp', delete=False)
+        tmp_path = Path(f.name)
+        try:
+            with f:
+                for doc in _iter_json_documents(path):
+                    f.write(encode(doc))
+            tmp_path.replace(cache_path)
+        finally:
+            with suppress(FileNotFoundError):
+                tmp_path.unlink()
+    else:
+        logger.debug('Using cached BSON %s for %s', cache_path, path)
+    yield from _iter_bson_file(cache_path)
+
+
+def _iter_bson_file(path):
+    with path.open('rb') as f:
+        while True:
+            header = f.read(4)
+            if not header:
+                return
+            if len(header) < 4:
+                raise ValueError(f'Truncated BSON document in {path}')
+            size, = unpack('<i', header)
+            body = f.read(size - 4)
+            if len(body) < size - 4:
+                raise ValueError(f'Truncated BSON document in {path}')
+            yield RawBSONDocument(header + body)
+
+
+def _iter_json_documents(path):
+    if path.suffix in ('.jsonl', '.ndjson'):
+        with path.open('rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json_util_loads(line)
+    else:
+        with path.open(encoding='utf-8-sig') as f:
+            yield from _iter_json_array(f)
+
+
+json_separators = re_compile(r'[\s,]*')
+
+
+def _iter_json_array(f):
+    '''
+    Yields items of a JSON array read from text file `f` chunk by chunk.
+    If the file contains a single document instead of an array, that document is yielded.
+    '''
+    buf = f.read(json_chunk_size).lstrip()
+    if not buf.startswith('['):
+        yield json_util_loads(buf + f.read())
+        return
+    decoder = JSONDecoder(object_pairs_hook=json_util_object_pairs_hook)
+    pos = 1
+    while True:
+        pos = json_separators.match(buf, pos).end()
+        if buf.startswith(']', pos):
+            return
+        try:
+            doc, pos = decoder.raw_decode(buf, pos)
+        except JSONDecodeError:
+            # the document continues in the next chunk
+            chunk = f.read(json_chunk_size)
+            if not chunk:
+                raise
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield doc
+
+
+def _file_hash(path):
+    h = sha256(path.suffix.encode() + b'\0')
+    with path.open('rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_metadata(path):
+    # options and index definitions may contain Extended JSON values (e.g. {"$numberInt": "1"})
+    return json_util_loads(path.read_bytes()) or {}
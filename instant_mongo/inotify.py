@@ -0,0 +1,103 @@
+'''
+Minimal ctypes wrapper of the Linux inotify API.
+
+Used to sleep until mongod writes to its log files instead of polling them.
+On other platforms (or when inotify is not usable) `inotify_available()`
+returns False and callers fall back to polling.
+'''
+
+from ctypes import CDLL, c_char_p, c_int, c_uint32, get_errno
+from ctypes.util import find_library
+from os import close, fsencode, read, strerror
+from struct import calcsize, unpack_from
+from sys import platform
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_event_header = 'iIII'
+_event_header_size = calcsize(_event_header)
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        libc = CDLL(find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [c_int]
+        libc.inotify_init1.restype = c_int
+        libc.inotify_add_watch.argtypes = [c_int, c_char_p, c_uint32]
+        libc.inotify_add_watch.restype = c_int
+        libc.inotify_rm_watch.argtypes = [c_int, c_int]
+        libc.inotify_rm_watch.restype = c_int
+        _libc = libc
+    return _libc
+
+
+def inotify_available():
+    if not platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_get_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class Inotify:
+    '''
+    Inotify instance; its file descriptor becomes readable when a watched file changes,
+    so it can be used with select/poll/epoll or asyncio loop.add_reader().
+    '''
+
+    def __init__(self):
+        self._fd = _get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = get_errno()
+            raise OSError(errno, strerror(errno))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask=IN_MODIFY | IN_CLOSE_WRITE):
+        wd = _get_libc().inotify_add_watch(self._fd, fsencode(path), mask)
+        if wd < 0:
+            errno = get_errno()
+            raise OSError(errno, strerror(errno), str(path))
+        return wd
+
+    def remove_watch(self, wd):
+        _get_libc().inotify_rm_watch(self._fd, wd)
+
+    def read_events(self):
+        '''
+        Returns list of (wd, mask) tuples of pending events; doesn't block.
+        '''
+        try:
+            data = read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _event_header_size <= len(data):
+            wd, mask, _, name_len = unpack_from(_event_header, data, pos)
+            events.append((wd, mask))
+            pos += _event_header_size + name_len
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            close(self._fd)
+            self._fd = -1
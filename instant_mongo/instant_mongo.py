@@ -1,31 +1,159 @@
-from contextlib import ExitStack
+from asyncio import TimeoutError as AsyncTimeoutError, create_subprocess_exec, get_running_loop, run_coroutine_threadsafe, wait_for
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from json import dumps
 from logging import getLogger
 from os import getpid
 from pathlib import Path
 from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure, PyMongoError, ServerSelectionTimeoutError
 from pymongo.database import Database
 from re import match
 from shutil import rmtree
-from subprocess import Popen
+from subprocess import Popen, TimeoutExpired
 from tempfile import TemporaryDirectory
-from threading import Event, Thread
-from time import sleep, time_ns, monotonic_ns
+from threading import RLock, Thread
+from time import monotonic, monotonic_ns, time_ns
 from typing import Optional
+from weakref import WeakSet
+from urllib.parse import quote
 
 try:
     from pymongo import AsyncMongoClient
 except ImportError:
     AsyncMongoClient = None
 
+try:
+    from os import register_at_fork
+except ImportError:
+    # not available on Windows
+    register_at_fork = None
+
+from .data_template import clone_data_dir, data_template_key, default_data_template_dir
+from .data_template import ensure_data_template, get_mongod_version
+from .db_pool import DatabasePool
+from .fixtures import load_fixtures
+from .log_pump import log_pump
+from .mongod_log import SlowOpsBuffer, parse_log_line
+from .plan_guard import PlanGuard
 from .port_guard import PortGuard
-from .util import drop_all_dbs
-from .util import tcp_conns_accepted_on_port, to_path
+from .profiles import get_mongod_profile, merge_args, shm_dir
+from .reaper import default_reap_interval, default_roots, reap_orphans_throttled
+from .readiness import PrimaryElectedListener, describe_mongod_failure
+from .readiness import async_wait_for_log_line, is_waiting_for_connections, wait_for_log_line
+from .replica_set import ReplicaSetMember, default_replica_set_settings, monitoring_client_kwargs
+from .replica_set import replica_set_config, replica_set_name
+from .snapshot import create_snapshot, drop_snapshot, restore_snapshot
+from .util import drop_all_dbs, empty_all_dbs, empty_collection
+from .util import tcp_conns_accepted_on_port, to_path, to_thread, unix_socket_conns_accepted
+from .write_tracker import WriteTracker
 
 
 logger = getLogger('instant_mongo')
 
+# Maximum length of a Unix domain socket path (sun_path is 104 bytes on macOS
+# and 108 bytes on Linux, including the terminating NUL byte)
+max_unix_socket_path_length = 103
+
+# How mongod is stopped:
+# - graceful: the shutdown command
+# - terminate: SIGTERM (mongod shuts down cleanly as well)
+# - kill: SIGKILL - fastest, for data that is thrown away anyway
+# If mongod doesn't exit within shutdown_timeout seconds, it is killed.
+shutdown_strategies = ('graceful', 'terminate', 'kill')
+
+# phases of InstantMongoDB start and stop recorded in im.timings
+start_phases = ('prepare_data_dir', 'allocate_port', 'spawn', 'wait_for_conns', 'init_rs')
+stop_phases = ('close_client', 'stop_mongod', 'delete_data_dir')
+
+
+class ClientMixin:
+    '''
+    Cached pymongo.MongoClient and test database helpers shared by InstantMongoDB
+    and InstantMongoCluster. The class using it provides `mongo_uri` and initializes
+    `_client` (None) and `_client_lock` (threading.RLock).
+    '''
+
+    @property
+    def client(self) -> MongoClient:
+        '''
+        Returns a pymongo.MongoClient instance connected to the MongoDB server.
+
+        The instance will also be cached and returned again on subsequent calls.
+        '''
+        if not self._client:
+            with self._client_lock:
+                if not self._client:
+                    self._client = self.get_client(connect=True)
+        return self._client
+
+    def close_client(self):
+        '''
+        Closes the cached pymongo.MongoClient instance (if any).
+
+        The instance will be recreated on next access to `im.client`.
+
+        This method is intended to be used when you need to close the client
+        after each test to make sure you have no leftover threads running
+        (e.g. for fork safety).
+        '''
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def get_client(self, **kwargs) -> MongoClient:
+        '''
+        Returns a pymongo.MongoClient instance connected to the MongoDB server.
+
+        The instance will not be cached and will be created anew on each call.
+        '''
+        return MongoClient(self.mongo_uri, **self._client_kwargs(kwargs))
+
+    def _client_kwargs(self, kwargs):
+        return kwargs
+
+    @property
+    def db(self) -> Database:
+        '''
+        Returns a pymongo.Database instance connected to the MongoDB server working on the 'test' database.
+
+        The Database instance comes from the cached MongoClient instance.
+        '''
+        return self.client['test']
+
+    def get_new_test_db(self) -> Database:
+        '''
+        Returns a pymongo.Database instance connected to the MongoDB server.
+        Database name will be randomly generated.
+        '''
+        # If you have many tests and you create a new database for each test, don't forget
+        # to drop them after the test - MongoDB might run out of space or open file handles.
+        # You can use the drop_everything() method.
+        return self.client[f'test_{time_ns()}']
+
+    @contextmanager
+    def _maintenance_client(self):
+        '''
+        Yields the cached client if there is one, otherwise a temporary client.
+        '''
+        with ExitStack() as stack:
+            yield self._client or stack.enter_context(self.get_client(connect=True))
+
+    def drop_everything(self, strategy='drop'):
+        '''
+        Drops all databases and collections (with strategy='truncate' the collections are only emptied).
+        '''
+        if strategy not in ('drop', 'truncate'):
+            raise ValueError(f'Unknown strategy: {strategy!r}')
+        with self._maintenance_client() as client:
+            if strategy == 'truncate':
+                empty_all_dbs(client)
+            else:
+                drop_all_dbs(client)
+
 
-class InstantMongoDB:
+class InstantMongoDB(ClientMixin):
     '''
     Usage:
 
@@ -37,24 +165,73 @@ class InstantMongoDB:
     Available attributes and methods:
 
     - im.mongo_uri is 'mongodb://127.0.0.1:{port}'
+      (with unix_socket=True 'mongodb://{percent-encoded socket path}')
     - im.client is pymongo.MongoClient(im.mongodb_uri)
+    - im.async_client is pymongo.AsyncMongoClient(im.mongo_uri), one per event loop
     - im.db is im.client['test']
     - im.drop_everything() drops all databases and collections; intended for tests
+    - im.slow_ops is a list of slow operations reported in the mongod log
+    - im.timings is a dict {phase: duration in seconds} of the last start() and stop()
+    - im.stop(wait=False) stops MongoDB in the background, im.wait_stopped() waits for it
+
+    The instance can be used in processes forked from the process that started it:
+    the child gets its own im.client (created on first access) and stop() called
+    in the child doesn't stop MongoDB.
     '''
 
     wait_timeout = 10
 
+    replica_set_settings = default_replica_set_settings
+
+    # Callables called as hook(im, phase, seconds) after each timed phase of start
+    # and stop of any instance - e.g. for collecting startup cost across CI runs.
+    timing_hooks = []
+
+    # how often (in seconds) reap_orphans=True looks for orphaned data dirs
+    reap_interval = default_reap_interval
+
     def __init__(
             self, data_parent_dir=None, *, data_dir=None, port=None,
             as_replica_set=False, delete_data_dir_on_exit=None,
-            follow_logs=False, mongod_bin='mongod'):
+            follow_logs=False, mongod_bin='mongod',
+            use_data_template=False, data_template_dir=None,
+            mongod_profile='default', extra_args=None,
+            replica_set_members=1, replica_set_arbiters=0, replica_set_hidden=0,
+            slow_ms=None, plan_guard=None, timing_hook=None, unix_socket=False,
+            shutdown_strategy='terminate', shutdown_timeout=30, reap_orphans=False,
+            track_writes=False):
+        if replica_set_members < 1 or replica_set_arbiters < 0 or not 0 <= replica_set_hidden < replica_set_members:
+            raise ValueError('Replica set needs at least one member that is not hidden')
+        if unix_socket and replica_set_members + replica_set_arbiters > 1:
+            raise ValueError('unix_socket cannot be used with multi-member replica set')
+        if shutdown_strategy not in shutdown_strategies:
+            raise ValueError(f'Unknown shutdown_strategy: {shutdown_strategy!r}')
         self.logger = logger
         self.port: Optional[int] = port
-        self.as_replica_set = as_replica_set
+        self.replica_set_members = replica_set_members
+        self.replica_set_arbiters = replica_set_arbiters
+        self.replica_set_hidden = replica_set_hidden
+        self.as_replica_set = as_replica_set or self._is_multi_member_rs
         self.delete_data_dir_on_exit = delete_data_dir_on_exit
         self.follow_logs = follow_logs
         self.mongod_bin = mongod_bin
+        self.use_data_template = use_data_template
+        self.data_template_dir = to_path(data_template_dir) if data_template_dir else None
+        self.mongod_profile = get_mongod_profile(mongod_profile)
+        self.extra_args = list(extra_args or [])
+        self.slow_ms = slow_ms
+        self._slow_ops = SlowOpsBuffer()
+        self.plan_guard = plan_guard_from_option(plan_guard)
+        self.timing_hook = timing_hook
+        self.timings = {}
+        self.unix_socket = unix_socket
+        self.unix_socket_path = None
+        self.shutdown_strategy = shutdown_strategy
+        self.shutdown_timeout = shutdown_timeout
+        self.reap_orphans = reap_orphans
+        self.write_tracker = WriteTracker() if track_writes else None
         self._exit_stack = None
+        self._stop_thread = None
         # figure out self.data_dir
         if data_dir:
             self.data_dir = to_path(data_dir)
@@ -64,25 +241,107 @@ class InstantMongoDB:
                 self.delete_data_dir_on_exit = True
         else:
             self.data_dir = None  # will be created later
+        self._reaper_roots = default_roots() + ([to_path(data_parent_dir)] if data_parent_dir else [])
 
         self._mongodb_process = None
+        self._rs_members = []
         self._client: Optional[MongoClient] = None
+        self._client_lock = RLock()
+        self._async_clients = {}  # event loop -> AsyncMongoClient
+        self.db_pool = self._new_db_pool()
+        self._owner_pid = None  # PID of the process that started MongoDB
+        self._temp_dirs = []
+        _instances.add(self)
 
     @property
     def mongo_uri(self) -> str:
         if self._mongodb_process is None:
             raise RuntimeError('MongoDB process is not running')
+        if self._is_multi_member_rs:
+            hosts = ','.join(m.host for m in self._rs_members if not m.arbiter and not m.hidden)
+            return f'mongodb://{hosts}/?replicaSet={replica_set_name}'
+        if self.unix_socket:
+            uri = 'mongodb://' + quote(str(self.unix_socket_path), safe='')
+            # don't let the client discover the replica set member by its TCP address
+            return uri + '/?directConnection=true' if self.as_replica_set else uri
         return f'mongodb://127.0.0.1:{self.port}'
 
+    @property
+    def _is_multi_member_rs(self):
+        return self.replica_set_members + self.replica_set_arbiters > 1
+
     def _generate_data_dir_name(self):
         return f'instant-mongo-data.{getpid()}.{time_ns()}'
 
+    @property
+    def mongod_cmd(self):
+        '''
+        Command line (list of arguments) the mongod process was started with.
+        '''
+        if self._mongodb_process is None:
+            raise RuntimeError('MongoDB process is not running')
+        return self._mongodb_process.cmd
+
     def _prepare_data_dir(self):
         if self.data_dir is None:
-            temp_dir = self._exit_stack.enter_context(TemporaryDirectory(prefix=f'instant-mongo.{getpid()}.'))
-            self.data_dir = Path(temp_dir) / self._generate_data_dir_name()
+            temp_parent_dir = shm_dir() if self.mongod_profile.prefer_shm else None
+            temp_dir = self._enter_temp_dir(prefix=f'instant-mongo.{getpid()}.', dir=temp_parent_dir)
+            self.data_dir = temp_dir / self._generate_data_dir_name()
         assert isinstance(self.data_dir, Path)
-        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._populate_data_dir(self.data_dir)
+        if self.unix_socket:
+            self.unix_socket_path = self._prepare_unix_socket_dir() / 'mongod.sock'
+
+    def _prepare_unix_socket_dir(self):
+        '''
+        The socket is created in the data dir, unless the path would be too long
+        for a Unix domain socket - then a short temporary directory is used.
+        mongod creates also its default socket mongodb-{port}.sock there
+        (see --unixSocketPrefix), so that one must fit as well.
+        The temporary directory is named like the other ones, so that the reaper finds it.
+        '''
+        socket_dir = self.data_dir.resolve()
+        if len(bytes(socket_dir / 'mongodb-65535.sock')) > max_unix_socket_path_length:
+            socket_dir = self._enter_temp_dir(prefix=f'instant-mongo.{getpid()}.', dir='/tmp' if Path('/tmp').is_dir() else None)
+        return socket_dir
+
+    def _enter_temp_dir(self, **kwargs):
+        '''
+        Creates a temporary directory deleted when MongoDB is stopped.
+        '''
+        temp_dir = TemporaryDirectory(**kwargs)
+        # kept to prevent forked processes from deleting it, see _after_fork_in_child()
+        self._temp_dirs.append(temp_dir)
+        return Path(self._exit_stack.enter_context(temp_dir))
+
+    def _populate_data_dir(self, data_dir):
+        data_dir.mkdir(parents=True, exist_ok=True)
+        if self.use_data_template and not any(data_dir.iterdir()):
+            self._clone_data_template(data_dir)
+
+    def _clone_data_template(self, data_dir):
+        '''
+        Populate the (empty) data dir from a cached, already initialized data dir,
+        so that mongod doesn't have to create its storage and catalogs from scratch.
+        '''
+        template_root = self.data_template_dir or default_data_template_dir()
+        storage_args = MongoDBProcess.storage_args + self.mongod_profile.storage_args + self.extra_args
+        key = data_template_key(get_mongod_version(self.mongod_bin), storage_args)
+        template_path = ensure_data_template(template_root, key, self._init_data_template)
+        clone_data_dir(template_path, data_dir)
+
+    def _init_data_template(self, path):
+        # Replica set is not initiated in the template - the replica set config
+        # contains host and port, so it cannot be shared between instances.
+        # A standalone-initialized data dir can be started with --replSet later.
+        im = InstantMongoDB(
+            data_dir=path,
+            delete_data_dir_on_exit=False,
+            mongod_bin=self.mongod_bin,
+            mongod_profile=self.mongod_profile,
+            extra_args=self.extra_args)
+        im.start()
+        im.stop()
 
     def __enter__(self):
         self.start()
@@ -91,61 +350,343 @@ class InstantMongoDB:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop()
 
+    async def __aenter__(self):
+        await self.astart()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.astop()
+
     def start(self):
+        start_ns = monotonic_ns()
+        self._spawn()
+        try:
+            with self._timed('wait_for_conns'):
+                self._wait_for_accepting_conns()
+            self._client = None
+            if self.as_replica_set:
+                with self._timed('init_rs'):
+                    self._init_rs()
+        except BaseException:
+            self._abort_start()
+            raise
+        self._record_timing('start', monotonic_ns() - start_ns)
+        self._log_timings('start')
+
+    def _spawn(self, port_guard=None):
+        '''
+        Prepares the data dir and launches mongod, without waiting for it to be ready.
+        '''
         self._patch_pymongo_min_heartbeat_interval()
+        self.wait_stopped()
+        self._reap_orphans()
         assert self._exit_stack is None
         self._exit_stack = ExitStack()
+        self._owner_pid = getpid()
+        self._temp_dirs = []
+        self._slow_ops = SlowOpsBuffer()
+        self.timings = {}
         try:
-            self._prepare_data_dir()
-            if not self.port:
-                port_guard = self._exit_stack.enter_context(PortGuard())
-                self.port = port_guard.get_available_port()
-            self._mongodb_process = MongoDBProcess(
-                logger=self.logger,
-                data_dir=self.data_dir,
-                port=self.port,
-                as_replica_set=self.as_replica_set,
-                follow_logs=self.follow_logs,
-                mongod_bin=self.mongod_bin)
-            self._exit_stack.callback(self._mongodb_process.stop)
-            self._mongodb_process.start()
-            self._wait_for_accepting_tcp_conns()
+            with self._timed('prepare_data_dir'):
+                self._prepare_data_dir()
+            with self._timed('allocate_port'):
+                if port_guard is None and self._needs_port_guard:
+                    port_guard = self._exit_stack.enter_context(PortGuard())
+                self._mongodb_process = self._create_mongodb_process(port_guard)
+            with self._timed('spawn'):
+                self._exit_stack.callback(self._mongodb_process.stop)
+                self._mongodb_process.start()
+                self._spawn_rs_members(port_guard)
+        except BaseException:
+            self._abort_start()
+            raise
+
+    def _reap_orphans(self):
+        '''
+        Cleans up data dirs and mongod processes left behind by processes that are gone,
+        see instant_mongo.reaper. Runs at most once per reap_interval seconds.
+        '''
+        if not self.reap_orphans:
+            return
+        try:
+            reap_orphans_throttled(self._reaper_roots, interval=self.reap_interval)
+        except Exception as e:
+            logger.exception('Failed to reap orphaned data dirs: %r', e)
+
+    def _abort_start(self):
+        self._exit_stack.close()
+        self._exit_stack = None
+        self._mongodb_process = None
+        self._rs_members = []
+
+    def _spawn_rs_members(self, port_guard):
+        '''
+        Launches the other members of a multi-member replica set (without waiting
+        for them to be ready). The mongod process of this instance is member 0.
+        '''
+        self._rs_members = [ReplicaSetMember(0, self.port, self.data_dir, process=self._mongodb_process)]
+        for index in range(1, self.replica_set_members + self.replica_set_arbiters):
+            self._rs_members.append(ReplicaSetMember(
+                index, port_guard.get_available_port(), self._member_data_dir(index),
+                arbiter=index >= self.replica_set_members,
+                hidden=self.replica_set_members - self.replica_set_hidden <= index < self.replica_set_members))
+        if self.delete_data_dir_on_exit:
+            # deleted after the members are stopped (exit stack callbacks run in reverse order)
+            for member in self._rs_members[1:]:
+                self._exit_stack.callback(rmtree, member.data_dir, ignore_errors=True)
+        # stop() resets self._rs_members before the exit stack is closed
+        self._exit_stack.callback(self._stop_rs_members, self._rs_members)
+        for member in self._rs_members[1:]:
+            self._populate_data_dir(member.data_dir)
+            member.process = self._new_mongodb_process(member.data_dir, member.port)
+            member.process.start()
+
+    def _member_data_dir(self, index):
+        '''
+        Data dirs of the other replica set members are next to the data dir of member 0
+        (not inside it - mongod would treat them as databases with directoryPerDB).
+        '''
+        return self.data_dir.with_name(f'{self.data_dir.name}.member.{index}')
+
+    @staticmethod
+    def _stop_rs_members(members):
+        # a process started by astart() is stopped by astop() before this is called
+        stop_processes([m.process for m in members if m.process is not None and not m.process.started_async])
+
+    @classmethod
+    def start_many(cls, count, **kwargs):
+        '''
+        Starts `count` instances in parallel and returns them as a list.
+
+        Ports for all instances are allocated using one PortGuard, all mongod
+        processes are launched at once and then awaited together, so the whole
+        startup takes about as long as the slowest single start. If any instance
+        fails to start, all of them are stopped. Keyword arguments are passed
+        to the InstantMongoDB constructor.
+
+        Stop the returned instances using stop().
+        '''
+        if kwargs.get('data_dir') or kwargs.get('port'):
+            raise ValueError('data_dir and port cannot be used with start_many() - each instance needs its own')
+        instances = [cls(**kwargs) for _ in range(count)]
+        start_ns = monotonic_ns()
+        with ExitStack() as cleanup:
+            with PortGuard() as port_guard:
+                for im in instances:
+                    im._spawn(port_guard)
+                    cleanup.callback(im.stop)
+                for im in instances:
+                    with im._timed('wait_for_conns'):
+                        im._wait_for_accepting_conns()
+                    im._client = None
+            if any(im.as_replica_set for im in instances):
+                with ThreadPoolExecutor(max_workers=count) as executor:
+                    for future in [executor.submit(im._init_rs) for im in instances]:
+                        future.result()
+            # all started - keep them running
+            cleanup.pop_all()
+        for im in instances:
+            im._record_timing('start', monotonic_ns() - start_ns)
+            im._log_timings('start')
+        return instances
+
+    async def astart(self):
+        '''
+        Starts MongoDB without blocking the asyncio event loop.
+
+        mongod is spawned using asyncio.create_subprocess_exec(), readiness is awaited
+        using event loop readers and the replica set is initialized via AsyncMongoClient
+        (in a thread with pymongo < 4.9 that doesn't have it). Use astop() to stop it.
+        '''
+        self._patch_pymongo_min_heartbeat_interval()
+        await to_thread(self.wait_stopped)
+        await to_thread(self._reap_orphans)
+        assert self._exit_stack is None
+        self._exit_stack = ExitStack()
+        self._owner_pid = getpid()
+        self._temp_dirs = []
+        self._slow_ops = SlowOpsBuffer()
+        self.timings = {}
+        start_ns = monotonic_ns()
+        try:
+            with self._timed('prepare_data_dir'):
+                await to_thread(self._prepare_data_dir)
+            with self._timed('allocate_port'):
+                port_guard = None
+                if self._needs_port_guard:
+                    port_guard = self._exit_stack.enter_context(PortGuard())
+                self._mongodb_process = self._create_mongodb_process(port_guard)
+            with self._timed('spawn'):
+                await self._mongodb_process.astart()
+                await to_thread(self._spawn_rs_members, port_guard)
+            with self._timed('wait_for_conns'):
+                await self._async_wait_for_accepting_conns()
             self._client = None
-            self._init_rs()
+            if self.as_replica_set:
+                with self._timed('init_rs'):
+                    await self._async_init_rs()
         except BaseException:
-            self._exit_stack.close()
+            if self._mongodb_process is not None:
+                await self._mongodb_process.astop()
+                self._mongodb_process = None
+            await to_thread(self._exit_stack.close)
             self._exit_stack = None
-            self._mongodb_process = None
+            self._rs_members = []
             raise
+        self._record_timing('start', monotonic_ns() - start_ns)
+        self._log_timings('start')
+
+    @property
+    def _needs_tcp_port(self):
+        # With unix_socket the TCP port is optional - but a replica set member
+        # is identified by host:port in the replica set config.
+        return not self.unix_socket or self.as_replica_set
+
+    @property
+    def _needs_port_guard(self):
+        return self._is_multi_member_rs or (not self.port and self._needs_tcp_port)
+
+    def _create_mongodb_process(self, port_guard=None):
+        if not self.port and self._needs_tcp_port:
+            if port_guard is None:
+                port_guard = self._exit_stack.enter_context(PortGuard())
+            self.port = port_guard.get_available_port()
+        return self._new_mongodb_process(self.data_dir, self.port, unix_socket_path=self.unix_socket_path)
+
+    def _new_mongodb_process(self, data_dir, port, unix_socket_path=None):
+        return MongoDBProcess(
+            logger=self.logger,
+            data_dir=data_dir,
+            port=port,
+            unix_socket_path=unix_socket_path,
+            as_replica_set=self.as_replica_set,
+            shutdown_strategy=self.shutdown_strategy,
+            shutdown_timeout=self.shutdown_timeout,
+            follow_logs=self.follow_logs,
+            mongod_bin=self.mongod_bin,
+            mongod_profile=self.mongod_profile,
+            extra_args=self._mongod_extra_args)
+
+    @property
+    def _mongod_extra_args(self):
+        # slowms doesn't affect the data files, so it's not part of the data template key
+        if self.slow_ms is None:
+            return self.extra_args
+        return ['--slowms', str(self.slow_ms)] + self.extra_args
+
+    def _wait_for_accepting_conns(self):
+        wait_until_accepting_conns(self._mongodb_process, self.wait_timeout)
+        for member in self._rs_members[1:]:
+            wait_until_accepting_conns(member.process, self.wait_timeout)
 
-    def _wait_for_accepting_tcp_conns(self):
-        deadline = monotonic_ns() + self.wait_timeout * 1_000_000_000
-        while True:
-            if not self._mongodb_process.is_alive():
-                raise Exception('MongoDB process exited before it started to accept connections')
-            if tcp_conns_accepted_on_port(self.port):
-                return
-            if monotonic_ns() > deadline:
+    async def _async_wait_for_accepting_conns(self):
+        for process in [self._mongodb_process] + [m.process for m in self._rs_members[1:]]:
+            try:
+                ready = await process.async_wait_until_ready(
+                    self.wait_timeout,
+                    check_ready=process.accepts_connections)
+            except TimeoutError:
                 raise TimeoutError(
-                    f'MongoDB did not start accepting connections within {self.wait_timeout}s')
-            sleep(.01)
+                    f'MongoDB did not start accepting connections within {self.wait_timeout}s') from None
+            if not ready:
+                raise start_failed_exception(process)
 
     def _init_rs(self):
         if not self.as_replica_set:
             return
+        if self._is_multi_member_rs:
+            config = replica_set_config(self._rs_members, self.replica_set_settings)
+            with self._member_client(self._rs_members[0]) as client:
+                client.admin.command('replSetInitiate', config)
+            self.wait_for_primary()
+            return
+        listener = PrimaryElectedListener()
         # Initialize the replica set. We need directConnection=True to connect as a standalone client.
-        with self.get_client(directConnection=True) as client:
+        with self.get_client(**monitoring_client_kwargs(listener)) as client:
             client.admin.command('replSetInitiate')
             # Wait for the primary to be elected.
-            deadline = monotonic_ns() + self.wait_timeout * 1_000_000_000
-            while True:
-                status = client.admin.command('replSetGetStatus')
-                if status['myState'] == 1:
-                    break
-                if monotonic_ns() > deadline:
-                    raise TimeoutError(
-                        f'Replica set primary not elected within {self.wait_timeout}s')
-                sleep(.01)
+            if not listener.wait(self.wait_timeout):
+                raise TimeoutError(
+                    f'Replica set primary not elected within {self.wait_timeout}s')
+
+    async def _async_init_rs(self):
+        if not self.as_replica_set:
+            return
+        if self._is_multi_member_rs or AsyncMongoClient is None:
+            # AsyncMongoClient is not available in pymongo < 4.9
+            await to_thread(self._init_rs)
+            return
+        listener = PrimaryElectedListener()
+        client = self.get_async_client(**monitoring_client_kwargs(listener))
+        try:
+            await client.admin.command('replSetInitiate')
+            if not await listener.async_wait(self.wait_timeout):
+                raise TimeoutError(
+                    f'Replica set primary not elected within {self.wait_timeout}s')
+        finally:
+            await client.close()
+
+    def _member_client(self, member, **kwargs):
+        kwargs.setdefault('directConnection', True)
+        return MongoClient(f'mongodb://{member.host}', **kwargs)
+
+    def wait_for_primary(self, timeout=None):
+        '''
+        Waits until the running replica set members agree on a primary - one of them
+        is primary and the others are secondaries or arbiters - and returns index
+        of the primary member.
+        '''
+        if not self.as_replica_set:
+            raise RuntimeError('MongoDB is not running as a replica set')
+        timeout = self.wait_timeout if timeout is None else timeout
+        members = [m for m in self._rs_members if m.is_alive]
+        listener = PrimaryElectedListener(members={m.address: m.arbiter for m in members})
+        with ExitStack() as stack:
+            # one direct connection per member - a replica set client wouldn't monitor hidden members
+            for member in members:
+                stack.enter_context(self._member_client(member, **monitoring_client_kwargs(listener)))
+            if not listener.wait(timeout):
+                raise TimeoutError(f'Replica set primary not elected within {timeout}s')
+        return next(m.index for m in members if m.address == listener.primary)
+
+    def step_down(self, seconds=60):
+        '''
+        Makes the current primary step down (it cannot be elected again for `seconds`)
+        and waits until another member is elected; returns index of the new primary member.
+        '''
+        primary = self._rs_members[self.wait_for_primary()]
+        with self._member_client(primary) as client:
+            try:
+                client.admin.command('replSetStepDown', seconds)
+            except ConnectionFailure:
+                # MongoDB < 4.2 closes all connections when stepping down
+                pass
+        return self.wait_for_primary()
+
+    def kill_member(self, index):
+        '''
+        Kills mongod of the replica set member with SIGKILL, simulating a crash.
+        Use wait_for_primary() to wait for the failover and start_member() to start it again.
+        '''
+        self._rs_members[index].process.kill()
+
+    def start_member(self, index):
+        '''
+        Starts again a replica set member stopped by kill_member() and waits until
+        it accepts connections.
+        '''
+        member = self._rs_members[index]
+        if member.is_alive:
+            raise RuntimeError(f'Replica set member {index} is already running')
+        # the log file is overwritten by the new process
+        self._save_slow_ops()
+        self._slow_ops.forget(member.process.stdout_path)
+        member.process = self._new_mongodb_process(
+            member.data_dir, member.port, unix_socket_path=self.unix_socket_path if index == 0 else None)
+        if index == 0:
+            self._mongodb_process = member.process
+        member.process.start()
+        wait_until_accepting_conns(member.process, self.wait_timeout)
 
     @staticmethod
     def _patch_pymongo_min_heartbeat_interval():
@@ -155,55 +696,248 @@ class InstantMongoDB:
         if getattr(pymongo.common, 'MIN_HEARTBEAT_INTERVAL', None) == 0.5:
             pymongo.common.MIN_HEARTBEAT_INTERVAL = 0.02
 
-    def stop(self):
+    def stop(self, wait=True):
+        '''
+        Stops MongoDB and deletes the data dir (if delete_data_dir_on_exit).
+
+        With wait=False the mongod processes are only told to shut down (see shutdown_strategy)
+        and the method returns immediately - waiting for them to exit and deleting the data dir
+        happens in a background thread. Use wait_stopped() to wait for it; start() waits for it
+        as well.
+        '''
+        if self._is_forked_copy:
+            self._forget_forked_copy()
+            return
+        if self._mongodb_process is not None and self._mongodb_process.started_async:
+            raise RuntimeError('MongoDB was started using astart(), use astop() to stop it')
+        self.wait_stopped()
+        stop_ns = monotonic_ns()
+        running = self._exit_stack is not None
+        self._save_slow_ops()
+        self._close_clients()
+        self._forget_server_state()
+        exit_stack, self._exit_stack = self._exit_stack, None
+        processes = [m.process for m in self._rs_members if m.process is not None]
+        self._mongodb_process = None
+        self._rs_members = []
+        data_dir = None
+        if self.delete_data_dir_on_exit and self.data_dir is not None:
+            data_dir, self.data_dir = self.data_dir, None
+
+        def finish():
+            if exit_stack is not None:
+                with self._timed('stop_mongod'):
+                    exit_stack.close()
+            if data_dir is not None:
+                # Pytest doesn't delete tmp dirs immediately. So after a few runs
+                # a smaller /tmp filesystem could be easily filled up.
+                # So we delete the data dir explicitly.
+                with self._timed('delete_data_dir'):
+                    rmtree(data_dir, ignore_errors=True)
+            if running:
+                self._record_timing('stop', monotonic_ns() - stop_ns)
+                self._log_timings('stop')
+
+        if wait:
+            finish()
+            return
+        for process in processes:
+            process.request_stop()
+        self._stop_thread = Thread(target=self._run_background_stop, args=(finish,), name='instant_mongo_stop')
+        self._stop_thread.start()
+
+    def _forget_server_state(self):
+        self.db_pool.clear()
+        if self.write_tracker is not None:
+            self.write_tracker.checkpoint()
+
+    def _close_clients(self):
         if self._client is not None:
             logger.debug('Calling self._client.close() pid=%d', getpid())
-            self._client.close()
+            with self._timed('close_client'):
+                self._client.close()
             logger.debug('Done self._client.close()')
             self._client = None
-        if self._exit_stack is not None:
-            self._exit_stack.close()
-            self._exit_stack = None
+        self._close_async_clients()
+
+    @staticmethod
+    def _run_background_stop(finish):
+        try:
+            finish()
+        except Exception as e:
+            logger.exception('Failed to stop MongoDB in the background: %r', e)
+
+    def wait_stopped(self, timeout=None):
+        '''
+        Waits until the background stop started by stop(wait=False) finishes.
+        Returns False if it is still running after `timeout` seconds.
+        '''
+        if self._stop_thread is None:
+            return True
+        self._stop_thread.join(timeout)
+        if self._stop_thread.is_alive():
+            return False
+        self._stop_thread = None
+        return True
+
+    @staticmethod
+    def stop_many(instances):
+        '''
+        Stops the instances in parallel and waits until all of them are stopped.
+        '''
+        instances = list(instances)
+        if not instances:
+            return
+        with ThreadPoolExecutor(max_workers=len(instances)) as executor:
+            for _ in executor.map(lambda im: im.stop(), instances):
+                pass
+
+    async def astop(self):
+        '''
+        Stops MongoDB without blocking the asyncio event loop; blocking cleanup
+        (closing the cached client, deleting the data dir) runs in a thread.
+        '''
+        if self._is_forked_copy:
+            self._forget_forked_copy()
+            return
+        await to_thread(self.wait_stopped)
+        stop_ns = monotonic_ns()
+        running = self._exit_stack is not None
+        if self.slow_ms is not None:
+            await to_thread(self._save_slow_ops)
+        if self._client is not None:
+            with self._timed('close_client'):
+                await to_thread(self._client.close)
+            self._client = None
+        await self.close_async_client()
+        self._close_async_clients()
+        self._forget_server_state()
+        with self._timed('stop_mongod'):
+            if self._mongodb_process is not None:
+                await self._mongodb_process.astop()
+            if self._exit_stack is not None:
+                await to_thread(self._exit_stack.close)
+                self._exit_stack = None
         self._mongodb_process = None
+        self._rs_members = []
         if self.delete_data_dir_on_exit and self.data_dir is not None:
-            # Pytest doesn't delete tmp dirs immediately. So after a few runs
-            # a smaller /tmp filesystem could be easily filled up.
-            # So we delete the data dir explicitly.
-            rmtree(self.data_dir, ignore_errors=True)
+            with self._timed('delete_data_dir'):
+                await to_thread(rmtree, self.data_dir, ignore_errors=True)
             self.data_dir = None
+        if running:
+            self._record_timing('stop', monotonic_ns() - stop_ns)
+            self._log_timings('stop')
 
     @property
-    def client(self) -> MongoClient:
-        '''
-        Returns a pymongo.MongoClient instance connected to the MongoDB server.
+    def _is_forked_copy(self):
+        return self._owner_pid is not None and self._owner_pid != getpid()
 
-        The instance will also be cached and returned again on subsequent calls.
+    def _forget_forked_copy(self):
         '''
-        if not self._client:
-            self._client = self.get_client(connect=True)
-        return self._client
-
-    def close_client(self):
+        Called by stop() in a forked process - MongoDB belongs to the parent process,
+        so it is left running and its data dir is kept.
         '''
-        Closes the cached pymongo.MongoClient instance (if any).
+        logger.debug('Not stopping MongoDB started by process %s', self._owner_pid)
+        self._after_fork_in_child()
+        self._exit_stack = None
+        self._mongodb_process = None
+        self._rs_members = []
+        self._owner_pid = None
+        self._temp_dirs = []
+        self.data_dir = None
 
-        The instance will be recreated on next access to `im.client`.
+    def _before_fork(self):
+        # don't fork while another thread is creating the cached client
+        self._client_lock.acquire()
 
-        This method is intended to be used when you need to close the client
-        after each test to make sure you have no leftover threads running
-        (e.g. for fork safety).
-        '''
+    def _after_fork_in_parent(self):
+        self._client_lock.release()
+
+    def _after_fork_in_child(self):
+        self._client_lock = RLock()
+        # The clients share sockets with the parent process, they must not be used
+        # nor closed here (closing would end the server sessions of the parent).
+        # They are kept referenced until the next fork, so that they are not garbage collected either.
         if self._client is not None:
-            self._client.close()
+            _clients_abandoned_at_fork.append(self._client)
             self._client = None
+        _clients_abandoned_at_fork.extend(self._async_clients.values())
+        self._async_clients = {}
+        # databases pooled in the parent process may be leased there at the same time
+        self.db_pool = self._new_db_pool()
+        for temp_dir in self._temp_dirs:
+            # TemporaryDirectory deletes itself at interpreter exit - of the child as well
+            finalizer = getattr(temp_dir, '_finalizer', None)
+            if finalizer is not None:
+                finalizer.detach()
 
-    def get_client(self, **kwargs) -> MongoClient:
+    @contextmanager
+    def _timed(self, phase):
+        start_ns = monotonic_ns()
+        try:
+            yield
+        finally:
+            self._record_timing(phase, monotonic_ns() - start_ns)
+
+    def _record_timing(self, phase, duration_ns):
+        seconds = duration_ns / 1e9
+        self.timings[phase] = seconds
+        hooks = self.timing_hooks + ([self.timing_hook] if self.timing_hook else [])
+        for hook in hooks:
+            try:
+                hook(self, phase, seconds)
+            except Exception as e:
+                logger.exception('Timing hook %r failed: %r', hook, e)
+
+    def _log_timings(self, total_phase):
+        phases = start_phases if total_phase == 'start' else stop_phases
+        logger.debug(
+            'MongoDB %s took %.3f s (%s)', total_phase, self.timings[total_phase],
+            ', '.join(f'{phase} {self.timings[phase]:.3f} s' for phase in phases if phase in self.timings))
+
+    def _client_kwargs(self, kwargs):
+        if self.write_tracker is None:
+            return kwargs
+        return dict(kwargs, event_listeners=list(kwargs.get('event_listeners') or []) + [self.write_tracker])
+
+    @property
+    def async_client(self) -> AsyncMongoClient:
         '''
-        Returns a pymongo.MongoClient instance connected to the MongoDB server.
+        Returns a pymongo.AsyncMongoClient instance connected to the MongoDB server.
 
-        The instance will not be cached and will be created anew on each call.
+        The instance is cached per event loop - every event loop (e.g. every test
+        with pytest-asyncio function scoped loops) gets its own client, so it can
+        be used from anywhere within the loop. Must be accessed from a running event loop.
+
+        The client of the running loop is closed by astop() or close_async_client().
+        Clients of loops that are still running are closed (on their loop) by stop().
+        Clients of loops that are not running anymore cannot be closed - they are
+        just dropped and released when their loop is garbage collected.
+        '''
+        loop = get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            # the client references its loop, so clients of closed loops have to be dropped explicitly
+            self._async_clients = {lp: c for lp, c in self._async_clients.items() if not lp.is_closed()}
+            client = self.get_async_client()
+            self._async_clients[loop] = client
+        return client
+
+    async def close_async_client(self):
+        '''
+        Closes the cached pymongo.AsyncMongoClient instance of the running event loop (if any).
         '''
-        return MongoClient(self.mongo_uri, **kwargs)
+        client = self._async_clients.pop(get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def _close_async_clients(self):
+        # A client can be closed only on its own loop - the close is scheduled on loops
+        # that are running; clients of other loops are dropped with the loop.
+        for loop, client in list(self._async_clients.items()):
+            if loop.is_running():
+                run_coroutine_threadsafe(client.close(), loop)
+        self._async_clients.clear()
 
     def get_async_client(self, **kwargs) -> AsyncMongoClient:
         '''
@@ -213,27 +947,34 @@ class InstantMongoDB:
         Can be used as an async context manager.
         '''
         if AsyncMongoClient is None:
-            raise RuntimeError('AsyncMongoClient is not available - pymongo 4.x is required')
-        return AsyncMongoClient(self.mongo_uri, **kwargs)
+            raise RuntimeError('AsyncMongoClient is not available - pymongo 4.9+ is required')
+        return AsyncMongoClient(self.mongo_uri, **self._client_kwargs(kwargs))
 
-    @property
-    def db(self) -> Database:
+    def get_new_test_db(self) -> Database:
         '''
-        Returns a pymongo.Database instance connected to the MongoDB server working on the 'test' database.
+        Returns a pymongo.Database instance connected to the MongoDB server.
+        Database name will be randomly generated.
 
-        The Database instance comes from the cached MongoClient instance.
+        With plan_guard enabled the database profiler is turned on for the database
+        and plans of its queries are checked by im.plan_guard.check().
         '''
-        return self.client['test']
+        db = super().get_new_test_db()
+        if self.plan_guard is not None:
+            self.plan_guard.watch(db)
+        return db
 
-    def get_new_test_db(self) -> Database:
+    def lease_db(self, schema=None):
         '''
-        Returns a pymongo.Database instance connected to the MongoDB server.
-        Database name will be randomly generated.
+        Context manager yielding a database with collections and indexes given by `schema`
+        ({collection name: list of indexes}, see instant_mongo.db_pool) - reused from im.db_pool
+        if available. At the end of the with-block the database is emptied and returned to the pool
+        instead of being dropped, so the next lease with the same schema doesn't have to create
+        the collections and indexes again.
         '''
-        # If you have many tests and you create a new database for each test, don't forget
-        # to drop them after the test - MongoDB might run out of space or open file handles.
-        # You can use the drop_everything() method.
-        return self.client[f'test_{time_ns()}']
+        return self.db_pool.lease(schema)
+
+    def _new_db_pool(self):
+        return DatabasePool(self.get_new_test_db, lambda name: self.client[name])
 
     @property
     def mongodb_uri(self) -> str:
@@ -244,117 +985,336 @@ class InstantMongoDB:
         warn('mongodb_uri is deprecated, use mongo_uri instead', DeprecationWarning, stacklevel=2)
         return self.mongo_uri
 
-    def drop_everything(self):
+    def drop_everything(self, strategy='drop'):
         '''
         Drops all databases and collections.
 
         Intended to clean up the database after each test.
+
+        With strategy='truncate' the collections are only emptied - their indexes,
+        validators and other options are kept, so tests don't have to create them again.
+        Time series collections are not emptied.
+
+        Snapshots created by snapshot() are kept.
         '''
-        with ExitStack() as stack:
-            client = self._client or stack.enter_context(self.get_client(connect=True))
-            drop_all_dbs(client)
+        super().drop_everything(strategy)
+        if strategy == 'drop':
+            self.db_pool.clear()
+        if self.write_tracker is not None:
+            self.write_tracker.checkpoint()
+
+    @property
+    def dirty_collections(self):
+        '''
+        Sorted list of (db name, collection name) of collections that were written to or created
+        since start, since the last cleanup_dirty(), drop_everything() or clear_dirty_collections() call.
+        Requires track_writes=True; only writes made through im.client, get_client() and
+        get_async_client() clients are seen.
+        '''
+        return self._get_write_tracker().dirty
+
+    def clear_dirty_collections(self):
+        '''
+        Forgets the collections written to so far (a checkpoint) and returns them.
+        '''
+        return self._get_write_tracker().checkpoint()
+
+    def cleanup_dirty(self, strategy='drop'):
+        '''
+        Like drop_everything(), but only for the collections written to since the last checkpoint
+        (see dirty_collections), so the cost doesn't depend on the number of databases.
+        With strategy='truncate' the collections are only emptied.
+
+        Databases of im.db_pool whose collections were dropped are rebuilt before they are leased again.
+        '''
+        if strategy not in ('drop', 'truncate'):
+            raise ValueError(f'Unknown strategy: {strategy!r}')
+        dirty = self._get_write_tracker().checkpoint()
+        # the client is not registered with the write tracker, so the cleanup itself
+        # doesn't make anything dirty (and writes made meanwhile by other threads are kept)
+        with MongoClient(self.mongo_uri, connect=True) as client:
+            for db_name, coll_name in dirty:
+                if strategy == 'truncate':
+                    empty_collection(client[db_name][coll_name])
+                else:
+                    client[db_name].drop_collection(coll_name)
+        if strategy == 'drop':
+            self.db_pool.invalidate({db_name for db_name, coll_name in dirty})
+
+    def _get_write_tracker(self):
+        if self.write_tracker is None:
+            raise RuntimeError('Write tracking is not enabled - use InstantMongoDB(track_writes=True)')
+        return self.write_tracker
+
+    def snapshot(self, name, db_names=None):
+        '''
+        Captures current state of given databases (default: all databases) server-side,
+        so that it can be brought back later using restore(name).
+
+        Documents are copied by MongoDB itself (using $out), collection options
+        and indexes are recorded as well. Taking a snapshot of the same name again
+        replaces it.
+        '''
+        with self._maintenance_client() as client:
+            create_snapshot(client, name, db_names)
+
+    def restore(self, name):
+        '''
+        Restores databases captured by snapshot(name) - documents, collection options and indexes.
+        Collections created in these databases after the snapshot was taken are dropped.
+        The snapshot can be restored repeatedly.
+        '''
+        with self._maintenance_client() as client:
+            restore_snapshot(client, name)
+
+    def drop_snapshot(self, name):
+        with self._maintenance_client() as client:
+            drop_snapshot(client, name)
+
+    def load_fixtures(self, path, db=None, **kwargs):
+        '''
+        Loads seed data from a fixture file or a directory of fixture files
+        (*.json, *.jsonl, *.bson, mongodump *.metadata.json) into database `db`
+        (name or pymongo.Database, default: im.db). Each file is loaded into
+        a collection named after the file.
+
+        Keyword arguments (batch_size, max_workers, use_cache, cache_dir) are passed
+        to instant_mongo.fixtures.load_fixtures().
+
+        Returns dict {collection name: number of inserted documents}.
+        '''
+        if db is None:
+            db = self.db
+        elif isinstance(db, str):
+            db = self.client[db]
+        return load_fixtures(db, path, **kwargs)
+
+    @property
+    def slow_ops(self):
+        '''
+        List of slow operations (instant_mongo.mongod_log.SlowOp) logged by mongod
+        since start or since the last clear_slow_ops() call. Use slow_ms to set
+        the threshold (mongod default: 100 ms; slow_ms=0 logs every operation).
+        With slow_ms set, the ops stay available after stop() and restart of
+        a replica set member.
+
+        Operations on the admin, config and local databases are not included.
+        Requires mongod 4.4+ (structured JSON log).
+        '''
+        self._refresh_slow_ops()
+        return list(self._slow_ops)
+
+    def clear_slow_ops(self):
+        self._refresh_slow_ops()
+        self._slow_ops.clear()
+
+    def _save_slow_ops(self):
+        '''
+        Reads the rest of the mongod logs before they are deleted or overwritten, so that
+        slow ops logged until then stay available. Only with slow_ms set - otherwise
+        stop() would read the whole log just in case.
+        '''
+        if self.slow_ms is not None:
+            self._refresh_slow_ops()
+
+    def _refresh_slow_ops(self):
+        self._slow_ops.refresh([m.process.stdout_path for m in self._rs_members if m.process is not None])
+
+
+def wait_until_accepting_conns(process, timeout):
+    try:
+        ready = process.wait_until_ready(
+            timeout,
+            check_ready=process.accepts_connections)
+    except TimeoutError:
+        raise TimeoutError(
+            f'MongoDB did not start accepting connections within {timeout}s') from None
+    if not ready:
+        raise start_failed_exception(process)
+
+
+def stop_processes(processes):
+    '''
+    Stops the (mongod) processes in parallel - a replica set member may take a while to shut down.
+    '''
+    if len(processes) > 1:
+        with ThreadPoolExecutor(max_workers=len(processes)) as executor:
+            for _ in executor.map(lambda p: p.stop(), processes):
+                pass
+    elif processes:
+        processes[0].stop()
+
+
+# Instances that need to be notified about fork() - see InstantMongoDB._after_fork_in_child()
+_instances = WeakSet()
+_forking_instances = []
+_clients_abandoned_at_fork = []
+
+
+def _before_fork():
+    _forking_instances[:] = list(_instances)
+    for im in _forking_instances:
+        im._before_fork()
+
+
+def _after_fork_in_parent():
+    for im in _forking_instances:
+        im._after_fork_in_parent()
+    del _forking_instances[:]
+
+
+def _after_fork_in_child():
+    # Clients abandoned at an earlier fork (inherited from the parent) are released now,
+    # so the list doesn't grow with every generation of forked processes. Dropping them
+    # closes only this process's copies of their sockets.
+    del _clients_abandoned_at_fork[:]
+    for im in _forking_instances:
+        im._after_fork_in_child()
+    del _forking_instances[:]
+
+
+if register_at_fork is not None:
+    register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent, after_in_child=_after_fork_in_child)
+
+
+def plan_guard_from_option(plan_guard):
+    '''
+    Returns PlanGuard for the plan_guard option of InstantMongoDB - any false value turns
+    the guard off, True means mode 'warn'.
+    '''
+    if isinstance(plan_guard, PlanGuard) or plan_guard is None:
+        return plan_guard
+    if not plan_guard:
+        return None
+    return PlanGuard('warn' if plan_guard is True else plan_guard)
+
+
+def start_failed_exception(process):
+    return Exception(
+        'MongoDB process exited before it started to accept connections: '
+        f'{process.describe_failure()}')
 
 
 class MongoDBProcess:
 
-    def __init__(self, logger, data_dir, port, as_replica_set, follow_logs, mongod_bin='mongod'):
+    storage_args = [
+        '--directoryperdb',
+        '--storageEngine', 'wiredTiger',
+    ]
+
+    def __init__(
+            self, logger, data_dir, port, as_replica_set, follow_logs, mongod_bin='mongod',
+            mongod_profile='default', extra_args=None, replica_set_name=replica_set_name,
+            unix_socket_path=None, shutdown_strategy='terminate', shutdown_timeout=30):
         self._logger = logger
         self._data_dir = data_dir.resolve()
         self._stdout_path = data_dir / 'mongod-stdout.log'
         self._stderr_path = data_dir / 'mongod-stderr.log'
         self._port = port
+        self._unix_socket_path = unix_socket_path
+        self._shutdown_strategy = shutdown_strategy
+        self._shutdown_timeout = shutdown_timeout
+        self._stop_deadline = None
         self._mongod_process = None
-        self._stdout_reader = None
-        self._stderr_reader = None
+        self._async_process = None
+        self._log_followers = []
         self._as_replica_set = as_replica_set
+        self._replica_set_name = replica_set_name
         self._follow_logs = follow_logs
         self._mongod_bin = mongod_bin
+        self._profile = get_mongod_profile(mongod_profile)
+        self._extra_args = list(extra_args or [])
+        self.cmd = self._build_cmd()
+
+    @property
+    def stdout_path(self):
+        return self._stdout_path
+
+    @property
+    def started_async(self):
+        return self._async_process is not None
+
+    def _build_cmd(self):
+        cmd = [
+            self._mongod_bin,
+            '--dbpath', str(self._data_dir),
+            *self._listen_args(),
+            *self.storage_args,
+        ]
+        args = self._profile.storage_args + self._profile.args
+        if self._as_replica_set:
+            cmd.extend(['--replSet', self._replica_set_name])
+            args += self._profile.replica_set_args
+        return cmd + merge_args(args, self._extra_args)
+
+    def _listen_args(self):
+        if self._unix_socket_path is None:
+            return ['--port', str(self._port), '--bind_ip', '127.0.0.1']
+        # bind_ip accepts also full paths of Unix domain sockets;
+        # without a port given mongod listens on TCP only if bind_ip contains an IP address
+        bind_ip = ([] if self._port is None else ['127.0.0.1']) + [str(self._unix_socket_path)]
+        return [
+            *([] if self._port is None else ['--port', str(self._port)]),
+            '--bind_ip', ','.join(bind_ip),
+            '--unixSocketPrefix', str(self._unix_socket_path.parent),
+        ]
+
+    def accepts_connections(self):
+        if self._unix_socket_path is not None:
+            return unix_socket_conns_accepted(self._unix_socket_path)
+        return tcp_conns_accepted_on_port(self._port)
 
     def start(self):
         try:
             assert self._mongod_process is None
-            cmd = [
-                self._mongod_bin,
-                '--dbpath', str(self._data_dir),
-                '--port', str(self._port),
-                '--bind_ip', '127.0.0.1',
-                '--directoryperdb',
-                '--storageEngine', 'wiredTiger',
-                '--wiredTigerCacheSizeGB', '1',
-            ]
-            if self._as_replica_set:
-                cmd.extend([
-                    '--replSet', 'test-rs',
-                    '--oplogSize', '1000',
-                ])
+            self._logger.debug('Running %s', ' '.join(self.cmd))
             with self._stdout_path.open('wb') as stdout_file, self._stderr_path.open('wb') as stderr_file:
                 self._mongod_process = Popen(
-                    cmd,
+                    self.cmd,
                     stdout=stdout_file,
                     stderr=stderr_file)
-            if self._follow_logs:
-                self._stdout_reader = OutputFileReader(
-                    self._logger,
-                    self._stdout_path,
-                    f'mongod[{self._mongod_process.pid}] out')
-                self._stderr_reader = OutputFileReader(
-                    self._logger,
-                    self._stderr_path,
-                    f'mongod[{self._mongod_process.pid}] err')
+            self._start_output_readers()
         except BaseException:
             self.stop()
             raise
 
-    def stop(self):
-        if self._mongod_process:
-            self._logger.debug('Shutting down mongod[%s]', self._mongod_process.pid)
-            self._mongod_process.terminate()
-            self._mongod_process.wait()
-            self._mongod_process = None
-        if self._stdout_reader:
-            self._stdout_reader.stop()
-            self._stdout_reader = None
-        if self._stderr_reader:
-            self._stderr_reader.stop()
-            self._stderr_reader = None
-
-    def is_alive(self):
-        return self._mongod_process.poll() is None
-
-
-class OutputFileReader:
+    async def astart(self):
+        try:
+            assert self._mongod_process is None and self._async_process is None
+            self._logger.debug('Running %s', ' '.join(self.cmd))
+            with self._stdout_path.open('wb') as stdout_file, self._stderr_path.open('wb') as stderr_file:
+                self._async_process = await create_subprocess_exec(
+                    *self.cmd,
+                    stdout=stdout_file,
+                    stderr=stderr_file)
+            self._start_output_readers()
+        except BaseException:
+            await self.astop()
+            raise
 
-    def __init__(self, logger, file_path, name):
-        self.logger = logger
-        self.file_path = file_path
-        self.name = name
-        self.stop_event = Event()
-        self.thread = Thread(target=self._run)
-        self.thread.start()
-
-    def _run(self):
-        with self.file_path.open('rb') as f:
-            while not self.stop_event.is_set():
-                line = f.readline()
-                if not line:
-                    sleep(0.01)
-                    continue
-                try:
-                    line = line.decode()
-                except Exception:
-                    line = str(line)
-                try:
-                    line = self._preprocess_line(line)
-                except Exception as e:
-                    self.logger.exception('Failed to preprocess line %r: %r', line, e)
-                self.logger.debug('%s: %s', self.name, line.rstrip())
+    def _start_output_readers(self):
+        if self._follow_logs:
+            self._log_followers = [
+                log_pump.follow(self._stdout_path, partial(self._log_output_line, f'mongod[{self.pid}] out')),
+                log_pump.follow(self._stderr_path, partial(self._log_output_line, f'mongod[{self.pid}] err')),
+            ]
 
-    def stop(self):
-        self.stop_event.set()
-        self.thread.join()
-        self.thread = None
+    def _log_output_line(self, name, line):
+        record = parse_log_line(line)
+        if record is not None:
+            self._logger.debug(
+                '%s: %s %-8s %s [%s] %s%s', name, record.severity, record.component, record.id,
+                record.context, record.msg, f' {dumps(record.attr)}' if record.attr else '',
+                extra={'mongod_log': record})
+            return
+        try:
+            line = self._preprocess_line(line)
+        except Exception as e:
+            self._logger.exception('Failed to preprocess line %r: %r', line, e)
+        self._logger.debug('%s: %s', name, line.rstrip())
 
-    def _preprocess_line(self, line):
+    @staticmethod
+    def _preprocess_line(line):
         m = match(
             r'^[0-9]{4}-[0-9]{2}-[0-9]{2}'
             r'T[0-9]{2}:[0-9]{2}:[0-9]{2}'
@@ -362,3 +1322,135 @@ class OutputFileReader:
         if m:
             return m.group(1)
         return line
+
+    def request_stop(self):
+        '''
+        Tells mongod to shut down (according to the shutdown strategy) without waiting for it to exit.
+        '''
+        process = self._async_process or self._mongod_process
+        if process is None or self._stop_deadline is not None:
+            return
+        self._stop_deadline = monotonic() + self._shutdown_timeout
+        if not self.is_alive():
+            return
+        self._logger.debug('Shutting down mongod[%s] (%s)', process.pid, self._shutdown_strategy)
+        if self._shutdown_strategy == 'kill':
+            process.kill()
+        elif self._shutdown_strategy == 'terminate' or not self._send_shutdown_command():
+            process.terminate()
+
+    def _send_shutdown_command(self):
+        '''
+        Returns False if the shutdown command could not be sent.
+        '''
+        if self._unix_socket_path is not None:
+            address = quote(str(self._unix_socket_path), safe='')
+        else:
+            address = f'127.0.0.1:{self._port}'
+        try:
+            with MongoClient(f'mongodb://{address}', directConnection=True, serverSelectionTimeoutMS=1000) as client:
+                client.admin.command('shutdown', force=True)
+        except ServerSelectionTimeoutError:
+            return False
+        except ConnectionFailure:
+            # mongod closes the connection when shutting down
+            pass
+        except PyMongoError as e:
+            self._logger.warning('Failed to send shutdown command to mongod[%s]: %r', self.pid, e)
+            return False
+        return True
+
+    def _remaining_stop_time(self):
+        return max(0, self._stop_deadline - monotonic())
+
+    def stop(self):
+        if self._async_process:
+            raise RuntimeError('mongod was started using astart(), use astop() to stop it')
+        if self._mongod_process:
+            self.request_stop()
+            try:
+                self._mongod_process.wait(self._remaining_stop_time())
+            except TimeoutExpired:
+                self._logger.warning(
+                    'mongod[%s] did not exit within %s s, killing it', self._mongod_process.pid, self._shutdown_timeout)
+                self._mongod_process.kill()
+                self._mongod_process.wait()
+            self._mongod_process = None
+            self._stop_deadline = None
+        self._stop_output_readers()
+
+    def kill(self):
+        '''
+        Kills mongod with SIGKILL (no clean shutdown).
+        '''
+        if self._async_process:
+            raise RuntimeError('mongod was started using astart(), use astop() to stop it')
+        if self._mongod_process:
+            self._logger.debug('Killing mongod[%s]', self._mongod_process.pid)
+            self._mongod_process.kill()
+            self._mongod_process.wait()
+            self._mongod_process = None
+            self._stop_deadline = None
+        self._stop_output_readers()
+
+    async def astop(self):
+        if self._async_process:
+            if self._shutdown_strategy == 'graceful':
+                await to_thread(self.request_stop)
+            else:
+                self.request_stop()
+            try:
+                await wait_for(self._async_process.wait(), self._remaining_stop_time())
+            except AsyncTimeoutError:
+                self._logger.warning(
+                    'mongod[%s] did not exit within %s s, killing it', self._async_process.pid, self._shutdown_timeout)
+                self._async_process.kill()
+                await self._async_process.wait()
+            self._async_process = None
+            self._stop_deadline = None
+        if self._mongod_process:
+            await to_thread(self.stop)
+        else:
+            self._stop_output_readers()
+
+    def _stop_output_readers(self):
+        for follower in self._log_followers:
+            log_pump.unfollow(follower)
+        self._log_followers = []
+
+    def detach(self):
+        '''
+        Stop following logs and forget the mongod process without terminating it,
+        so that it keeps running after this object (or the whole Python process) is gone.
+        '''
+        self._async_process = None
+        self._mongod_process = None
+        self.stop()
+
+    @property
+    def pid(self):
+        return (self._async_process or self._mongod_process).pid
+
+    def wait_until_ready(self, timeout, check_ready=None):
+        '''
+        Blocks until mongod reports in its log that it is waiting for connections.
+
+        Returns True when ready, False if mongod exited; raises TimeoutError.
+        '''
+        return wait_for_log_line(
+            self._stdout_path, is_waiting_for_connections,
+            pid=self.pid, is_alive=self.is_alive, timeout=timeout, check_ready=check_ready)
+
+    async def async_wait_until_ready(self, timeout, check_ready=None):
+        return await async_wait_for_log_line(
+            self._stdout_path, is_waiting_for_connections,
+            pid=self.pid, is_alive=self.is_alive, timeout=timeout, check_ready=check_ready)
+
+    def describe_failure(self):
+        returncode = self._async_process.returncode if self._async_process else self._mongod_process.poll()
+        return describe_mongod_failure(self._stdout_path, self._stderr_path, returncode)
+
+    def is_alive(self):
+        if self._async_process:
+            return self._async_process.returncode is None
+        return self._mongod_process is not None and self._mongod_process.poll() is None
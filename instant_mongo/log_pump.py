@@ -0,0 +1,170 @@
+'''
+One background thread that follows output files of all running mongod processes
+(when started with follow_logs=True) and passes their lines to callbacks.
+
+The thread sleeps until inotify reports that some of the files were written
+(polls every 50 ms where inotify is not available), so it doesn't consume any
+CPU while mongod is quiet. It is started when the first file is followed and
+exits when the last one is unfollowed.
+'''
+
+from logging import getLogger
+from os import close, pipe, read, write
+from select import select
+from threading import Event, Lock, Thread, current_thread
+
+from .inotify import Inotify, inotify_available
+
+try:
+    from os import register_at_fork
+except ImportError:
+    # not available on Windows
+    register_at_fork = None
+
+
+logger = getLogger(__name__)
+
+
+class _FollowedFile:
+
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self.f = None
+        self.wd = None
+        self.buf = b''
+        self.removed = Event()
+        self.thread = None
+
+    def read_lines(self, flush=False):
+        chunk = self.f.read()
+        if not chunk and not (flush and self.buf):
+            return
+        *lines, self.buf = (self.buf + chunk).split(b'\n')
+        if flush and self.buf:
+            lines.append(self.buf)
+            self.buf = b''
+        for line in lines:
+            try:
+                self.callback(line.decode(errors='replace'))
+            except Exception as e:
+                logger.exception('Failed to process line from %s: %r', self.path, e)
+
+
+class LogPump:
+
+    poll_interval = 0.05
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._lock = Lock()
+        self._files = []
+        self._to_add = []
+        self._to_remove = []
+        self._thread = None
+        self._wakeup_fds = None
+
+    def follow(self, path, callback):
+        '''
+        Starts following the file (from its beginning); callback is called with
+        every complete line (str, without the newline). Returns a handle for unfollow().
+        '''
+        ff = _FollowedFile(path, callback)
+        with self._lock:
+            self._to_add.append(ff)
+            if self._thread is None:
+                self._wakeup_fds = pipe()
+                self._thread = Thread(target=self._run, args=(self._wakeup_fds,), name='instant_mongo_log_pump', daemon=True)
+                self._thread.start()
+            else:
+                write(self._wakeup_fds[1], b'x')
+        return ff
+
+    def unfollow(self, ff):
+        '''
+        Reads the rest of the file (including an incomplete last line) and stops following it.
+        '''
+        with self._lock:
+            self._to_remove.append(ff)
+            if self._wakeup_fds is not None:
+                write(self._wakeup_fds[1], b'x')
+        ff.removed.wait()
+        with self._lock:
+            exited_thread = ff.thread if ff.thread is not self._thread else None
+        if exited_thread is not None and exited_thread is not current_thread():
+            exited_thread.join()
+
+    def _run(self, wakeup_fds):
+        inotify = Inotify() if inotify_available() else None
+        try:
+            while self._process_changes(inotify):
+                fds = [wakeup_fds[0]] + ([inotify] if inotify else [])
+                readable, _, _ = select(fds, [], [], None if inotify else self.poll_interval)
+                if wakeup_fds[0] in readable:
+                    read(wakeup_fds[0], 4096)
+                if inotify is None:
+                    changed = self._files
+                elif inotify in readable:
+                    wds = {wd for wd, _ in inotify.read_events()}
+                    changed = [ff for ff in self._files if ff.wd in wds]
+                else:
+                    changed = []
+                for ff in changed:
+                    ff.read_lines()
+        except BaseException as e:
+            logger.exception('Log pump failed: %r', e)
+            with self._lock:
+                for ff in self._files + self._to_add + self._to_remove:
+                    ff.removed.set()
+                self._files, self._to_add, self._to_remove = [], [], []
+                self._thread = None
+                self._wakeup_fds = None
+        finally:
+            if inotify is not None:
+                inotify.close()
+            for fd in wakeup_fds:
+                close(fd)
+
+    def _process_changes(self, inotify):
+        '''
+        Applies pending follow()/unfollow() requests; returns False when
+        there is nothing left to follow and the thread should exit.
+        '''
+        with self._lock:
+            for ff in self._to_add:
+                ff.thread = current_thread()
+                try:
+                    ff.f = ff.path.open('rb')
+                except OSError as e:
+                    logger.warning('Cannot follow %s: %r', ff.path, e)
+                    ff.removed.set()
+                    continue
+                if inotify is not None:
+                    ff.wd = inotify.add_watch(ff.path)
+                ff.read_lines()
+                self._files.append(ff)
+            self._to_add = []
+            for ff in self._to_remove:
+                if ff in self._files:
+                    ff.read_lines(flush=True)
+                    ff.f.close()
+                    if inotify is not None:
+                        inotify.remove_watch(ff.wd)
+                    self._files.remove(ff)
+                ff.removed.set()
+            self._to_remove = []
+            if not self._files:
+                self._thread = None
+                self._wakeup_fds = None
+                return False
+            return True
+
+
+log_pump = LogPump()
+
+# The pump thread doesn't exist in a forked child; the files followed by the parent
+# process are not followed in the child.
+if register_at_fork is not None:
+    register_at_fork(after_in_child=log_pump._reset)
@@ -0,0 +1,165 @@
+'''
+Parsing of the structured (JSON) log that mongod 4.4+ writes, and collection
+of slow query entries from it.
+
+A log line looks like this:
+
+{"t":{"$date":"2024-05-20T20:10:08.731+00:00"},"s":"I","c":"COMMAND","id":51803,
+ "ctx":"conn12","msg":"Slow query","attr":{"ns":"test.users","planSummary":"COLLSCAN",...}}
+'''
+
+from collections import deque
+from json import loads
+from threading import Lock
+
+
+slow_query_log_id = 51803
+
+# Operations on these databases are mostly server-internal (hello, replication,
+# sessions) and are not collected as slow ops.
+internal_db_names = ('admin', 'config', 'local')
+
+
+class MongodLogRecord:
+    '''
+    One parsed mongod log entry.
+    '''
+
+    def __init__(self, timestamp, severity, component, id, context, msg, attr, raw):
+        self.timestamp = timestamp
+        self.severity = severity
+        self.component = component
+        self.id = id
+        self.context = context
+        self.msg = msg
+        self.attr = attr
+        self.raw = raw
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.severity} {self.component} {self.id} {self.msg!r}>'
+
+
+def parse_log_line(line):
+    '''
+    Returns MongodLogRecord, or None if the line is not a JSON log entry
+    (e.g. output of mongod < 4.4 or a message written before logging was set up).
+    '''
+    line = line.strip()
+    if not line.startswith('{'):
+        return None
+    try:
+        entry = loads(line)
+    except ValueError:
+        return None
+    if not isinstance(entry, dict) or 'msg' not in entry:
+        return None
+    timestamp = entry.get('t')
+    if isinstance(timestamp, dict):
+        timestamp = timestamp.get('$date')
+    return MongodLogRecord(
+        timestamp=timestamp,
+        severity=entry.get('s'),
+        component=entry.get('c'),
+        id=entry.get('id'),
+        context=entry.get('ctx'),
+        msg=entry['msg'],
+        attr=entry.get('attr') or {},
+        raw=line)
+
+
+def is_slow_query(record):
+    return record.id == slow_query_log_id or record.msg == 'Slow query'
+
+
+class SlowOp:
+    '''
+    Slow operation as reported by mongod - all operations that took longer
+    than slowms (mongod option --slowms, default 100 ms) are logged.
+    '''
+
+    def __init__(self, record):
+        attr = record.attr
+        self.record = record
+        self.type = attr.get('type')
+        self.ns = attr.get('ns')
+        self.command = attr.get('command') or {}
+        self.plan_summary = attr.get('planSummary')
+        self.keys_examined = attr.get('keysExamined')
+        self.docs_examined = attr.get('docsExamined')
+        self.n_returned = attr.get('nreturned')
+        self.duration_ms = attr.get('durationMillis')
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} {self.ns} {self.command_name} {self.plan_summary} '
+            f'docsExamined={self.docs_examined} nreturned={self.n_returned} {self.duration_ms}ms>')
+
+    @property
+    def command_name(self):
+        return next(iter(self.command), None)
+
+    @property
+    def db_name(self):
+        return self.ns.split('.', 1)[0] if self.ns else None
+
+    @property
+    def is_collscan(self):
+        return self.plan_summary == 'COLLSCAN'
+
+
+class SlowOpsBuffer:
+    '''
+    Collects slow ops from mongod log files. The files are read incrementally,
+    only when refresh() is called - no background thread is needed.
+    When a log file is rewritten (mongod restarted), call forget(path) first.
+
+    Only the last `maxlen` slow ops are kept.
+    '''
+
+    def __init__(self, maxlen=10000):
+        self._ops = deque(maxlen=maxlen)
+        self._positions = {}
+        self._lock = Lock()
+
+    def refresh(self, paths):
+        with self._lock:
+            for path in paths:
+                self._read_file(path)
+
+    def _read_file(self, path):
+        offset, partial = self._positions.get(path, (0, b''))
+        try:
+            with path.open('rb') as f:
+                if f.seek(0, 2) < offset:
+                    # the file was truncated and forget() was not called
+                    offset, partial = 0, b''
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        *lines, partial = (partial + chunk).split(b'\n')
+        self._positions[path] = (offset + len(chunk), partial)
+        for line in lines:
+            record = parse_log_line(line.decode(errors='replace'))
+            if record is not None and is_slow_query(record):
+                op = SlowOp(record)
+                if op.db_name not in internal_db_names:
+                    self._ops.append(op)
+
+    def forget(self, path):
+        '''
+        The file will be read from the beginning on next refresh(). The ops already collected are kept.
+        '''
+        with self._lock:
+            self._positions.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._ops.clear()
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._ops))
+
+    def __len__(self):
+        return len(self._ops)
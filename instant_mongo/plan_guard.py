@@ -0,0 +1,268 @@
+'''
+Query plan regression guard: the database profiler is enabled on test databases
+and plans of the executed queries are checked for collection scans, in-memory
+sorts and a high number of examined documents per returned document.
+
+Queries that are fast in tests only because the test data is tiny are caught
+this way, even though they take a millisecond there.
+'''
+
+from datetime import datetime
+from json import dump
+from warnings import warn
+
+
+class QueryPlanWarning(UserWarning):
+    pass
+
+
+class QueryPlanError(AssertionError):
+    pass
+
+
+class ProfiledQuery:
+    '''
+    One query (find, aggregate, update, ...) recorded by the database profiler.
+    '''
+
+    def __init__(self, profile_doc):
+        self.ns = profile_doc.get('ns')
+        self.op = profile_doc.get('op')
+        self.command = profile_doc.get('command') or {}
+        self.plan_summary = profile_doc.get('planSummary')
+        self.keys_examined = profile_doc.get('keysExamined')
+        self.docs_examined = profile_doc.get('docsExamined')
+        self.n_returned = profile_doc.get('nreturned')
+        # updates and deletes don't return documents
+        self.n_matched = profile_doc.get('nMatched', profile_doc.get('ndeleted'))
+        self.has_sort_stage = bool(profile_doc.get('hasSortStage'))
+        self.millis = profile_doc.get('millis')
+        self.ts = profile_doc.get('ts')
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.ns} {self.command_name} {self.plan_summary}>'
+
+    @property
+    def command_name(self):
+        if self.op in ('update', 'remove'):
+            return self.op
+        return next(iter(self.command), self.op)
+
+    @property
+    def shape(self):
+        '''
+        The query with all values replaced by '?' - queries that differ
+        only in the values have the same shape.
+        '''
+        shape = {'ns': self.ns, 'command': self.command_name}
+        for key in ('filter', 'query', 'q', 'pipeline'):
+            if key in self.command:
+                shape[key] = query_shape(self.command[key])
+        if 'sort' in self.command:
+            shape['sort'] = dict(self.command['sort'])
+        return shape
+
+    def to_dict(self):
+        return {
+            'shape': self.shape,
+            'plan_summary': self.plan_summary,
+            'keys_examined': self.keys_examined,
+            'docs_examined': self.docs_examined,
+            'n_returned': self.n_returned,
+            'n_matched': self.n_matched,
+            'has_sort_stage': self.has_sort_stage,
+            'millis': self.millis,
+            'ts': self.ts.isoformat() if isinstance(self.ts, datetime) else self.ts,
+        }
+
+
+def query_shape(value):
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            item_shape = query_shape(item)
+            if item_shape not in shapes:
+                shapes.append(item_shape)
+        return shapes
+    return '?'
+
+
+class QueryPlanIssue:
+
+    def __init__(self, query, kind, message):
+        self.query = query
+        self.kind = kind
+        self.message = message
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.kind} {self.message}>'
+
+    def __str__(self):
+        return f'{self.query.ns} {self.query.command_name}: {self.message} (shape: {self.query.shape})'
+
+    def to_dict(self):
+        return {'kind': self.kind, 'message': self.message, 'query': self.query.to_dict()}
+
+
+class PlanGuard:
+    '''
+    Usage:
+
+    guard = PlanGuard(mode='fail')
+    db = guard.watch(im.get_new_test_db())
+    ... run the code under test ...
+    guard.check()  # raises QueryPlanError if some query has a bad plan
+
+    mode is 'warn' (QueryPlanWarning is emitted for every issue), 'fail'
+    (QueryPlanError is raised) or None (issues are only returned and reported).
+
+    Checks:
+
+    - COLLSCAN - the query scanned the whole collection (allow_collscan=True disables this check)
+    - SORT - the results were sorted in memory instead of using an index (allow_in_memory_sort=True)
+    - ratio - the query examined more than max_examined_ratio documents
+      (or index keys) per returned document
+    '''
+
+    modes = ('warn', 'fail', None)
+
+    def __init__(self, mode='warn', max_examined_ratio=10, allow_collscan=False, allow_in_memory_sort=False):
+        if mode not in self.modes:
+            raise ValueError(f'Unknown plan guard mode: {mode!r}')
+        self.mode = mode
+        self.max_examined_ratio = max_examined_ratio
+        self.allow_collscan = allow_collscan
+        self.allow_in_memory_sort = allow_in_memory_sort
+        self.queries = []
+        self.issues = []
+        self._checked_issue_count = 0
+        self._dbs = {}
+
+    def watch(self, db):
+        '''
+        Enables the profiler (level 2 - all operations) on the database. Returns the database.
+        '''
+        db.command('profile', 2)
+        self._dbs[db.name] = _ProfileReader(db)
+        return db
+
+    def collect(self):
+        '''
+        Reads new entries from the profiler of all watched databases.
+        Returns the newly collected queries.
+        '''
+        new_queries = []
+        for reader in self._dbs.values():
+            for doc in reader.read_new():
+                if _is_query(doc):
+                    query = ProfiledQuery(doc)
+                    new_queries.append(query)
+                    self.issues.extend(self.find_issues(query))
+        self.queries.extend(new_queries)
+        return new_queries
+
+    def find_issues(self, query):
+        issues = []
+        plan_summary = query.plan_summary or ''
+        if not self.allow_collscan and plan_summary.startswith('COLLSCAN'):
+            issues.append(QueryPlanIssue(query, 'COLLSCAN', 'collection scan'))
+        if not self.allow_in_memory_sort and query.has_sort_stage:
+            issues.append(QueryPlanIssue(query, 'SORT', 'in-memory sort'))
+        examined = max(query.docs_examined or 0, query.keys_examined or 0)
+        returned = query.n_returned if query.n_returned is not None else query.n_matched or 0
+        if examined / max(returned, 1) > self.max_examined_ratio:
+            issues.append(QueryPlanIssue(
+                query, 'ratio', f'examined {examined} documents or keys for {returned} returned'))
+        return issues
+
+    def check(self):
+        '''
+        Collects new profiler entries and warns or fails (depending on mode)
+        if some query has a bad plan. Issues found by a previous check() are
+        not reported again. Returns the new issues.
+        '''
+        self.collect()
+        issues = self.issues[self._checked_issue_count:]
+        self._checked_issue_count = len(self.issues)
+        if issues and self.mode == 'fail':
+            raise QueryPlanError(
+                f'{len(issues)} queries with bad plans:\n' + '\n'.join(f'- {issue}' for issue in issues))
+        if self.mode == 'warn':
+            for issue in issues:
+                warn(str(issue), QueryPlanWarning, stacklevel=2)
+        return issues
+
+    def reset(self):
+        '''
+        Forgets collected queries and issues, e.g. at the start of a test.
+        Queries executed before reset() are not collected.
+        '''
+        self.collect()
+        self.queries = []
+        self.issues = []
+        self._checked_issue_count = 0
+
+    def report(self):
+        '''
+        Returns JSON-serializable dict with the collected query shapes
+        (with the number of executions) and issues.
+        '''
+        shapes = {}
+        for query in self.queries:
+            entry = shapes.setdefault(repr(query.shape), {
+                'shape': query.shape,
+                'count': 0,
+                'plan_summaries': [],
+                'max_docs_examined': 0,
+                'max_millis': 0,
+            })
+            entry['count'] += 1
+            if query.plan_summary not in entry['plan_summaries']:
+                entry['plan_summaries'].append(query.plan_summary)
+            entry['max_docs_examined'] = max(entry['max_docs_examined'], query.docs_examined or 0)
+            entry['max_millis'] = max(entry['max_millis'], query.millis or 0)
+        return {
+            'queries': list(shapes.values()),
+            'issues': [issue.to_dict() for issue in self.issues],
+        }
+
+    def write_report(self, path):
+        with open(path, 'w') as f:
+            dump(self.report(), f, indent=2, default=str)
+
+
+class _ProfileReader:
+    '''
+    Reads system.profile of one database incrementally.
+    '''
+
+    def __init__(self, db):
+        self.db = db
+        self.last_ts = None
+        # entries with timestamp == last_ts that were already read
+        # (timestamps have only millisecond precision)
+        self.seen_at_last_ts = []
+
+    def read_new(self):
+        query = {} if self.last_ts is None else {'ts': {'$gte': self.last_ts}}
+        new_docs = []
+        for doc in self.db['system.profile'].find(query):
+            if doc.get('ts') == self.last_ts and doc in self.seen_at_last_ts:
+                continue
+            if doc.get('ts') != self.last_ts:
+                self.last_ts = doc.get('ts')
+                self.seen_at_last_ts = []
+            self.seen_at_last_ts.append(doc)
+            new_docs.append(doc)
+        return new_docs
+
+
+def _is_query(profile_doc):
+    # getMore entries are continuations of queries that were already recorded;
+    # own reads of system.profile are not interesting
+    return (
+        profile_doc.get('planSummary') is not None
+        and profile_doc.get('op') != 'getmore'
+        and not profile_doc.get('ns', '').endswith('.system.profile'))
@@ -0,0 +1,230 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Condition, Lock
+from time import monotonic
+
+from .instant_mongo import InstantMongoDB
+
+
+logger = getLogger(__name__)
+
+
+class InstantMongoPool:
+    '''
+    Keeps a number of InstantMongoDB instances already running in the background,
+    so that getting a fresh MongoDB server doesn't have to wait for mongod startup.
+
+    Usage:
+
+    with InstantMongoPool(size=2, data_parent_dir='/tmp') as pool:
+        im = pool.acquire()
+        try:
+            im.db['testcoll'].insert_one({'foo': 'bar'})
+        finally:
+            pool.release(im)
+
+    Or:
+
+    with InstantMongoPool(size=2) as pool:
+        with pool.instance() as im:
+            ...
+
+    The pool keeps `size` instances ready - when one is acquired, a replacement
+    is started in the background, so acquire() doesn't have to wait for mongod
+    startup even when many instances are acquired at once. Released instances
+    are reset (all databases are dropped) in the background and put back into
+    the pool, where acquire() prefers them; instances above `size` are stopped.
+
+    `max_instances` limits the number of instances (ready, acquired and starting)
+    running at once - when reached, no replacements are started and acquire()
+    waits until an instance is released. Other keyword arguments are passed
+    to InstantMongoDB.
+    '''
+
+    def __init__(self, size=2, max_instances=None, **kwargs):
+        if size < 1:
+            raise ValueError('Pool size must be at least 1')
+        if max_instances is not None and max_instances < size:
+            raise ValueError('max_instances must not be lower than pool size')
+        if kwargs.get('data_dir') or kwargs.get('port'):
+            raise ValueError('data_dir and port cannot be used with InstantMongoPool - each instance needs its own')
+        self.size = size
+        self.max_instances = max_instances
+        self._im_kwargs = kwargs
+        self._executor = None
+        self._ready = []  # Futures resolving to InstantMongoDB instances, released instances first
+        self._leased = set()
+        self._instance_count = 0  # instances started (or starting) and not stopped yet
+        self._stopping = []  # instances above pool size stopped in the background
+        self._lock = Lock()
+        self._ready_changed = Condition(self._lock)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        assert self._executor is None
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='instant_mongo_pool')
+        with self._lock:
+            self._refill()
+
+    def _refill(self):
+        # called with self._lock held
+        while len(self._ready) < self.size and not self._at_max_instances():
+            self._ready.append(self._submit_start())
+
+    def _at_max_instances(self):
+        return self.max_instances is not None and self._instance_count >= self.max_instances
+
+    def _submit_start(self):
+        # called with self._lock held
+        self._instance_count += 1
+        return self._executor.submit(self._start_instance)
+
+    def _start_instance(self):
+        try:
+            im = InstantMongoDB(**self._im_kwargs)
+            im.start()
+        except BaseException:
+            self._forget_instance()
+            raise
+        return im
+
+    def _reset_instance(self, im):
+        try:
+            im.drop_everything()
+        except BaseException:
+            im.stop()
+            self._forget_instance()
+            raise
+        return im
+
+    def _forget_instance(self):
+        with self._lock:
+            self._instance_count -= 1
+
+    def _take_ready(self):
+        '''
+        Removes and returns an instance that is ready (or the first one, if none is ready yet).
+        Called with self._lock held.
+        '''
+        if not self._ready:
+            return None
+        future = next((f for f in self._ready if f.done()), self._ready[0])
+        self._ready.remove(future)
+        return future
+
+    def acquire(self, timeout=None) -> InstantMongoDB:
+        '''
+        Returns a running InstantMongoDB instance.
+
+        Returns an instance from the pool (released ones are reused first) and starts
+        a replacement in the background, so that the pool has `size` instances ready
+        again. Only if the pool is empty, a new instance is started and this call blocks
+        until it is ready - or, with max_instances reached, until an instance is released.
+        '''
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._lock:
+            if self._executor is None:
+                raise RuntimeError('InstantMongoPool is not started')
+            future = self._take_ready()
+            if future is None and not self._at_max_instances():
+                future = self._submit_start()
+            self._refill()
+            while future is None:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f'No MongoDB instance available within {timeout}s')
+                self._ready_changed.wait(remaining)
+                if self._executor is None:
+                    raise RuntimeError('InstantMongoPool was stopped')
+                future = self._take_ready()
+        try:
+            im = future.result(timeout=None if deadline is None else max(deadline - monotonic(), 0))
+        except FutureTimeoutError:
+            # keep the instance for the next acquire()
+            with self._lock:
+                self._ready.append(future)
+                self._ready_changed.notify()
+            raise TimeoutError(f'No MongoDB instance available within {timeout}s') from None
+        with self._lock:
+            self._leased.add(im)
+        return im
+
+    def release(self, im):
+        '''
+        Returns an instance obtained from acquire() back to the pool.
+
+        The instance is reset in the background and acquired again before other
+        instances; if the pool then has more than `size` instances, the surplus ones
+        are stopped (in the background as well).
+        '''
+        with self._lock:
+            self._leased.remove(im)
+            if self._executor is None:
+                # the pool was stopped in the meantime
+                self._instance_count -= 1
+                self._stopping.append(im)
+                surplus = []
+            else:
+                self._ready.insert(0, self._executor.submit(self._reset_instance, im))
+                # prefer stopping instances that are still starting over the ready ones
+                surplus = sorted(self._ready[1:], key=lambda f: f.done())[:len(self._ready) - self.size]
+                for future in surplus:
+                    self._ready.remove(future)
+                self._ready_changed.notify()
+        if self._executor is None:
+            im.stop(wait=False)
+        for future in surplus:
+            future.add_done_callback(self._stop_surplus)
+
+    def _stop_surplus(self, future):
+        if future.cancelled() or future.exception() is not None:
+            # failed instances were already forgotten
+            return
+        im = future.result()
+        with self._lock:
+            self._instance_count -= 1
+            self._stopping.append(im)
+        im.stop(wait=False)
+
+    @contextmanager
+    def instance(self, timeout=None):
+        '''
+        Context manager that acquires an instance and releases it at the end of the with-block.
+        '''
+        im = self.acquire(timeout=timeout)
+        try:
+            yield im
+        finally:
+            self.release(im)
+
+    def stop(self):
+        '''
+        Stops all instances - both the ones waiting in the pool and the acquired ones.
+        '''
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        with self._lock:
+            leased, self._leased = self._leased, set()
+            futures, self._ready = self._ready, []
+            self._ready_changed.notify_all()
+        # wait for running starts and resets (and stops of surplus instances they trigger)
+        executor.shutdown(wait=True)
+        for future in futures:
+            if future.exception() is None:
+                leased.add(future.result())
+            else:
+                logger.debug('Pooled MongoDB instance failed to start: %r', future.exception())
+        InstantMongoDB.stop_many(leased)
+        with self._lock:
+            stopping, self._stopping = self._stopping, []
+        for im in stopping:
+            im.wait_stopped()
+        self._instance_count = 0
@@ -1,4 +1,93 @@
+from os import O_CREAT, O_RDONLY, close, getpid, open as os_open
+from pathlib import Path
 from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from tempfile import gettempdir
+
+try:
+    from fcntl import LOCK_EX, LOCK_NB, flock
+except ImportError:
+    # not available on Windows
+    flock = None
+
+
+# Ports used when start_port is not given - below the Linux ephemeral port range
+# (32768-60999), so they don't collide with ports of outgoing connections.
+default_port_range = (19000, 32767)
+
+# Every process starts allocating at a different offset in default_port_range
+# (based on its pid), so that concurrent processes (e.g. pytest-xdist workers)
+# don't compete for the same ports.
+port_slot_size = 64
+
+
+def default_start_port(pid=None):
+    first, last = default_port_range
+    slot_count = (last + 1 - first) // port_slot_size
+    return first + ((getpid() if pid is None else pid) % slot_count) * port_slot_size
+
+
+def default_lease_dir():
+    return Path(gettempdir()) / 'instant-mongo-ports'
+
+
+class PortLeaseRegistry:
+    '''
+    Cross-process registry of allocated ports: a port is leased by holding
+    an exclusive flock() on the file {directory}/{port}.lock. The lock is
+    released when the lease is released or when the process exits, even when
+    it is killed, so there is nothing to clean up.
+    '''
+
+    def __init__(self, directory=None, enabled=True):
+        self.directory = Path(directory) if directory else default_lease_dir()
+        self.enabled = enabled and flock is not None
+        self._lock_fds = {}
+
+    def try_lease(self, port):
+        '''
+        Returns False if the port is already leased by somebody else.
+
+        If the registry cannot be used (disabled, no flock(), directory not writable)
+        returns True - the port is then guarded only by the sockets.
+        '''
+        if not self.enabled:
+            return True
+        try:
+            fd = self._open(port)
+        except OSError:
+            return True
+        try:
+            flock(fd, LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+            close(fd)
+            return False
+        except OSError:
+            close(fd)
+            return True
+        self._lock_fds[port] = fd
+        return True
+
+    def _open(self, port):
+        path = str(self.directory / f'{port}.lock')
+        try:
+            return os_open(path, O_RDONLY | O_CREAT, 0o666)
+        except FileNotFoundError:
+            # the directory is shared by all users
+            self.directory.mkdir(mode=0o777, exist_ok=True)
+            try:
+                self.directory.chmod(0o1777)
+            except OSError:
+                pass
+            return os_open(path, O_RDONLY | O_CREAT, 0o666)
+
+    def release(self, port):
+        fd = self._lock_fds.pop(port, None)
+        if fd is not None:
+            close(fd)
+
+    def release_all(self):
+        for port in list(self._lock_fds):
+            self.release(port)
 
 
 class PortGuard:
@@ -11,13 +100,27 @@ class PortGuard:
     But this approach works only if that another process uses the same port
     allocation strategy.
 
+    Allocated ports are also recorded in a cross-process lease registry (lock
+    files in lease_dir, default: instant-mongo-ports in the system temp directory),
+    so a port is not handed out to another process until this PortGuard is closed,
+    whatever its start_port is.
+
+    Without start_port each process starts at a different offset (based on its
+    pid), so concurrent processes don't have to walk through each other's ports.
+
     Use as a context manager to ensure guard sockets are cleaned up.
     """
 
-    def __init__(self, start_port=19000):
-        self._start_port = start_port
-        self._next_port = start_port
+    def __init__(self, start_port=None, lease_dir=None, use_registry=True):
+        if start_port is None:
+            self._start_port = default_start_port()
+            self._port_range = default_port_range
+        else:
+            self._start_port = start_port
+            self._port_range = (start_port, 65535)
+        self._next_port = self._start_port
         self._guard_sockets = []
+        self._registry = PortLeaseRegistry(lease_dir, enabled=use_registry)
 
     def __enter__(self):
         return self
@@ -26,32 +129,45 @@ class PortGuard:
         self.close()
 
     def get_listening_socket(self, bind_host='127.0.0.1'):
-        while True:
+        first_port, last_port = self._port_range
+        for _ in range((last_port + 1 - first_port) // 2):
             assert self._next_port % 2 == 0
             guard_port, app_port = self._next_port, self._next_port + 1
-            s_guard = None
-            s_app = None
-            try:
-                s_guard = socket(family=AF_INET, type=SOCK_STREAM)
-                s_guard.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-                s_guard.bind((bind_host, guard_port))
-                s_guard.listen(1)
-
-                s_app = socket(family=AF_INET, type=SOCK_STREAM)
-                s_app.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-                s_app.bind((bind_host, app_port))
-                s_app.listen(1)
-            except Exception:
-                if s_guard:
-                    s_guard.close()
-                if s_app:
-                    s_app.close()
-                self._next_port += 2
-                if self._next_port >= 65535:
-                    self._next_port = self._start_port
+            self._next_port += 2
+            if self._next_port + 1 > last_port:
+                self._next_port = first_port
+            if not self._registry.try_lease(app_port):
+                continue
+            sockets = self._bind_pair(bind_host, guard_port, app_port)
+            if sockets is None:
+                self._registry.release(app_port)
                 continue
+            s_guard, s_app = sockets
             self._guard_sockets.append(s_guard)
             return (app_port, s_app)
+        raise RuntimeError(f'No available port in range {first_port}-{last_port}')
+
+    @staticmethod
+    def _bind_pair(bind_host, guard_port, app_port):
+        s_guard = None
+        s_app = None
+        try:
+            s_guard = socket(family=AF_INET, type=SOCK_STREAM)
+            s_guard.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            s_guard.bind((bind_host, guard_port))
+            s_guard.listen(1)
+
+            s_app = socket(family=AF_INET, type=SOCK_STREAM)
+            s_app.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            s_app.bind((bind_host, app_port))
+            s_app.listen(1)
+        except Exception:
+            if s_guard:
+                s_guard.close()
+            if s_app:
+                s_app.close()
+            return None
+        return s_guard, s_app
 
     def get_available_port(self):
         port, sock = self.get_listening_socket()
@@ -62,3 +178,4 @@ class PortGuard:
         for sock in self._guard_sockets:
             sock.close()
         self._guard_sockets = []
+        self._registry.release_all()
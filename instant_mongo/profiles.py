@@ -0,0 +1,102 @@
+'''
+Sets of mongod command line options ("profiles").
+
+- 'default' - conservative settings, the same as in previous versions
+- 'fast' - trades durability for speed: data dir in tmpfs (/dev/shm), no FTDC
+  diagnostic data capture, infrequent checkpoints, small cache and oplog,
+  no compression. Data written to such mongod may be lost on crash, which is
+  fine for tests.
+'''
+
+from os import W_OK, access
+from pathlib import Path
+
+
+class MongodProfile:
+
+    def __init__(self, name, args=(), storage_args=(), replica_set_args=(), prefer_shm=False):
+        self.name = name
+        # options that affect format of the data files - part of the data template key
+        self.storage_args = list(storage_args)
+        self.args = list(args)
+        self.replica_set_args = list(replica_set_args)
+        self.prefer_shm = prefer_shm
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name}>'
+
+
+mongod_profiles = {
+    'default': MongodProfile(
+        'default',
+        args=['--wiredTigerCacheSizeGB', '1'],
+        replica_set_args=['--oplogSize', '1000'],
+    ),
+    'fast': MongodProfile(
+        'fast',
+        storage_args=[
+            '--wiredTigerCollectionBlockCompressor', 'none',
+            '--wiredTigerJournalCompressor', 'none',
+        ],
+        args=[
+            '--wiredTigerCacheSizeGB', '0.25',
+            # checkpoint once per hour instead of every 60 seconds
+            '--syncdelay', '3600',
+            # maximum allowed value - journal is flushed less often
+            '--journalCommitInterval', '500',
+            '--setParameter', 'diagnosticDataCollectionEnabled=false',
+            '--setParameter', 'enableFlowControl=false',
+        ],
+        replica_set_args=['--oplogSize', '64'],
+        prefer_shm=True,
+    ),
+}
+
+
+def get_mongod_profile(profile):
+    '''
+    Returns MongodProfile instance; `profile` can be a profile name or a MongodProfile instance.
+    '''
+    if isinstance(profile, MongodProfile):
+        return profile
+    try:
+        return mongod_profiles[profile]
+    except KeyError:
+        raise ValueError(f'Unknown mongod profile: {profile!r} (available: {", ".join(mongod_profiles)})') from None
+
+
+def shm_dir():
+    '''
+    Returns /dev/shm if it is available and writable, otherwise None.
+    '''
+    path = Path('/dev/shm')
+    return path if path.is_dir() and access(path, W_OK) else None
+
+
+def merge_args(args, extra_args):
+    '''
+    Returns `args` followed by `extra_args`; options present in `extra_args`
+    are removed from `args` (mongod doesn't allow most options to be repeated).
+    '''
+    overridden = {key for key, _ in _split_options(extra_args)}
+    merged = [token for key, tokens in _split_options(args) if key not in overridden for token in tokens]
+    return merged + list(extra_args)
+
+
+def _split_options(args):
+    '''
+    Splits list of command line arguments to (key, tokens) tuples. For --setParameter
+    the key includes the parameter name, because --setParameter can be used repeatedly.
+    '''
+    result = []
+    for token in args:
+        if token.startswith('--setParameter='):
+            result.append((('--setParameter', token.split('=', 2)[1]), [token]))
+        elif token.startswith('-') or not result:
+            result.append((token.split('=', 1)[0], [token]))
+        else:
+            key, tokens = result[-1]
+            if key == '--setParameter':
+                key = (key, token.split('=', 1)[0])
+            result[-1] = (key, tokens + [token])
+    return result
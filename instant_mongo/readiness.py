@@ -0,0 +1,265 @@
+'''
+Detection of mongod readiness based on signals from mongod itself -
+its log output, its exit and server monitoring events - instead of
+polling with sleep().
+'''
+
+from asyncio import Event as AsyncEvent, TimeoutError as AsyncTimeoutError, get_running_loop, wait_for
+from contextlib import ExitStack
+from json import loads
+from os import close
+from select import select
+from threading import Event
+from time import monotonic
+
+from pymongo.monitoring import ServerHeartbeatListener
+from pymongo.server_type import SERVER_TYPE
+
+from .inotify import Inotify, inotify_available
+
+
+def is_waiting_for_connections(line):
+    '''
+    Returns True for the log line mongod writes when it is ready to accept connections.
+
+    mongod 4.4+ writes JSON logs: {"id":23016, "msg":"Waiting for connections", ...},
+    older versions write "waiting for connections on port 27017".
+    '''
+    return 'waiting for connections' in line.lower()
+
+
+def describe_mongod_failure(stdout_path, stderr_path, returncode=None):
+    '''
+    Returns a short description of why mongod exited, based on the error
+    entries from its log output.
+    '''
+    messages = _error_messages(_read_text(stdout_path).splitlines()[-100:])
+    stderr = _read_text(stderr_path).strip()
+    if stderr:
+        messages.append(stderr[-1000:])
+    if returncode is not None:
+        messages.append(f'exit code {returncode}')
+    return '; '.join(messages) or 'no error details in mongod output'
+
+
+def _error_messages(lines):
+    messages = []
+    for line in lines:
+        try:
+            entry = loads(line)
+        except ValueError:
+            if 'error' in line.lower() or 'exception' in line.lower():
+                messages.append(line.strip())
+            continue
+        if isinstance(entry, dict) and entry.get('s') in ('F', 'E'):
+            attr = entry.get('attr') or {}
+            detail = attr.get('error') or attr.get('reason') or attr.get('exception')
+            messages.append(f'{entry.get("msg")}: {detail}' if detail else str(entry.get('msg')))
+    return messages
+
+
+def _read_text(path):
+    try:
+        return path.read_bytes().decode(errors='replace')
+    except OSError:
+        return ''
+
+
+def open_pidfd(pid):
+    '''
+    Returns a pidfd (Linux 5.3+, Python 3.9+) that becomes readable when the process exits,
+    or None if not supported.
+    '''
+    try:
+        from os import pidfd_open
+        return pidfd_open(pid)
+    except (ImportError, OSError):
+        return None
+
+
+class _LineScanner:
+    '''
+    Reads new content of a growing file and checks complete lines with a predicate.
+    '''
+
+    def __init__(self, f, predicate):
+        self._f = f
+        self._predicate = predicate
+        self._buf = b''
+
+    def found(self):
+        chunk = self._f.read()
+        if not chunk:
+            return False
+        *lines, self._buf = (self._buf + chunk).split(b'\n')
+        return any(self._predicate(line.decode(errors='replace')) for line in lines)
+
+
+def wait_for_log_line(path, predicate, pid, is_alive, timeout, check_ready=None, check_interval=0.1):
+    '''
+    Blocks until a line matching `predicate` is written to the file at `path`.
+
+    Returns True when the line was found (or `check_ready()` returned True),
+    False if the process exited first. Raises TimeoutError after `timeout` seconds.
+
+    The wait is driven by inotify (file was written) and pidfd (process exited)
+    where available; `check_ready` is only a fallback called when nothing happened
+    for `check_interval` seconds. Without inotify the file is polled every 10 ms.
+    '''
+    deadline = monotonic() + timeout
+    with ExitStack() as stack:
+        scanner = _LineScanner(stack.enter_context(path.open('rb')), predicate)
+        inotify, pidfd = _open_wakeup_fds(stack, path, pid)
+        fds = [fd for fd in (inotify, pidfd) if fd is not None]
+        while True:
+            if scanner.found():
+                return True
+            if not is_alive():
+                return False
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'Log line not found in {path} within {timeout}s')
+            readable, _, _ = select(fds, [], [], min(remaining, check_interval if inotify else .01))
+            if inotify in readable:
+                inotify.read_events()
+            elif not readable and check_ready is not None and check_ready():
+                return True
+
+
+async def async_wait_for_log_line(path, predicate, pid, is_alive, timeout, check_ready=None, check_interval=0.1):
+    '''
+    Same as wait_for_log_line(), but waits without blocking the asyncio event loop
+    (inotify and pidfd file descriptors are watched with loop.add_reader()).
+    '''
+    loop = get_running_loop()
+    deadline = monotonic() + timeout
+    with ExitStack() as stack:
+        scanner = _LineScanner(stack.enter_context(path.open('rb')), predicate)
+        inotify, pidfd = _open_wakeup_fds(stack, path, pid)
+        wakeup = AsyncEvent()
+        exited = AsyncEvent()
+        if not _add_readers(loop, stack, ((inotify, wakeup.set), (pidfd, lambda: (exited.set(), wakeup.set())))):
+            inotify = None
+        while True:
+            if scanner.found():
+                return True
+            if exited.is_set() or not is_alive():
+                return False
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'Log line not found in {path} within {timeout}s')
+            wakeup.clear()
+            try:
+                await wait_for(wakeup.wait(), min(remaining, check_interval if inotify else .01))
+            except AsyncTimeoutError:
+                if check_ready is not None and check_ready():
+                    return True
+            if inotify is not None:
+                inotify.read_events()
+
+
+def _add_readers(loop, stack, fd_callbacks):
+    '''
+    Registers callbacks for readable file descriptors in the event loop;
+    returns False if the event loop doesn't support that (e.g. ProactorEventLoop on Windows).
+    '''
+    try:
+        for fd, callback in fd_callbacks:
+            if fd is not None:
+                loop.add_reader(fd, callback)
+                stack.callback(loop.remove_reader, fd)
+    except NotImplementedError:
+        return False
+    return True
+
+
+def _open_wakeup_fds(stack, path, pid):
+    inotify = None
+    if inotify_available():
+        inotify = stack.enter_context(Inotify())
+        inotify.add_watch(path)
+    pidfd = open_pidfd(pid)
+    if pidfd is not None:
+        stack.callback(close, pidfd)
+    return inotify, pidfd
+
+
+class PrimaryElectedListener(ServerHeartbeatListener):
+    '''
+    pymongo heartbeat listener that sets `self.event` once a server reports itself
+    as replica set primary. With MongoDB 4.4+ the server pushes state changes to
+    the client monitor (streaming protocol), so no polling is involved.
+
+    Heartbeat events are used instead of server description events because
+    pymongo publishes the latter from a queue processed only once per second.
+
+    If `members` ({address: is_arbiter}) is given, the listener is expected to be
+    used by direct connections to all these members and the event is set only once
+    one of them is primary and all the others are secondaries or arbiters.
+    Address of the primary is then available as `self.primary`.
+    '''
+
+    def __init__(self, members=None):
+        self.event = Event()
+        self.primary = None
+        self._members = members
+        self._states = {}
+        self._async_events = []
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if self._members is None:
+            ready = event.reply.server_type == SERVER_TYPE.RSPrimary
+            if ready:
+                self.primary = event.connection_id
+        else:
+            self._states[event.connection_id] = _member_state(event.reply.document)
+            ready = self._members_ready()
+        if ready:
+            self.event.set()
+            for loop, async_event in self._async_events:
+                loop.call_soon_threadsafe(async_event.set)
+
+    def _members_ready(self):
+        # copy - heartbeats of different members are processed in different threads
+        states = dict(self._states)
+        primaries = [address for address, state in states.items() if state == 'primary']
+        if len(primaries) != 1:
+            return False
+        for address, arbiter in self._members.items():
+            if states.get(address) not in (('arbiter',) if arbiter else ('primary', 'secondary')):
+                return False
+        self.primary = primaries[0]
+        return True
+
+    def failed(self, event):
+        pass
+
+    def wait(self, timeout):
+        return self.event.wait(timeout)
+
+    async def async_wait(self, timeout):
+        '''
+        Same as wait(), but doesn't block the asyncio event loop.
+        '''
+        async_event = AsyncEvent()
+        self._async_events.append((get_running_loop(), async_event))
+        if self.event.is_set():
+            return True
+        try:
+            await wait_for(async_event.wait(), timeout)
+        except AsyncTimeoutError:
+            return False
+        return True
+
+
+def _member_state(hello_reply):
+    if hello_reply.get('isWritablePrimary') or hello_reply.get('ismaster'):
+        return 'primary'
+    if hello_reply.get('arbiterOnly'):
+        return 'arbiter'
+    if hello_reply.get('secondary'):
+        return 'secondary'
+    return None
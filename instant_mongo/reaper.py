@@ -0,0 +1,200 @@
+'''
+Cleanup of data directories (and mongod processes) left behind by processes
+that didn't stop their InstantMongoDB instances - e.g. a killed CI job.
+
+Temporary directories created by instant-mongo contain PID of the process
+that created them (instant-mongo.{pid}.*, instant-mongo-data.{pid}.*). When that
+process doesn't exist anymore, the directory is an orphan: mongod processes still
+running in it (found via their mongod.lock files) are killed and the directory
+is deleted.
+
+Can be run from the command line:
+
+    instant-mongo-reap [--dry-run] [directory ...]
+'''
+
+from argparse import ArgumentParser
+from logging import DEBUG, INFO, basicConfig, getLogger
+from os import getpid, kill
+from pathlib import Path
+from re import match
+from shutil import rmtree
+from signal import SIGKILL
+from sys import stdout
+from tempfile import gettempdir
+from threading import Thread
+from time import monotonic, sleep, time
+
+from .profiles import shm_dir
+from .util import is_pid_alive
+
+
+logger = getLogger(__name__)
+
+orphan_dir_name_pattern = r'^instant-mongo(?:-data)?\.([0-9]+)\.'
+
+# mongod.lock of the data dir itself, of the data dir (and replica set members next to it)
+# inside a temporary directory and of InstantMongoCluster servers
+lock_file_patterns = ('mongod.lock', '*/mongod.lock', '*/*/mongod.lock')
+
+default_reap_interval = 600
+
+
+def default_roots():
+    '''
+    Directories where instant-mongo creates its temporary directories.
+    '''
+    roots = [Path(gettempdir())]
+    if shm_dir() is not None:
+        roots.append(shm_dir())
+    return roots
+
+
+class OrphanDir:
+
+    def __init__(self, path, owner_pid):
+        self.path = path
+        self.owner_pid = owner_pid
+        self.mongod_pids = find_mongod_pids(path)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path} owner_pid={self.owner_pid} mongod_pids={self.mongod_pids}>'
+
+
+def find_orphan_dirs(roots=None):
+    '''
+    Returns list of OrphanDir - directories created by instant-mongo in a process that doesn't exist anymore.
+    '''
+    orphans = []
+    for root in (default_roots() if roots is None else roots):
+        try:
+            paths = sorted(Path(root).iterdir())
+        except OSError:
+            continue
+        for path in paths:
+            m = match(orphan_dir_name_pattern, path.name)
+            if not m or not path.is_dir() or path.is_symlink():
+                continue
+            owner_pid = int(m.group(1))
+            if owner_pid == getpid() or is_pid_alive(owner_pid):
+                continue
+            orphans.append(OrphanDir(path, owner_pid))
+    return orphans
+
+
+def find_mongod_pids(path):
+    '''
+    Returns PIDs of running mongod processes with data dir in the given directory.
+    '''
+    pids = []
+    for pattern in lock_file_patterns:
+        for lock_path in sorted(path.glob(pattern)):
+            pid = read_lock_file_pid(lock_path)
+            if pid and pid not in pids and is_pid_alive(pid) and process_uses_dir(pid, lock_path.parent):
+                pids.append(pid)
+    return pids
+
+
+def read_lock_file_pid(lock_path):
+    '''
+    mongod writes its PID into mongod.lock and empties it on clean shutdown.
+    '''
+    try:
+        content = lock_path.read_text().strip()
+    except OSError:
+        return None
+    return int(content) if content.isdigit() else None
+
+
+def process_uses_dir(pid, path):
+    '''
+    Returns True if the command line of the process contains the directory - the PID
+    from a stale lock file may have been reused by an unrelated process.
+    Without /proc the process cannot be checked, so False is returned.
+    '''
+    try:
+        cmdline = Path(f'/proc/{pid}/cmdline').read_bytes().split(b'\0')
+    except OSError:
+        return False
+    paths = {bytes(path), bytes(path.resolve())}
+    return any(arg.rstrip(b'/') in paths for arg in cmdline)
+
+
+def kill_pid(pid, timeout=10):
+    '''
+    Kills a process that is not a child of the current process and waits until it is gone.
+    '''
+    try:
+        kill(pid, SIGKILL)
+    except ProcessLookupError:
+        return
+    deadline = monotonic() + timeout
+    while is_pid_alive(pid) and monotonic() < deadline:
+        sleep(.01)
+
+
+def reap_orphans(roots=None, dry_run=False, background=False):
+    '''
+    Kills mongod processes running in orphaned directories and deletes the directories.
+
+    With background=True the directories are deleted in a background thread
+    (the processes are still killed before this function returns).
+
+    Returns list of the OrphanDir found.
+    '''
+    orphans = find_orphan_dirs(roots)
+    for orphan in orphans:
+        logger.info('%s orphaned directory %s (PID %s)', 'Found' if dry_run else 'Reaping', orphan.path, orphan.owner_pid)
+        if dry_run:
+            continue
+        for pid in orphan.mongod_pids:
+            logger.info('Killing orphaned mongod[%s]', pid)
+            kill_pid(pid)
+    if orphans and not dry_run:
+        paths = [orphan.path for orphan in orphans]
+        if background:
+            Thread(target=delete_dirs, args=(paths,), name='instant_mongo_reaper').start()
+        else:
+            delete_dirs(paths)
+    return orphans
+
+
+def delete_dirs(paths):
+    for path in paths:
+        rmtree(path, ignore_errors=True)
+
+
+def reap_orphans_throttled(roots=None, interval=default_reap_interval, stamp_path=None):
+    '''
+    Runs reap_orphans(background=True), but at most once per `interval` seconds
+    across all processes of the current user - the time of the last run is stored
+    as modification time of the stamp file. Returns None if skipped.
+    '''
+    stamp_path = Path(stamp_path) if stamp_path else Path(gettempdir()) / 'instant-mongo-reaper.stamp'
+    try:
+        if time() - stamp_path.stat().st_mtime < interval:
+            return None
+    except FileNotFoundError:
+        pass
+    try:
+        stamp_path.touch()
+    except OSError as e:
+        logger.debug('Failed to touch %s: %r', stamp_path, e)
+        return None
+    return reap_orphans(roots, background=True)
+
+
+def main():
+    parser = ArgumentParser(description='Kill orphaned instant-mongo mongod processes and delete their data directories.')
+    parser.add_argument('--dry-run', '-n', action='store_true', help='only list the orphaned directories')
+    parser.add_argument('--verbose', '-v', action='store_true')
+    parser.add_argument('directories', nargs='*', help='directories to search (default: system temp directory and /dev/shm)')
+    args = parser.parse_args()
+    basicConfig(level=DEBUG if args.verbose else INFO, format='%(message)s')
+    orphans = reap_orphans(args.directories or None, dry_run=args.dry_run)
+    if not orphans:
+        stdout.write('No orphaned directories found\n')
+
+
+if __name__ == '__main__':
+    main()
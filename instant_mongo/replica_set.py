@@ -0,0 +1,92 @@
+'''
+Helpers for replica sets with multiple members.
+'''
+
+from pymongo import MongoClient
+
+from .readiness import PrimaryElectedListener
+
+
+replica_set_name = 'test-rs'
+
+# Replica set settings tuned for tests: failure of a primary is detected
+# and a new one elected in a fraction of a second (defaults: 10 s election
+# timeout, 2 s heartbeat interval, primary catch-up without time limit).
+default_replica_set_settings = {
+    'electionTimeoutMillis': 500,
+    'heartbeatIntervalMillis': 100,
+    'catchUpTimeoutMillis': 0,
+}
+
+
+class ReplicaSetMember:
+    '''
+    One mongod process of a replica set started by InstantMongoDB.
+    '''
+
+    def __init__(self, index, port, data_dir, arbiter=False, hidden=False, process=None):
+        self.index = index
+        self.port = port
+        self.data_dir = data_dir
+        self.arbiter = arbiter
+        self.hidden = hidden
+        self.process = process
+
+    def __repr__(self):
+        kind = 'arbiter' if self.arbiter else 'hidden' if self.hidden else 'member'
+        return f'<{self.__class__.__name__} {self.index} {kind} {self.host}>'
+
+    @property
+    def host(self):
+        return f'127.0.0.1:{self.port}'
+
+    @property
+    def address(self):
+        '''
+        Address as used by pymongo, e.g. in ServerHeartbeatSucceededEvent.connection_id.
+        '''
+        return ('127.0.0.1', self.port)
+
+    @property
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def config(self):
+        doc = {'_id': self.index, 'host': self.host}
+        if self.arbiter:
+            doc['arbiterOnly'] = True
+        elif self.hidden:
+            doc.update(priority=0, hidden=True)
+        return doc
+
+
+def replica_set_config(members, settings, name=replica_set_name):
+    return {
+        '_id': name,
+        'members': [m.config() for m in members],
+        'settings': dict(settings),
+    }
+
+
+def monitoring_client_kwargs(listener):
+    '''
+    MongoClient arguments for a direct connection whose heartbeats are reported to `listener`.
+    '''
+    import pymongo.common
+    # Short heartbeat frequency matters only for MongoDB < 4.4 - newer servers
+    # push the state change to the client monitor right away.
+    return dict(
+        directConnection=True,
+        event_listeners=[listener],
+        heartbeatFrequencyMS=max(50, int(pymongo.common.MIN_HEARTBEAT_INTERVAL * 1000)))
+
+
+def initiate_replica_set(member, config, timeout):
+    '''
+    Initiates a replica set with `config` on the given (single) member and waits until it becomes primary.
+    '''
+    listener = PrimaryElectedListener()
+    with MongoClient(f'mongodb://{member.host}', **monitoring_client_kwargs(listener)) as client:
+        client.admin.command('replSetInitiate', config)
+        if not listener.wait(timeout):
+            raise TimeoutError(f'Replica set primary not elected within {timeout}s')
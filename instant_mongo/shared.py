@@ -0,0 +1,155 @@
+from contextlib import ExitStack
+from json import dumps, loads
+from logging import getLogger
+from os import getpid
+from time import time_ns
+
+from .instant_mongo import InstantMongoDB
+from .util import is_pid_alive, locked_file, tcp_conns_accepted_on_port, terminate_pid, to_thread
+
+
+logger = getLogger(__name__)
+
+
+class SharedInstantMongoDB(InstantMongoDB):
+    '''
+    InstantMongoDB that is shared by multiple processes (e.g. pytest-xdist workers).
+
+    Usage:
+
+    with SharedInstantMongoDB(data_dir='/tmp/shared-mongo') as im:
+        db = im.get_new_test_db()
+
+    The first process to start runs mongod and publishes its port and PID
+    in a state file next to the data dir (`{data_dir}.state.json`, protected
+    by `{data_dir}.lock`). Other processes using the same data_dir attach to
+    the running server. The last process to stop shuts mongod down.
+
+    Use get_new_test_db() to get isolated databases in each process -
+    drop_everything() drops databases of all attached processes.
+    '''
+
+    def __init__(self, data_parent_dir=None, *, data_dir=None, **kwargs):
+        if not data_dir:
+            raise ValueError('SharedInstantMongoDB requires data_dir that is the same for all processes')
+        if data_parent_dir:
+            raise ValueError('SharedInstantMongoDB cannot be used with data_parent_dir')
+        super().__init__(data_dir=data_dir, **kwargs)
+        if self._is_multi_member_rs:
+            raise ValueError('SharedInstantMongoDB cannot be used with multi-member replica set')
+        if self.unix_socket:
+            raise ValueError('SharedInstantMongoDB cannot be used with unix_socket')
+        self._lock_path = self.data_dir.with_name(self.data_dir.name + '.lock')
+        self._state_path = self.data_dir.with_name(self.data_dir.name + '.state.json')
+        self._client_token = None
+
+    def start(self):
+        assert self._exit_stack is None
+        self.data_dir.parent.mkdir(parents=True, exist_ok=True)
+        with locked_file(self._lock_path):
+            state = self._read_state()
+            if state and is_pid_alive(state['pid']) and tcp_conns_accepted_on_port(state['port']):
+                logger.debug('Attaching to running mongod[%s] on port %s', state['pid'], state['port'])
+                self._attach(state['pid'], state['port'])
+            else:
+                super().start()
+                state = {
+                    'pid': self._mongodb_process.pid,
+                    'port': self.port,
+                    'clients': {},
+                }
+            self._client_token = f'{getpid()}.{time_ns()}'
+            state['clients'] = {
+                token: pid for token, pid in state['clients'].items() if is_pid_alive(pid)
+            }
+            state['clients'][self._client_token] = getpid()
+            self._write_state(state)
+
+    async def astart(self):
+        # the state file lock is blocking, so the whole start runs in a thread
+        await to_thread(self.start)
+
+    async def astop(self):
+        await to_thread(self.stop)
+
+    def _attach(self, pid, port):
+        self._patch_pymongo_min_heartbeat_interval()
+        self.port = port
+        self._mongodb_process = AttachedMongoDBProcess(pid)
+        self._exit_stack = ExitStack()
+        self._owner_pid = getpid()
+        self._exit_stack.callback(self._mongodb_process.stop)
+        self._client = None
+
+    def stop(self, wait=True):
+        # Always waits - another process could start mongod in the same data dir
+        # as soon as the state file lock is released.
+        if self._is_forked_copy:
+            # the client token belongs to the parent process
+            self._client_token = None
+        if self._client_token is None:
+            super().stop()
+            return
+        with locked_file(self._lock_path):
+            state = self._read_state() or {'clients': {}}
+            state['clients'] = {
+                token: pid for token, pid in state['clients'].items()
+                if token != self._client_token and is_pid_alive(pid)
+            }
+            self._client_token = None
+            if state['clients']:
+                logger.debug('Leaving mongod running for %d other client(s)', len(state['clients']))
+                self._write_state(state)
+                self._mongodb_process.detach()
+                delete_data_dir_on_exit, self.delete_data_dir_on_exit = self.delete_data_dir_on_exit, False
+                try:
+                    super().stop()
+                finally:
+                    self.delete_data_dir_on_exit = delete_data_dir_on_exit
+            else:
+                super().stop()
+                try:
+                    self._state_path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _read_state(self):
+        try:
+            return loads(self._state_path.read_text())
+        except FileNotFoundError:
+            return None
+
+    def _write_state(self, state):
+        tmp_path = self._state_path.with_name(f'{self._state_path.name}.{getpid()}.tmp')
+        tmp_path.write_text(dumps(state))
+        tmp_path.replace(self._state_path)
+
+
+class AttachedMongoDBProcess:
+    '''
+    A mongod process started by another process.
+    '''
+
+    started_async = False
+
+    def __init__(self, pid):
+        self._pid = pid
+
+    @property
+    def pid(self):
+        return self._pid
+
+    def stop(self):
+        if self._pid:
+            logger.debug('Shutting down mongod[%s]', self._pid)
+            terminate_pid(self._pid)
+            self._pid = None
+
+    async def astop(self):
+        await to_thread(self.stop)
+
+    def detach(self):
+        self._pid = None
+
+    def is_alive(self):
+        return is_pid_alive(self._pid)
@@ -0,0 +1,113 @@
+'''
+Server-side snapshots of database state.
+
+A snapshot of selected databases is stored in a hidden database (see
+util.snapshot_db_prefix) - documents are copied using the $out aggregation
+stage, collection options and index definitions are stored in a metadata
+collection. Restoring copies the documents back into a temporary collection,
+builds indexes and swaps it in place using renameCollection, so no document
+is transferred to or from Python.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from re import fullmatch
+
+from .util import index_model, is_internal_db, list_data_collections, list_database_names, snapshot_db_prefix
+
+
+meta_collection_name = '__meta'
+restore_temp_prefix = 'tmp.instant_mongo_restore.'
+
+
+def snapshot_db_name(name):
+    # MongoDB database names must be shorter than 64 characters
+    if not fullmatch(r'[A-Za-z0-9_-]{1,38}', name):
+        raise ValueError(f'Invalid snapshot name: {name!r}')
+    return snapshot_db_prefix + name
+
+
+def create_snapshot(client, name, db_names=None, max_workers=8):
+    '''
+    Captures current state of given databases (all non-internal databases if None)
+    into snapshot `name`, replacing previous snapshot of the same name.
+    '''
+    snapshot_db = client[snapshot_db_name(name)]
+    client.drop_database(snapshot_db.name)
+    if db_names is None:
+        db_names = [n for n in list_database_names(client) if not is_internal_db(n)]
+    collections = []
+    for db_name in db_names:
+        for collection, options in list_data_collections(client[db_name]):
+            collections.append({
+                'db': db_name,
+                'coll': collection.name,
+                'options': options,
+                'indexes': [spec for spec in collection.list_indexes() if spec['name'] != '_id_'],
+            })
+
+    def copy(c):
+        _copy_collection(client[c['db']][c['coll']], snapshot_db[f'{c["db"]}.{c["coll"]}'], c['options'])
+
+    _run_all(copy, collections, max_workers)
+    snapshot_db[meta_collection_name].insert_one({'db_names': list(db_names), 'collections': collections})
+
+
+def restore_snapshot(client, name, max_workers=8):
+    '''
+    Restores databases captured in snapshot `name` to the captured state.
+    Collections created after the snapshot was taken are dropped. The snapshot
+    is kept, so it can be restored again.
+    '''
+    snapshot_db = client[snapshot_db_name(name)]
+    meta = snapshot_db[meta_collection_name].find_one()
+    if meta is None:
+        raise KeyError(f'Snapshot {name!r} does not exist')
+    for db_name in meta['db_names']:
+        db = client[db_name]
+        captured = {c['coll'] for c in meta['collections'] if c['db'] == db_name}
+        for collection, _ in list_data_collections(db):
+            if collection.name not in captured:
+                collection.drop()
+
+    def restore(c):
+        db = client[c['db']]
+        temp = db[restore_temp_prefix + c['coll']]
+        temp.drop()
+        db.create_collection(temp.name, **c['options'])
+        _copy_collection(snapshot_db[f'{c["db"]}.{c["coll"]}'], temp, c['options'])
+        if c['indexes']:
+            temp.create_indexes([index_model(spec) for spec in c['indexes']])
+        temp.rename(c['coll'], dropTarget=True)
+
+    _run_all(restore, meta['collections'], max_workers)
+
+
+def drop_snapshot(client, name):
+    client.drop_database(snapshot_db_name(name))
+
+
+def list_snapshots(client):
+    return sorted(
+        n[len(snapshot_db_prefix):]
+        for n in list_database_names(client) if n.startswith(snapshot_db_prefix))
+
+
+def _copy_collection(source, target, options):
+    if options.get('capped'):
+        # $out cannot write into capped collections
+        target.delete_many({})
+        docs = list(source.find())
+        if docs:
+            target.insert_many(docs, bypass_document_validation=True)
+        return
+    source.aggregate(
+        [{'$out': {'db': target.database.name, 'coll': target.name}}],
+        bypassDocumentValidation=True)
+
+
+def _run_all(func, items, max_workers):
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(func, items):
+            pass
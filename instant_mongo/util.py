@@ -1,7 +1,32 @@
-from errno import ECONNREFUSED
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from errno import ECONNREFUSED, ENOENT
+from os import kill
 from pathlib import Path
 import pymongo
+from signal import SIGKILL, SIGTERM
 from threading import enumerate as enumerate_threads
+from time import monotonic_ns, sleep
+
+try:
+    from fcntl import flock, LOCK_EX, LOCK_UN
+except ImportError:
+    flock = None
+
+try:
+    from asyncio import to_thread
+except ImportError:
+    # Python < 3.9
+    from asyncio import get_running_loop
+    from contextvars import copy_context
+    from functools import partial
+
+    async def to_thread(func, *args, **kwargs):
+        '''
+        Runs func(*args, **kwargs) in the default executor - backport of asyncio.to_thread().
+        '''
+        loop = get_running_loop()
+        return await loop.run_in_executor(None, partial(copy_context().run, func, *args, **kwargs))
 
 
 def to_path(p):
@@ -32,13 +57,89 @@ def count_documents(collection, filter=None, **kwargs):
         return collection.count(filter, **kwargs)
 
 
+def estimated_document_count(collection):
+    if pymongo.version_tuple >= (3, 7):
+        return collection.estimated_document_count()
+    else:
+        return collection.count()
+
+
+# Databases holding snapshots created by InstantMongoDB.snapshot()
+snapshot_db_prefix = '__instant_mongo_snapshot_'
+
+
+def is_internal_db(db_name):
+    '''
+    Returns True for databases that must not be dropped when cleaning up
+    after tests - MongoDB system databases and instant-mongo snapshots.
+    '''
+    return db_name in ('admin', 'config', 'local') or db_name.startswith(snapshot_db_prefix)
+
+
 def drop_all_dbs(client):
     for db_name in sorted(list_database_names(client)):
-        if db_name in ('admin', 'config', 'local'):
+        if is_internal_db(db_name):
             continue
         client.drop_database(db_name)
 
 
+def empty_all_dbs(client, max_workers=8):
+    '''
+    Deletes all documents in all databases, but keeps the collections
+    together with their indexes, validators and other options.
+
+    Collections are processed concurrently using a thread pool and collections
+    that are already empty are skipped. Only regular collections are emptied -
+    time series collections are left as they are (and views have no documents).
+    '''
+    collections = []
+    for db_name in sorted(list_database_names(client)):
+        if is_internal_db(db_name):
+            continue
+        collections.extend(list_data_collections(client[db_name]))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(lambda c: empty_collection(*c), collections):
+            pass
+
+
+def list_data_collections(db):
+    '''
+    Returns list of (collection, options) tuples of regular (non-system, non-view) collections.
+    '''
+    return [
+        (db[info['name']], info.get('options') or {})
+        for info in db.list_collections(filter={'type': 'collection'})
+        if not info['name'].startswith('system.')
+    ]
+
+
+def empty_collection(collection, options=None):
+    '''
+    Deletes all documents from the collection. Capped collections (where
+    documents cannot be deleted in older MongoDB versions) are recreated
+    with the same options and indexes instead.
+    '''
+    if estimated_document_count(collection) == 0:
+        return
+    if options and options.get('capped'):
+        indexes = [index_model(spec) for spec in collection.list_indexes() if spec['name'] != '_id_']
+        collection.drop()
+        collection.database.create_collection(collection.name, **options)
+        if indexes:
+            collection.create_indexes(indexes)
+    else:
+        collection.delete_many({})
+
+
+def index_model(spec):
+    '''
+    Converts index specification (as returned by list_indexes() or stored by mongodump)
+    to pymongo.IndexModel.
+    '''
+    kwargs = {k: v for k, v in spec.items() if k not in ('v', 'key', 'ns')}
+    return pymongo.IndexModel(list(spec['key'].items()), **kwargs)
+
+
 def drop_all_collections(db):
     for c_name in sorted(list_collection_names(db)):
         if c_name.startswith('system.'):
@@ -62,6 +163,24 @@ def tcp_conns_accepted_on_port(port, host='127.0.0.1'):
         return True
 
 
+def unix_socket_conns_accepted(path):
+    import socket
+    c = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    c.settimeout(0.1)
+    try:
+        c.connect(str(path))
+    except socket.timeout:
+        return False
+    except OSError as e:
+        if e.errno not in (ECONNREFUSED, ENOENT):
+            raise Exception(f'Unexpected exception: {e!r}') from e
+        return False
+    else:
+        return True
+    finally:
+        c.close()
+
+
 def join_pymongo_threads():
     '''
     PyMongo maintains threads for replica set monitoring.
@@ -71,3 +190,54 @@ def join_pymongo_threads():
     for t in enumerate_threads():
         if t.name.startswith("pymongo_"):
             t.join(timeout=10)
+
+
+@contextmanager
+def locked_file(lock_path):
+    '''
+    Context manager holding an exclusive lock (flock) on the given file,
+    used to serialize work between processes. The file is created if needed.
+    '''
+    with open(lock_path, 'a') as f:
+        if flock is not None:
+            flock(f.fileno(), LOCK_EX)
+        try:
+            yield
+        finally:
+            if flock is not None:
+                flock(f.fileno(), LOCK_UN)
+
+
+def is_pid_alive(pid):
+    '''
+    Returns True if a process with given PID exists and is not a zombie.
+    '''
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        stat = Path(f'/proc/{pid}/stat').read_text()
+    except OSError:
+        return True
+    # the state field follows the process name, which is in parentheses
+    return stat[stat.rindex(')') + 2:][:1] not in ('Z', 'X')
+
+
+def terminate_pid(pid, timeout=30):
+    '''
+    Terminates a process that is not a child of the current process:
+    sends SIGTERM, waits up to `timeout` seconds and sends SIGKILL if needed.
+    '''
+    deadline = monotonic_ns() + timeout * 1_000_000_000
+    try:
+        kill(pid, SIGTERM)
+        while is_pid_alive(pid):
+            if monotonic_ns() > deadline:
+                kill(pid, SIGKILL)
+                deadline = monotonic_ns() + timeout * 1_000_000_000
+            sleep(.01)
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,101 @@
+'''
+Tracking of collections that received writes, so that cleanup after a test
+can be limited to what the test actually changed.
+
+WriteTracker is a pymongo CommandListener - it sees only commands sent through
+clients it is registered with (InstantMongoDB(track_writes=True) registers it
+with im.client and clients returned by get_client() and get_async_client()).
+'''
+
+from threading import Lock
+
+from pymongo import monitoring
+
+from .util import is_internal_db
+
+
+# commands whose value is name of the collection they write to (or create)
+collection_write_commands = {'insert', 'update', 'delete', 'findAndModify', 'create', 'createIndexes', 'collMod'}
+
+
+def written_namespaces(command_name, db_name, command):
+    '''
+    Returns list of (db name, collection name) the command writes to.
+    '''
+    if command_name in collection_write_commands:
+        coll_name = command.get(command_name)
+        return [(db_name, coll_name)] if isinstance(coll_name, str) else []
+    if command_name == 'aggregate':
+        return _aggregate_output(db_name, command.get('pipeline') or [])
+    if command_name == 'renameCollection':
+        return [_split_namespace(command['to'])] if isinstance(command.get('to'), str) else []
+    if command_name == 'bulkWrite':
+        # client bulk write (MongoDB 8.0+) is sent to the admin database
+        return [_split_namespace(info['ns']) for info in command.get('nsInfo') or [] if 'ns' in info]
+    return []
+
+
+def _aggregate_output(db_name, pipeline):
+    if not pipeline:
+        return []
+    stage = pipeline[-1]
+    target = stage.get('$out') if '$out' in stage else stage.get('$merge')
+    if isinstance(target, dict) and 'into' in target:
+        target = target['into']
+    if isinstance(target, str):
+        return [(db_name, target)]
+    if isinstance(target, dict) and isinstance(target.get('coll'), str):
+        return [(target.get('db', db_name), target['coll'])]
+    return []
+
+
+def _split_namespace(ns):
+    db_name, coll_name = ns.split('.', 1)
+    return db_name, coll_name
+
+
+class WriteTracker(monitoring.CommandListener):
+    '''
+    Records (db name, collection name) of collections that were written to or created
+    since creation or since the last checkpoint(). Internal databases (admin, config, local,
+    snapshots) and system collections are ignored.
+
+    Commands are recorded when they are started - a command that failed might still
+    have written something (e.g. unordered insert_many()).
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._dirty = set()
+
+    def started(self, event):
+        namespaces = [
+            (db_name, coll_name)
+            for db_name, coll_name in written_namespaces(event.command_name, event.database_name, event.command)
+            if not is_internal_db(db_name) and not coll_name.startswith('system.')
+        ]
+        if namespaces:
+            with self._lock:
+                self._dirty.update(namespaces)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    @property
+    def dirty(self):
+        '''
+        Sorted list of (db name, collection name).
+        '''
+        with self._lock:
+            return sorted(self._dirty)
+
+    def checkpoint(self):
+        '''
+        Forgets the recorded collections and returns them (as a sorted list).
+        '''
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return sorted(dirty)
@@ -1,10 +1,33 @@
 from logging import basicConfig, DEBUG
 from os import environ
+from pytest import fixture, skip
+from subprocess import check_call
 from sys import stdout
 
+from instant_mongo.util import join_pymongo_threads
+
 
 if environ.get('LOG_TO_STDOUT'):
     basicConfig(
         format='%(asctime)s [%(process)d] %(name)-15s %(levelname)5s: %(message)s',
         level=DEBUG,
         stream=stdout)
+
+
+@fixture(scope='session')
+def needs_mongod():
+    try:
+        check_call(['mongod', '--version'])
+    except FileNotFoundError:
+        if environ.get('CI'):
+            raise Exception('mongod not found - need to be installed in a CI environment')
+        else:
+            skip('mongod not found')
+
+
+@fixture(scope='module', autouse=True)
+def join_pymongo_threads_after_module():
+    # client.close() doesn't wait for the pymongo threads (with pymongo 3.x they keep running
+    # for a while), so that tests checking for running threads are not affected by other modules
+    yield
+    join_pymongo_threads()
@@ -1,8 +1,9 @@
-from os import environ
-from subprocess import check_call
+from asyncio import gather, run as asyncio_run
+from gc import collect as gc_collect
+from warnings import catch_warnings, simplefilter
 
 from bson import ObjectId
-from pytest import fixture, mark, skip
+from pytest import fixture, mark, raises, skip
 from pytest_asyncio import fixture as async_fixture
 
 try:
@@ -13,17 +14,6 @@ except ImportError:
 from instant_mongo import InstantMongoDB
 
 
-@fixture(scope='module')
-def needs_mongod():
-    try:
-        check_call(['mongod', '--version'])
-    except FileNotFoundError:
-        if environ.get('CI'):
-            raise Exception('mongod not found - need to be installed in a CI environment')
-        else:
-            skip('mongod not found')
-
-
 @fixture(scope='module')
 def instant_mongo(needs_mongod, tmp_path_factory):
     tmp_path = tmp_path_factory.mktemp('instant-mongo-async')
@@ -99,3 +89,94 @@ async def test_each_test_gets_isolated_db(db):
     """Each test should get a fresh database (no leftover data from other tests)."""
     count = await db['testcoll'].count_documents({})
     assert count == 0
+
+
+@mark.asyncio
+async def test_async_context_manager(needs_mongod, tmp_path):
+    async with InstantMongoDB(tmp_path) as im:
+        async with im.get_async_client() as client:
+            await client['test']['testcoll'].insert_one({'foo': 'bar'})
+            doc = await client['test']['testcoll'].find_one()
+            assert doc['foo'] == 'bar'
+        data_dir = im.data_dir
+    assert not data_dir.exists()
+
+
+@mark.asyncio
+async def test_astart_as_replica_set(needs_mongod, tmp_path):
+    im = InstantMongoDB(tmp_path, as_replica_set=True)
+    await im.astart()
+    try:
+        async with im.get_async_client() as client:
+            status = await client.admin.command('replSetGetStatus')
+            assert status['myState'] == 1
+        with raises(RuntimeError):
+            im.stop()
+    finally:
+        await im.astop()
+
+
+@mark.asyncio
+async def test_astart_concurrently(needs_mongod, tmp_path):
+    instances = [InstantMongoDB(tmp_path) for _ in range(3)]
+    await gather(*(im.astart() for im in instances))
+    try:
+        assert len({im.port for im in instances}) == 3
+        for im in instances:
+            async with im.get_async_client() as client:
+                await client.admin.command('ping')
+    finally:
+        await gather(*(im.astop() for im in instances))
+
+
+@mark.asyncio
+@mark.parametrize('shutdown_strategy', ['graceful', 'kill'])
+async def test_astop_shutdown_strategy(needs_mongod, tmp_path, shutdown_strategy):
+    im = InstantMongoDB(tmp_path, shutdown_strategy=shutdown_strategy)
+    await im.astart()
+    process = im._mongodb_process
+    await im.astop()
+    assert not process.is_alive()
+    assert list(tmp_path.iterdir()) == []
+
+
+@mark.asyncio
+async def test_async_client_is_cached_per_event_loop(instant_mongo):
+    client = instant_mongo.async_client
+    assert instant_mongo.async_client is client
+    await client['test']['testcoll'].insert_one({'foo': 'bar'})
+    assert (await client['test']['testcoll'].find_one())['foo'] == 'bar'
+    await client.drop_database('test')
+
+
+def test_new_async_client_for_new_event_loop(instant_mongo):
+    async def get_client():
+        client = instant_mongo.async_client
+        await client.admin.command('ping')
+        await instant_mongo.close_async_client()
+        return client
+
+    client1 = asyncio_run(get_client())
+    client2 = asyncio_run(get_client())
+    assert client1 is not client2
+    with raises(RuntimeError):
+        instant_mongo.async_client  # no running event loop
+
+
+@mark.asyncio
+async def test_close_async_client(instant_mongo):
+    client = instant_mongo.async_client
+    await client.admin.command('ping')
+    await instant_mongo.close_async_client()
+    assert instant_mongo.async_client is not client
+    await instant_mongo.close_async_client()
+
+
+@mark.asyncio
+async def test_astop_closes_async_client(needs_mongod, tmp_path):
+    async with InstantMongoDB(tmp_path) as im:
+        await im.async_client.admin.command('ping')
+    with catch_warnings(record=True) as caught:
+        simplefilter('always', ResourceWarning)
+        gc_collect()
+    assert not [w for w in caught if 'Unclosed AsyncMongoClient' in str(w.message)]
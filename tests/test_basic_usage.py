@@ -1,31 +1,22 @@
 from logging import getLogger
-from os import environ
+from os import fork, waitpid, _exit
 from pymongo import version as pymongo_version
 from pymongo import MongoClient
 from pymongo.database import Database
 from pymongo.errors import NotPrimaryError, OperationFailure
-from pytest import fixture, skip, raises, mark
-from subprocess import check_call
+from pytest import skip, raises, mark
+from re import match
 from threading import active_count
+from traceback import print_exc
 
 from instant_mongo import InstantMongoDB
+from instant_mongo.reaper import orphan_dir_name_pattern
 from instant_mongo.util import count_documents, drop_all_collections, join_pymongo_threads
 
 
 logger = getLogger(__name__)
 
 
-@fixture(scope='session')
-def needs_mongod():
-    try:
-        check_call(['mongod', '--version'])
-    except FileNotFoundError:
-        if environ.get('CI'):
-            raise Exception('mongod not found - need to be installed in a CI environment')
-        else:
-            skip('mongod not found')
-
-
 def test_instant_mongo_db_attribute(needs_mongod, tmp_path):
     with InstantMongoDB(tmp_path) as im:
         assert isinstance(im.db, Database)
@@ -149,7 +140,7 @@ def test_follow_logs(needs_mongod, tmp_path, caplog):
             im.db['testcoll'].insert_one({'foo': 'bar'})
             assert any('mongod' in r.message for r in caplog.records), \
                 'Expected mongod log output in captured log records'
-    # After closing, OutputFileReader threads should be stopped
+    # After closing, the log pump thread should be stopped
     join_pymongo_threads()
     assert active_count() == 1
 
@@ -181,3 +172,188 @@ def test_start_with_invalid_mongod_binary(tmp_path):
     with raises(FileNotFoundError):
         with InstantMongoDB(tmp_path, mongod_bin='nonexistent-mongod-binary'):
             pass
+
+
+@mark.parametrize('as_replica_set', [False, True])
+def test_start_many(needs_mongod, tmp_path, as_replica_set):
+    instances = InstantMongoDB.start_many(3, data_parent_dir=tmp_path, as_replica_set=as_replica_set)
+    try:
+        assert len({im.port for im in instances}) == 3
+        for n, im in enumerate(instances):
+            im.db['testcoll'].insert_one({'n': n})
+            doc, = im.db['testcoll'].find()
+            assert doc['n'] == n
+    finally:
+        for im in instances:
+            im.stop()
+
+
+def test_start_many_stops_all_on_failure(tmp_path):
+    with raises(FileNotFoundError):
+        InstantMongoDB.start_many(2, data_parent_dir=tmp_path, mongod_bin='nonexistent-mongod-binary')
+
+
+def test_instant_mongo_drop_everything_truncate_keeps_collections_and_indexes(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path) as im:
+        im.db['testcoll'].create_index('foo')
+        im.db['testcoll'].insert_many([{'foo': 'bar'}, {'foo': 'baz'}])
+        im.client['otherdb'].create_collection('empty')
+        im.drop_everything(strategy='truncate')
+        assert count_documents(im.db['testcoll']) == 0
+        assert 'testcoll' in im.db.list_collection_names()
+        assert 'foo_1' in im.db['testcoll'].index_information()
+        assert 'empty' in im.client['otherdb'].list_collection_names()
+
+
+def test_instant_mongo_drop_everything_truncate_keeps_capped_collection_indexes(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path) as im:
+        im.db.create_collection('cappedcoll', capped=True, size=100000)
+        im.db['cappedcoll'].create_index('foo')
+        im.db['cappedcoll'].insert_one({'foo': 'bar'})
+        im.drop_everything(strategy='truncate')
+        assert count_documents(im.db['cappedcoll']) == 0
+        assert 'foo_1' in im.db['cappedcoll'].index_information()
+
+
+def test_instant_mongo_drop_everything_unknown_strategy(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path) as im:
+        with raises(ValueError):
+            im.drop_everything(strategy='nonsense')
+
+
+def test_timings(needs_mongod, tmp_path, monkeypatch):
+    reported = []
+    monkeypatch.setattr(InstantMongoDB, 'timing_hooks', [lambda im, phase, seconds: reported.append(phase)])
+    with InstantMongoDB(tmp_path, as_replica_set=True) as im:
+        assert list(im.timings) == ['prepare_data_dir', 'allocate_port', 'spawn', 'wait_for_conns', 'init_rs', 'start']
+        assert im.timings['start'] >= im.timings['wait_for_conns'] > 0
+        im.client
+    assert list(im.timings)[-4:] == ['close_client', 'stop_mongod', 'delete_data_dir', 'stop']
+    assert reported == list(im.timings)
+
+
+@mark.parametrize('as_replica_set', [False, True])
+def test_unix_socket(needs_mongod, tmp_path, as_replica_set):
+    with InstantMongoDB(tmp_path, unix_socket=True, as_replica_set=as_replica_set) as im:
+        assert im.mongo_uri.startswith('mongodb://%2F')
+        assert im.mongo_uri.split('/')[2].endswith('mongod.sock')
+        if as_replica_set:
+            # the replica set config needs a TCP address
+            assert im.port
+        else:
+            assert im.port is None
+            assert '--port' not in im.mongod_cmd
+            assert '127.0.0.1' not in ' '.join(im.mongod_cmd)
+        im.db['testcoll'].insert_one({'foo': 'bar'})
+        assert im.db['testcoll'].find_one()['foo'] == 'bar'
+
+
+def test_unix_socket_with_long_data_dir_path(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path / ('x' * 100), unix_socket=True) as im:
+        assert len(str(im.unix_socket_path)) < 100
+        assert match(orphan_dir_name_pattern, im.unix_socket_path.parent.name)
+        assert im.client.admin.command('ping')['ok'] == 1
+    assert not im.unix_socket_path.parent.exists()
+
+
+def test_unix_socket_with_multi_member_replica_set():
+    with raises(ValueError):
+        InstantMongoDB(unix_socket=True, replica_set_members=3)
+
+
+@mark.parametrize('shutdown_strategy', ['graceful', 'terminate', 'kill'])
+def test_shutdown_strategy(needs_mongod, tmp_path, shutdown_strategy):
+    im = InstantMongoDB(tmp_path, shutdown_strategy=shutdown_strategy)
+    im.start()
+    process = im._mongodb_process
+    im.db['testcoll'].insert_one({'foo': 'bar'})
+    im.stop()
+    assert not process.is_alive()
+    assert list(tmp_path.iterdir()) == []
+    with raises(ValueError):
+        InstantMongoDB(shutdown_strategy='explode')
+
+
+def test_stop_without_waiting(needs_mongod, tmp_path):
+    im = InstantMongoDB(tmp_path, shutdown_strategy='kill')
+    im.start()
+    process = im._mongodb_process
+    im.stop(wait=False)
+    assert im.wait_stopped(timeout=10)
+    assert not process.is_alive()
+    assert list(tmp_path.iterdir()) == []
+    assert 'stop' in im.timings
+    # can be started again right away - start() waits for the background stop
+    im.start()
+    im.stop(wait=False)
+    im.start()
+    assert im.client.admin.command('ping')['ok'] == 1
+    im.stop()
+
+
+def test_stop_many(needs_mongod, tmp_path):
+    instances = InstantMongoDB.start_many(3, data_parent_dir=tmp_path)
+    processes = [im._mongodb_process for im in instances]
+    InstantMongoDB.stop_many(instances)
+    assert not any(process.is_alive() for process in processes)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_reap_orphans_at_start(needs_mongod, tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr('instant_mongo.instant_mongo.reap_orphans_throttled', lambda roots, interval: calls.append(roots))
+    with InstantMongoDB(tmp_path, reap_orphans=True):
+        pass
+    assert calls and tmp_path in calls[0]
+
+
+def run_in_forked_child(fn):
+    pid = fork()
+    if pid == 0:
+        try:
+            fn()
+        except BaseException:
+            print_exc()
+            _exit(1)
+        _exit(0)
+    _, status = waitpid(pid, 0)
+    try:
+        from os import waitstatus_to_exitcode
+    except ImportError:
+        # Python < 3.9
+        from os import WEXITSTATUS as waitstatus_to_exitcode
+    return waitstatus_to_exitcode(status)
+
+
+def test_fork(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path) as im:
+        client = im.client
+        client['test']['testcoll'].insert_one({'n': 1})
+        data_dir = im.data_dir
+
+        def child():
+            # the child gets its own client and doesn't stop MongoDB of the parent
+            assert im.client is not client
+            im.client['test']['testcoll'].insert_one({'n': 2})
+            im.stop()
+
+        assert run_in_forked_child(child) == 0
+        assert im.client is client
+        assert sorted(doc['n'] for doc in client['test']['testcoll'].find()) == [1, 2]
+        assert data_dir.is_dir()
+
+
+def test_fork_releases_clients_abandoned_at_previous_fork(needs_mongod, tmp_path):
+    from instant_mongo.instant_mongo import _clients_abandoned_at_fork
+    with InstantMongoDB(tmp_path) as im:
+        im.client.admin.command('ping')
+
+        def grandchild():
+            assert len(_clients_abandoned_at_fork) == 1
+
+        def child():
+            assert len(_clients_abandoned_at_fork) == 1
+            im.client.admin.command('ping')
+            assert run_in_forked_child(grandchild) == 0
+
+        assert run_in_forked_child(child) == 0
@@ -0,0 +1,26 @@
+from json import loads
+from os import environ
+from pathlib import Path
+from subprocess import check_call
+from sys import executable
+
+from pytest import mark
+
+
+benchmarks_dir = Path(__file__).resolve().parent.parent / 'benchmarks'
+
+
+# The full benchmark run takes a while (it starts a pool of 16 processes, among other things)
+@mark.skipif(not environ.get('RUN_BENCHMARKS'), reason='set RUN_BENCHMARKS=1 to run the benchmarks')
+def test_lifecycle_benchmark_with_fake_mongod(tmp_path):
+    output_path = tmp_path / 'results.json'
+    check_call([
+        executable, str(benchmarks_dir / 'bench_lifecycle.py'),
+        '--mongod', 'fake', '--repeat', '1', '--output', str(output_path)])
+    report = loads(output_path.read_text())
+    assert report['meta']['mongod'] == 'fake'
+    for name in 'standalone.start', 'replica_set.init_rs', 'drop_everything.drop.50_dbs', 'get_client.create_ping_close':
+        assert report['results'][name]['n'] == 1
+    check_call([
+        executable, str(benchmarks_dir / 'bench_lifecycle.py'),
+        '--mongod', 'fake', '--repeat', '1', '--compare', str(output_path)])
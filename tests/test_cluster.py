@@ -0,0 +1,49 @@
+from os import environ
+from subprocess import check_call
+
+from pytest import fixture, raises, skip
+
+from instant_mongo import InstantMongoCluster
+
+
+@fixture(scope='session')
+def needs_mongos(needs_mongod):
+    try:
+        check_call(['mongos', '--version'])
+    except FileNotFoundError:
+        if environ.get('CI'):
+            raise Exception('mongos not found - need to be installed in a CI environment (package mongodb-org-mongos)')
+        else:
+            skip('mongos not found')
+
+
+@fixture(scope='module')
+def cluster(needs_mongos, tmp_path_factory):
+    with InstantMongoCluster(tmp_path_factory.mktemp('instant-mongo-cluster'), shards=2) as cluster:
+        yield cluster
+
+
+def test_invalid_shard_count():
+    with raises(ValueError):
+        InstantMongoCluster(shards=0)
+
+
+def test_mongo_uri_before_start():
+    with raises(RuntimeError):
+        InstantMongoCluster().mongo_uri
+
+
+def test_cluster_is_mongos(cluster):
+    assert cluster.mongo_uri.startswith('mongodb://127.0.0.1:')
+    assert cluster.client.admin.command('hello')['msg'] == 'isdbgrid'
+
+
+def test_shard_collection(cluster):
+    cluster.shard_collection('test.users', {'user_id': 1}, split_points=[{'user_id': 100}, {'user_id': 200}])
+    cluster.db['users'].insert_many([{'user_id': i} for i in range(0, 300, 10)])
+    assert cluster.db['users'].count_documents({}) == 30
+    coll = cluster.get_new_test_db()['events']
+    cluster.shard_collection(coll, {'_id': 'hashed'})
+    coll.insert_one({'foo': 'bar'})
+    cluster.drop_everything()
+    assert cluster.db['users'].count_documents({}) == 0
@@ -0,0 +1,59 @@
+from instant_mongo import InstantMongoDB
+from instant_mongo.data_template import clone_data_dir, data_template_key, ensure_data_template
+
+
+def test_data_template_key_depends_on_version_and_args():
+    key = data_template_key('db version v7.0.0', ['--directoryperdb'])
+    assert key == data_template_key('db version v7.0.0', ['--directoryperdb'])
+    assert key != data_template_key('db version v8.0.0', ['--directoryperdb'])
+    assert key != data_template_key('db version v7.0.0', [])
+
+
+def test_ensure_data_template_initializes_only_once(tmp_path):
+    calls = []
+
+    def init_data_dir(path):
+        calls.append(path)
+        (path / 'WiredTiger').write_text('wt')
+        (path / 'mongod.lock').write_text('')
+        (path / 'admin').mkdir()
+        (path / 'admin' / 'collection.wt').write_text('data')
+
+    template_path = ensure_data_template(tmp_path / 'templates', 'abc', init_data_dir)
+    assert ensure_data_template(tmp_path / 'templates', 'abc', init_data_dir) == template_path
+    assert len(calls) == 1
+    assert (template_path / 'WiredTiger').read_text() == 'wt'
+    assert not (template_path / 'mongod.lock').exists()
+    # no leftover staging directories
+    assert sorted(p.name for p in (tmp_path / 'templates').iterdir()) == ['abc', 'abc.lock']
+
+
+def test_clone_data_dir(tmp_path):
+    template_path = tmp_path / 'template'
+    (template_path / 'admin').mkdir(parents=True)
+    (template_path / 'WiredTiger').write_text('wt')
+    (template_path / 'admin' / 'collection.wt').write_text('data')
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    clone_data_dir(template_path, data_dir)
+    assert (data_dir / 'WiredTiger').read_text() == 'wt'
+    assert (data_dir / 'admin' / 'collection.wt').read_text() == 'data'
+    # modifying the clone must not modify the template
+    (data_dir / 'admin' / 'collection.wt').write_text('changed')
+    assert (template_path / 'admin' / 'collection.wt').read_text() == 'data'
+
+
+def test_use_data_template(needs_mongod, tmp_path):
+    template_dir = tmp_path / 'templates'
+    for n in range(2):
+        with InstantMongoDB(tmp_path / 'data', use_data_template=True, data_template_dir=template_dir) as im:
+            im.db['testcoll'].insert_one({'n': n})
+            assert im.db['testcoll'].count_documents({}) == 1
+    assert len([p for p in template_dir.iterdir() if p.is_dir()]) == 1
+
+
+def test_use_data_template_as_replica_set(needs_mongod, tmp_path):
+    template_dir = tmp_path / 'templates'
+    with InstantMongoDB(tmp_path / 'data', use_data_template=True, data_template_dir=template_dir, as_replica_set=True) as im:
+        status = im.client['admin'].command('replSetGetStatus')
+        assert status['myState'] == 1
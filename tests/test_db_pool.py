@@ -0,0 +1,84 @@
+from pymongo import IndexModel
+from pytest import fixture, raises
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.db_pool import normalize_schema, schema_key
+
+
+@fixture(scope='module')
+def instant_mongo(needs_mongod, tmp_path_factory):
+    with InstantMongoDB(tmp_path_factory.mktemp('instant-mongo-db-pool')) as im:
+        yield im
+
+
+schema = {
+    'users': [IndexModel([('email', 1)], unique=True, name='email_1')],
+    'orders': [[('user_id', 1), ('created', -1)]],
+    'events': [],
+}
+
+
+def index_names(collection):
+    return sorted(spec['name'] for spec in collection.list_indexes())
+
+
+def test_schema_key():
+    assert schema_key(normalize_schema(schema)) == schema_key(normalize_schema(dict(reversed(list(schema.items())))))
+    assert schema_key(normalize_schema({'users': [{'email': 1}]})) == schema_key(normalize_schema({'users': [[('email', 1)]]}))
+    assert schema_key(normalize_schema({'users': []})) != schema_key(normalize_schema({'users': [{'email': 1}]}))
+    with raises(ValueError):
+        normalize_schema({'system.views': []})
+
+
+def test_lease_db(instant_mongo):
+    with instant_mongo.lease_db(schema) as db:
+        assert sorted(db.list_collection_names()) == ['events', 'orders', 'users']
+        assert index_names(db['users']) == ['_id_', 'email_1']
+        assert index_names(db['orders']) == ['_id_', 'user_id_1_created_-1']
+        db['users'].insert_one({'email': 'joe@example.com'})
+        db['users'].create_index('name')
+        db['orders'].drop()
+        db['other'].insert_one({})
+        db_name = db.name
+    assert len(instant_mongo.db_pool) == 1
+    with instant_mongo.lease_db(schema) as db:
+        # the same database, reset to the schema
+        assert db.name == db_name
+        assert sorted(db.list_collection_names()) == ['events', 'orders', 'users']
+        assert db['users'].find_one() is None
+        assert index_names(db['users']) == ['_id_', 'email_1']
+        assert index_names(db['orders']) == ['_id_', 'user_id_1_created_-1']
+        with instant_mongo.lease_db(schema) as db2:
+            assert db2.name != db_name
+        with instant_mongo.lease_db({'events': []}) as db3:
+            assert db3.name not in (db_name, db2.name)
+            assert db3.list_collection_names() == ['events']
+    assert len(instant_mongo.db_pool) == 3
+    instant_mongo.drop_everything()
+    assert len(instant_mongo.db_pool) == 0
+
+
+def test_lease_db_after_cleanup_dirty(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path, track_writes=True) as im:
+        with im.lease_db(schema) as db:
+            db['users'].insert_one({'email': 'joe@example.com'})
+            db_name = db.name
+        im.cleanup_dirty()
+        with im.lease_db(schema) as db:
+            assert db.name == db_name
+            assert sorted(db.list_collection_names()) == ['events', 'orders', 'users']
+            assert index_names(db['users']) == ['_id_', 'email_1']
+            assert index_names(db['orders']) == ['_id_', 'user_id_1_created_-1']
+
+
+def test_lease_db_rebuilds_schema_changed_outside_pool(instant_mongo):
+    with instant_mongo.lease_db(schema) as db:
+        db_name = db.name
+    instant_mongo.client[db_name].drop_collection('orders')
+    instant_mongo.client[db_name]['users'].drop_index('email_1')
+    with instant_mongo.lease_db(schema) as db:
+        assert db.name == db_name
+        assert sorted(db.list_collection_names()) == ['events', 'orders', 'users']
+        assert index_names(db['users']) == ['_id_', 'email_1']
+        assert index_names(db['orders']) == ['_id_', 'user_id_1_created_-1']
+    instant_mongo.drop_everything()
@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from json import dumps
+
+from bson import ObjectId, encode
+from pytest import fixture, raises
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.fixtures import find_fixture_files, iter_raw_documents
+
+
+@fixture(scope='module')
+def instant_mongo(needs_mongod, tmp_path_factory):
+    with InstantMongoDB(tmp_path_factory.mktemp('instant-mongo-fixtures')) as im:
+        yield im
+
+
+@fixture
+def im(instant_mongo):
+    yield instant_mongo
+    instant_mongo.drop_everything()
+
+
+@fixture
+def fixtures_dir(tmp_path):
+    d = tmp_path / 'fixtures'
+    d.mkdir()
+    (d / 'users.json').write_text(dumps([
+        {'_id': {'$oid': '5f0000000000000000000001'}, 'name': 'alice', 'created': {'$date': '2020-01-02T03:04:05Z'}},
+        {'_id': {'$oid': '5f0000000000000000000002'}, 'name': 'bob'},
+    ]))
+    (d / 'users.metadata.json').write_text(dumps({
+        'options': {},
+        'indexes': [
+            {'v': 2, 'key': {'_id': 1}, 'name': '_id_'},
+            {'v': 2, 'key': {'name': 1}, 'name': 'name_1', 'unique': True},
+        ],
+    }))
+    (d / 'events.jsonl').write_text('\n'.join(dumps({'n': i}) for i in range(25)) + '\n\n')
+    (d / 'items.bson').write_bytes(b''.join(encode({'i': i}) for i in range(10)))
+    (d / 'README.txt').write_text('not a fixture')
+    return d
+
+
+def test_find_fixture_files(fixtures_dir):
+    collections = find_fixture_files(fixtures_dir)
+    assert sorted(collections) == ['events', 'items', 'users']
+    assert collections['users'] == ([fixtures_dir / 'users.json'], fixtures_dir / 'users.metadata.json')
+    assert collections['items'] == ([fixtures_dir / 'items.bson'], None)
+    with raises(ValueError):
+        find_fixture_files(fixtures_dir / 'README.txt')
+
+
+def test_iter_raw_documents_parses_extended_json(fixtures_dir):
+    docs = [doc.raw for doc in iter_raw_documents(fixtures_dir / 'users.json')]
+    assert docs[0] == encode({
+        '_id': ObjectId('5f0000000000000000000001'),
+        'name': 'alice',
+        'created': datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+    })
+    assert len(list(iter_raw_documents(fixtures_dir / 'events.jsonl'))) == 25
+    assert [doc['i'] for doc in iter_raw_documents(fixtures_dir / 'items.bson')] == list(range(10))
+
+
+def test_iter_raw_documents_uses_cache(fixtures_dir, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    first = [doc.raw for doc in iter_raw_documents(fixtures_dir / 'events.jsonl', cache_dir)]
+    cache_files = list(cache_dir.iterdir())
+    assert len(cache_files) == 1
+    assert cache_files[0].suffix == '.bson'
+    assert [doc.raw for doc in iter_raw_documents(fixtures_dir / 'events.jsonl', cache_dir)] == first
+    # changed content gets a new cache entry
+    (fixtures_dir / 'events.jsonl').write_text(dumps({'n': 100}))
+    assert [doc['n'] for doc in iter_raw_documents(fixtures_dir / 'events.jsonl', cache_dir)] == [100]
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_iter_raw_documents_streams_json_array(tmp_path, monkeypatch):
+    monkeypatch.setattr('instant_mongo.fixtures.json_chunk_size', 7)
+    p = tmp_path / 'docs.json'
+    p.write_text(dumps([{'n': i, 's': 'x' * i, '_id': {'$oid': f'5f00000000000000000000{i:02d}'}} for i in range(20)], indent=2))
+    docs = list(iter_raw_documents(p))
+    assert [doc['n'] for doc in docs] == list(range(20))
+    assert docs[3]['_id'] == ObjectId('5f0000000000000000000003')
+    p.write_text(' [ ] ')
+    assert list(iter_raw_documents(p)) == []
+    p.write_text(dumps({'n': 1}))
+    assert [doc['n'] for doc in iter_raw_documents(p)] == [1]
+
+
+def test_iter_raw_documents_invalid_json_leaves_no_temporary_file(tmp_path):
+    p = tmp_path / 'broken.json'
+    p.write_text('[{"n": 1}, {"n": ')
+    cache_dir = tmp_path / 'cache'
+    with raises(ValueError):
+        list(iter_raw_documents(p, cache_dir))
+    assert list(cache_dir.iterdir()) == []
+
+
+def test_iter_raw_documents_same_content_in_parallel(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    paths = []
+    for i in range(8):
+        paths.append(tmp_path / f'docs{i}.json')
+        paths[-1].write_text(dumps([{'n': n} for n in range(1000)]))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda p: [doc['n'] for doc in iter_raw_documents(p, cache_dir)], paths))
+    assert results == [list(range(1000))] * 8
+    assert [p.suffix for p in cache_dir.iterdir()] == ['.bson']
+
+
+def test_iter_raw_documents_truncated_bson(tmp_path):
+    p = tmp_path / 'broken.bson'
+    p.write_bytes(encode({'a': 1}) + encode({'b': 2})[:7])
+    with raises(ValueError):
+        list(iter_raw_documents(p))
+
+
+def test_load_fixtures(im, fixtures_dir, tmp_path):
+    counts = im.load_fixtures(fixtures_dir, batch_size=7, cache_dir=tmp_path / 'cache')
+    assert counts == {'events': 25, 'items': 10, 'users': 2}
+    assert im.db['users'].find_one({'name': 'alice'})['_id'] == ObjectId('5f0000000000000000000001')
+    assert sorted(doc['n'] for doc in im.db['events'].find()) == list(range(25))
+    assert 'name_1' in im.db['users'].index_information()
+
+
+def test_load_fixtures_single_file_into_named_db(im, fixtures_dir):
+    assert im.load_fixtures(fixtures_dir / 'items.bson', db='seeded', use_cache=False) == {'items': 10}
+    assert im.client['seeded']['items'].count_documents({}) == 10
@@ -0,0 +1,77 @@
+from threading import Event, active_count, enumerate as enumerate_threads
+from time import monotonic, sleep
+
+from pytest import mark
+
+from instant_mongo import log_pump as log_pump_module
+from instant_mongo.log_pump import LogPump
+
+
+def wait_for(condition, timeout=5):
+    deadline = monotonic() + timeout
+    while not condition():
+        assert monotonic() < deadline, 'Condition not met in time'
+        sleep(0.005)
+
+
+def pump_threads():
+    return [t for t in enumerate_threads() if t.name == 'instant_mongo_log_pump']
+
+
+@mark.parametrize('use_inotify', [True, False])
+def test_log_pump_follows_multiple_files_with_one_thread(tmp_path, monkeypatch, use_inotify):
+    if not use_inotify:
+        monkeypatch.setattr(log_pump_module, 'inotify_available', lambda: False)
+    threads_before = active_count()
+    pump = LogPump()
+    paths = [tmp_path / f'out{i}.log' for i in range(5)]
+    for path in paths:
+        path.write_bytes(b'existing line\n')
+    lines = {path: [] for path in paths}
+    followers = [pump.follow(path, lines[path].append) for path in paths]
+    assert len(pump_threads()) == 1
+    with paths[2].open('ab') as f:
+        f.write(b'hello\nwor')
+        f.flush()
+        wait_for(lambda: lines[paths[2]] == ['existing line', 'hello'])
+        f.write(b'ld\nincomplete')
+        f.flush()
+        wait_for(lambda: lines[paths[2]] == ['existing line', 'hello', 'world'])
+    for follower in followers:
+        pump.unfollow(follower)
+    # rest of the file is read on unfollow
+    assert lines[paths[2]] == ['existing line', 'hello', 'world', 'incomplete']
+    assert lines[paths[0]] == ['existing line']
+    # the thread exits when nothing is followed
+    assert active_count() == threads_before
+    # ... and is started again when needed
+    follower = pump.follow(paths[0], lines[paths[0]].append)
+    assert len(pump_threads()) == 1
+    pump.unfollow(follower)
+    assert active_count() == threads_before
+
+
+def test_log_pump_survives_callback_errors(tmp_path):
+    pump = LogPump()
+    path = tmp_path / 'out.log'
+    path.write_bytes(b'a\nb\n')
+    received = []
+    done = Event()
+
+    def callback(line):
+        received.append(line)
+        if line == 'a':
+            raise ValueError('boom')
+        done.set()
+
+    follower = pump.follow(path, callback)
+    assert done.wait(5)
+    pump.unfollow(follower)
+    assert received == ['a', 'b']
+
+
+def test_log_pump_missing_file(tmp_path):
+    pump = LogPump()
+    follower = pump.follow(tmp_path / 'missing.log', print)
+    pump.unfollow(follower)
+    assert pump_threads() == []
@@ -0,0 +1,74 @@
+from logging import DEBUG
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.mongod_log import SlowOp, SlowOpsBuffer, parse_log_line
+
+
+slow_query_line = (
+    '{"t":{"$date":"2024-05-20T20:10:08.731+00:00"},"s":"I","c":"COMMAND","id":51803,"ctx":"conn12",'
+    '"msg":"Slow query","attr":{"type":"command","ns":"test.users","command":{"find":"users","filter":{"age":42}},'
+    '"planSummary":"COLLSCAN","keysExamined":0,"docsExamined":5489,"nreturned":1,"durationMillis":61}}')
+
+
+def test_parse_log_line():
+    record = parse_log_line(slow_query_line)
+    assert record.timestamp == '2024-05-20T20:10:08.731+00:00'
+    assert record.severity == 'I'
+    assert record.component == 'COMMAND'
+    assert record.id == 51803
+    assert record.context == 'conn12'
+    assert record.msg == 'Slow query'
+    assert record.attr['ns'] == 'test.users'
+    op = SlowOp(record)
+    assert op.ns == 'test.users'
+    assert op.command_name == 'find'
+    assert op.is_collscan
+    assert (op.docs_examined, op.n_returned, op.duration_ms) == (5489, 1, 61)
+
+
+def test_parse_log_line_not_json():
+    assert parse_log_line('2019-03-01T10:00:00.000+0000 I NETWORK  [initandlisten] waiting for connections') is None
+    assert parse_log_line('{broken') is None
+    assert parse_log_line('') is None
+
+
+def test_slow_ops_buffer_reads_incrementally(tmp_path):
+    path = tmp_path / 'mongod-stdout.log'
+    hello_line = slow_query_line.replace('test.users', 'admin.$cmd')
+    path.write_text(f'{hello_line}\n{slow_query_line}\n{slow_query_line[:50]}')
+    buf = SlowOpsBuffer()
+    buf.refresh([path, tmp_path / 'missing.log'])
+    assert [op.ns for op in buf] == ['test.users']
+    with path.open('a') as f:
+        f.write(slow_query_line[50:] + '\n')
+    buf.refresh([path])
+    assert len(buf) == 2
+    buf.clear()
+    assert list(buf) == []
+    # truncated file is read from the beginning
+    path.write_text(f'{slow_query_line}\n')
+    buf.refresh([path])
+    assert len(buf) == 1
+    # a file rewritten by a restarted mongod may be already longer than the old one
+    buf.forget(path)
+    path.write_text(f'{slow_query_line}\n' * 3)
+    buf.refresh([path])
+    assert len(buf) == 4
+
+
+def test_slow_ops(needs_mongod, tmp_path, caplog):
+    caplog.set_level(DEBUG, logger='instant_mongo')
+    with InstantMongoDB(tmp_path, slow_ms=0, follow_logs=True) as im:
+        assert im.mongod_cmd[im.mongod_cmd.index('--slowms') + 1] == '0'
+        im.clear_slow_ops()
+        im.db['users'].insert_many([{'age': n} for n in range(10)])
+        assert im.db['users'].find_one({'age': 5})
+        ops = [op for op in im.slow_ops if op.ns == 'test.users' and op.command_name == 'find']
+        assert ops
+        assert ops[0].docs_examined > 0
+        im.clear_slow_ops()
+        assert im.slow_ops == []
+        im.db['users'].find_one({'age': 7})
+    # still available after the data dir was deleted
+    assert [op.command_name for op in im.slow_ops] == ['find']
+    assert any(getattr(r, 'mongod_log', None) is not None for r in caplog.records)
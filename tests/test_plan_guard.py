@@ -0,0 +1,77 @@
+from datetime import datetime
+from json import loads
+
+from pytest import raises, warns
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.plan_guard import PlanGuard, ProfiledQuery, QueryPlanError, QueryPlanWarning
+
+
+def profile_doc(**kwargs):
+    doc = {
+        'op': 'query',
+        'ns': 'test.users',
+        'command': {'find': 'users', 'filter': {'age': {'$in': [41, 42]}, 'name': 'Bob'}},
+        'planSummary': 'IXSCAN { age: 1 }',
+        'keysExamined': 2,
+        'docsExamined': 2,
+        'nreturned': 2,
+        'millis': 0,
+        'ts': datetime(2024, 5, 20, 10, 0, 0),
+    }
+    doc.update(kwargs)
+    return doc
+
+
+def test_query_shape():
+    query = ProfiledQuery(profile_doc(command={'find': 'users', 'filter': {'age': {'$in': [41, 42]}}, 'sort': {'name': 1}}))
+    assert query.command_name == 'find'
+    assert query.shape == {'ns': 'test.users', 'command': 'find', 'filter': {'age': {'$in': ['?']}}, 'sort': {'name': 1}}
+
+
+def test_find_issues():
+    guard = PlanGuard()
+    assert guard.find_issues(ProfiledQuery(profile_doc())) == []
+    kinds = lambda **kwargs: [issue.kind for issue in guard.find_issues(ProfiledQuery(profile_doc(**kwargs)))]
+    assert kinds(planSummary='COLLSCAN', docsExamined=5, nreturned=1) == ['COLLSCAN']
+    assert kinds(hasSortStage=True) == ['SORT']
+    assert kinds(keysExamined=500, docsExamined=500, nreturned=3) == ['ratio']
+    assert kinds(op='update', nreturned=None, nMatched=100, keysExamined=100, docsExamined=100) == []
+    assert PlanGuard(allow_collscan=True).find_issues(ProfiledQuery(profile_doc(planSummary='COLLSCAN'))) == []
+    with raises(ValueError):
+        PlanGuard(mode='explode')
+
+
+def test_plan_guard_option(tmp_path):
+    assert InstantMongoDB(tmp_path, plan_guard=None).plan_guard is None
+    assert InstantMongoDB(tmp_path, plan_guard=False).plan_guard is None
+    assert InstantMongoDB(tmp_path, plan_guard=True).plan_guard.mode == 'warn'
+    assert InstantMongoDB(tmp_path, plan_guard='fail').plan_guard.mode == 'fail'
+    guard = PlanGuard(mode='fail')
+    assert InstantMongoDB(tmp_path, plan_guard=guard).plan_guard is guard
+    with raises(ValueError):
+        InstantMongoDB(tmp_path, plan_guard='explode')
+
+
+def test_plan_guard(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path, plan_guard='fail') as im:
+        db = im.get_new_test_db()
+        db['users'].insert_many([{'name': f'user{n}', 'age': n} for n in range(100)])
+        im.plan_guard.reset()
+        assert db['users'].find_one({'age': 42})['name'] == 'user42'
+        with raises(QueryPlanError) as exc_info:
+            im.plan_guard.check()
+        assert 'collection scan' in str(exc_info.value)
+        # already reported issues are not reported again
+        assert im.plan_guard.check() == []
+        im.plan_guard.mode = 'warn'
+        db['users'].find_one({'age': 43})
+        with warns(QueryPlanWarning):
+            im.plan_guard.check()
+        report_path = tmp_path / 'report.json'
+        im.plan_guard.write_report(report_path)
+        report = loads(report_path.read_text())
+        query, = report['queries']
+        assert query['shape'] == {'ns': db.name + '.users', 'command': 'find', 'filter': {'age': '?'}}
+        assert query['count'] == 2
+        assert [issue['kind'] for issue in report['issues']] == ['COLLSCAN', 'ratio', 'COLLSCAN', 'ratio']
@@ -0,0 +1,80 @@
+from pytest import raises
+
+from instant_mongo import InstantMongoPool
+
+
+def test_pool_acquire_and_release(needs_mongod, tmp_path):
+    with InstantMongoPool(size=2, data_parent_dir=tmp_path) as pool:
+        im1 = pool.acquire()
+        im2 = pool.acquire()
+        assert im1 is not im2
+        assert im1.mongo_uri != im2.mongo_uri
+        im1.db['testcoll'].insert_one({'foo': 'bar'})
+        pool.release(im1)
+        pool.release(im2)
+
+
+def test_pool_resets_released_instances(needs_mongod, tmp_path):
+    with InstantMongoPool(size=1, data_parent_dir=tmp_path) as pool:
+        for _ in range(3):
+            with pool.instance() as im:
+                assert 'testcoll' not in im.db.list_collection_names()
+                im.db['testcoll'].insert_one({'foo': 'bar'})
+
+
+def test_pool_reuses_released_instances(needs_mongod, tmp_path):
+    with InstantMongoPool(size=2, data_parent_dir=tmp_path) as pool:
+        im = pool.acquire()
+        pid = im._mongodb_process.pid
+        im.db['testcoll'].insert_one({'foo': 'bar'})
+        pool.release(im)
+        acquired = [pool.acquire() for _ in range(2)]
+        assert im in acquired
+        assert im._mongodb_process.pid == pid
+        assert 'testcoll' not in im.db.list_collection_names()
+        # nothing left to reuse - a new instance is started
+        im3 = pool.acquire()
+        assert im3 not in acquired
+        for acquired_im in acquired + [im3]:
+            pool.release(acquired_im)
+    assert im3._mongodb_process is None
+
+
+def test_pool_keeps_size_instances_ready(needs_mongod, tmp_path):
+    with InstantMongoPool(size=1, data_parent_dir=tmp_path) as pool:
+        im1 = pool.acquire()
+        # a replacement is started in the background right away
+        pool._ready[0].result(timeout=60)
+        im2 = pool.acquire(timeout=0)
+        assert im2 is not im1
+        pool.release(im1)
+        pool.release(im2)
+
+
+def test_pool_max_instances(needs_mongod, tmp_path):
+    with raises(ValueError):
+        InstantMongoPool(size=2, max_instances=1)
+    with InstantMongoPool(size=1, max_instances=1, data_parent_dir=tmp_path) as pool:
+        im = pool.acquire()
+        with raises(TimeoutError):
+            pool.acquire(timeout=0.1)
+        pool.release(im)
+        assert pool.acquire(timeout=60) is im
+        pool.release(im)
+
+
+def test_pool_stop_stops_acquired_instances(needs_mongod, tmp_path):
+    with InstantMongoPool(size=1, data_parent_dir=tmp_path) as pool:
+        im = pool.acquire()
+        assert im._mongodb_process is not None
+    assert im._mongodb_process is None
+
+
+def test_pool_rejects_shared_data_dir(tmp_path):
+    with raises(ValueError):
+        InstantMongoPool(data_dir=tmp_path)
+
+
+def test_pool_acquire_before_start():
+    with raises(RuntimeError):
+        InstantMongoPool().acquire()
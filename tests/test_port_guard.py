@@ -1,6 +1,8 @@
+from multiprocessing import get_context
 from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
 
-from instant_mongo.port_guard import PortGuard
+from instant_mongo import port_guard
+from instant_mongo.port_guard import PortGuard, default_port_range, default_start_port
 
 
 def test_get_available_port():
@@ -65,3 +67,57 @@ def test_close_clears_guard_sockets_list():
     assert len(pg._guard_sockets) > 0
     pg.close()
     assert pg._guard_sockets == []
+
+
+def test_default_start_port_depends_on_pid():
+    assert default_start_port(1000) != default_start_port(1001)
+    for pid in range(1000, 1100):
+        port = default_start_port(pid)
+        assert port % 2 == 0
+        assert default_port_range[0] <= port < default_port_range[1]
+
+
+def test_leased_port_is_not_handed_out_again(tmp_path):
+    with PortGuard(start_port=18100, lease_dir=tmp_path) as pg1:
+        port = pg1.get_available_port()
+        # even without the guard socket the port stays leased until pg1 is closed
+        for sock in pg1._guard_sockets:
+            sock.close()
+        with PortGuard(start_port=18100, lease_dir=tmp_path) as pg2:
+            assert pg2.get_available_port() != port
+    with PortGuard(start_port=18100, lease_dir=tmp_path) as pg3:
+        assert pg3.get_available_port() == port
+
+
+def test_port_guard_without_registry(tmp_path):
+    with PortGuard(lease_dir=tmp_path, use_registry=False) as pg:
+        assert pg.get_available_port() > 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def _allocate_ports_and_wait(lease_dir, barrier, queue):
+    with PortGuard(lease_dir=lease_dir) as pg:
+        ports = [pg.get_available_port() for _ in range(5)]
+        # release the guard sockets - only the leases protect the ports now
+        for sock in pg._guard_sockets:
+            sock.close()
+        barrier.wait()
+        queue.put(ports)
+        barrier.wait()
+
+
+def test_concurrent_processes_get_unique_ports(tmp_path, monkeypatch):
+    # all processes start at the same port so that they really compete
+    monkeypatch.setattr(port_guard, 'default_start_port', lambda: port_guard.default_port_range[0] + port_guard.port_slot_size)
+    ctx = get_context('fork')
+    count = 8
+    barrier = ctx.Barrier(count)
+    queue = ctx.Queue()
+    processes = [ctx.Process(target=_allocate_ports_and_wait, args=(tmp_path, barrier, queue)) for _ in range(count)]
+    for p in processes:
+        p.start()
+    ports = [port for _ in range(count) for port in queue.get(timeout=30)]
+    for p in processes:
+        p.join(30)
+        assert p.exitcode == 0
+    assert len(set(ports)) == len(ports) == count * 5
@@ -0,0 +1,55 @@
+from pytest import raises
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.profiles import MongodProfile, get_mongod_profile, merge_args, shm_dir
+
+
+def test_get_mongod_profile():
+    assert get_mongod_profile('fast').name == 'fast'
+    custom = MongodProfile('custom', args=['--quiet'])
+    assert get_mongod_profile(custom) is custom
+    with raises(ValueError):
+        get_mongod_profile('turbo')
+    with raises(ValueError):
+        InstantMongoDB(mongod_profile='turbo')
+
+
+def test_merge_args_overrides_options():
+    args = [
+        '--wiredTigerCacheSizeGB', '1',
+        '--setParameter', 'diagnosticDataCollectionEnabled=false',
+        '--setParameter', 'enableFlowControl=false',
+        '--quiet',
+    ]
+    assert merge_args(args, ['--wiredTigerCacheSizeGB', '2', '--setParameter', 'enableFlowControl=true']) == [
+        '--setParameter', 'diagnosticDataCollectionEnabled=false',
+        '--quiet',
+        '--wiredTigerCacheSizeGB', '2',
+        '--setParameter', 'enableFlowControl=true',
+    ]
+    assert merge_args(args, ['--setParameter=diagnosticDataCollectionEnabled=true']) == [
+        '--wiredTigerCacheSizeGB', '1',
+        '--setParameter', 'enableFlowControl=false',
+        '--quiet',
+        '--setParameter=diagnosticDataCollectionEnabled=true',
+    ]
+    assert merge_args(args, []) == args
+
+
+def test_default_profile_cmd(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path) as im:
+        cmd = im.mongod_cmd
+        assert cmd[cmd.index('--wiredTigerCacheSizeGB') + 1] == '1'
+        assert '--setParameter' not in cmd
+
+
+def test_fast_profile(needs_mongod):
+    with InstantMongoDB(mongod_profile='fast', as_replica_set=True, extra_args=['--oplogSize', '32']) as im:
+        cmd = im.mongod_cmd
+        assert 'diagnosticDataCollectionEnabled=false' in cmd
+        assert cmd.count('--oplogSize') == 1
+        assert cmd[cmd.index('--oplogSize') + 1] == '32'
+        if shm_dir():
+            assert im.data_dir.parts[:3] == ('/', 'dev', 'shm')
+        im.db['test'].insert_one({'foo': 'bar'})
+        assert im.db['test'].find_one()['foo'] == 'bar'
@@ -0,0 +1,75 @@
+from subprocess import Popen
+from time import monotonic
+
+from pytest import raises
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.readiness import describe_mongod_failure, is_waiting_for_connections, wait_for_log_line
+
+
+def test_is_waiting_for_connections():
+    assert is_waiting_for_connections(
+        '{"t":{"$date":"2026-01-01T00:00:00.000+00:00"},"s":"I","c":"NETWORK","id":23016,'
+        '"ctx":"listener","msg":"Waiting for connections","attr":{"port":19001,"ssl":"off"}}')
+    assert is_waiting_for_connections('2017-03-09T10:00:00.000+0100 I NETWORK  [thread1] waiting for connections on port 27017')
+    assert not is_waiting_for_connections('{"s":"I","c":"CONTROL","id":20698,"msg":"***** SERVER RESTARTED *****"}')
+
+
+def test_wait_for_log_line(tmp_path):
+    log_path = tmp_path / 'out.log'
+    with log_path.open('wb') as f:
+        p = Popen(['sh', '-c', 'echo starting; sleep 0.2; echo "Waiting for connections"; sleep 10'], stdout=f)
+    try:
+        assert wait_for_log_line(log_path, is_waiting_for_connections, p.pid, lambda: p.poll() is None, timeout=5)
+    finally:
+        p.kill()
+        p.wait()
+
+
+def test_wait_for_log_line_process_exited(tmp_path):
+    log_path = tmp_path / 'out.log'
+    with log_path.open('wb') as f:
+        p = Popen(['sh', '-c', 'echo starting; exit 3'], stdout=f)
+    t = monotonic()
+    assert not wait_for_log_line(log_path, is_waiting_for_connections, p.pid, lambda: p.poll() is None, timeout=5)
+    assert monotonic() - t < 1
+    p.wait()
+
+
+def test_wait_for_log_line_timeout(tmp_path):
+    log_path = tmp_path / 'out.log'
+    with log_path.open('wb') as f:
+        p = Popen(['sh', '-c', 'echo starting; sleep 10'], stdout=f)
+    try:
+        with raises(TimeoutError):
+            wait_for_log_line(log_path, is_waiting_for_connections, p.pid, lambda: p.poll() is None, timeout=.3)
+    finally:
+        p.kill()
+        p.wait()
+
+
+def test_describe_mongod_failure(tmp_path):
+    stdout_path = tmp_path / 'mongod-stdout.log'
+    stderr_path = tmp_path / 'mongod-stderr.log'
+    stdout_path.write_text(
+        '{"s":"I","c":"CONTROL","id":20698,"msg":"***** SERVER RESTARTED *****"}\n'
+        '{"s":"E","c":"CONTROL","id":20568,"msg":"Error setting up listener","attr":{"error":"Address already in use"}}\n')
+    stderr_path.write_text('')
+    description = describe_mongod_failure(stdout_path, stderr_path, 48)
+    assert 'Error setting up listener: Address already in use' in description
+    assert 'exit code 48' in description
+
+
+def test_start_failure_is_reported_immediately(tmp_path):
+    fake_mongod = tmp_path / 'failing-mongod'
+    fake_mongod.write_text(
+        '#!/bin/sh\n'
+        'echo \'{"s":"F","c":"CONTROL","id":20574,"msg":"Error during global initialization",'
+        '"attr":{"error":"BadValue: unknown option"}}\'\n'
+        'exit 2\n')
+    fake_mongod.chmod(0o755)
+    t = monotonic()
+    with raises(Exception, match='BadValue: unknown option'):
+        with InstantMongoDB(tmp_path / 'data', mongod_bin=str(fake_mongod)):
+            pass
+    assert monotonic() - t < InstantMongoDB.wait_timeout / 2
@@ -0,0 +1,64 @@
+from os import fork, waitpid, _exit
+from threading import enumerate as enumerate_threads
+
+from pytest import fixture
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.reaper import find_orphan_dirs, reap_orphans, reap_orphans_throttled
+from instant_mongo.util import is_pid_alive
+
+
+@fixture
+def dead_pid():
+    pid = fork()
+    if pid == 0:
+        _exit(0)
+    waitpid(pid, 0)
+    return pid
+
+
+def start_orphaned_mongod(data_dir):
+    im = InstantMongoDB(data_dir=data_dir, delete_data_dir_on_exit=False)
+    im.start()
+    pid = im._mongodb_process.pid
+    im._mongodb_process.detach()
+    im.stop()
+    return pid
+
+
+def test_find_orphan_dirs(tmp_path, dead_pid):
+    (tmp_path / f'instant-mongo.{dead_pid}.abc').mkdir()
+    (tmp_path / f'instant-mongo-data.{dead_pid}.123').mkdir()
+    (tmp_path / 'instant-mongo.1.abc').mkdir()  # PID 1 is alive
+    (tmp_path / f'other.{dead_pid}.abc').mkdir()
+    orphans = find_orphan_dirs([tmp_path])
+    assert sorted(o.path.name for o in orphans) == [f'instant-mongo-data.{dead_pid}.123', f'instant-mongo.{dead_pid}.abc']
+    assert [o.owner_pid for o in orphans] == [dead_pid, dead_pid]
+    assert [o.mongod_pids for o in orphans] == [[], []]
+
+
+def test_reap_orphans(needs_mongod, tmp_path, dead_pid):
+    orphan_dir = tmp_path / f'instant-mongo.{dead_pid}.abc'
+    mongod_pid = start_orphaned_mongod(orphan_dir / f'instant-mongo-data.{dead_pid}.123')
+    assert is_pid_alive(mongod_pid)
+    orphan, = reap_orphans([tmp_path], dry_run=True)
+    assert orphan.mongod_pids == [mongod_pid]
+    assert orphan_dir.exists()
+    reap_orphans([tmp_path])
+    assert not is_pid_alive(mongod_pid)
+    assert not orphan_dir.exists()
+
+
+def test_reap_orphans_throttled(tmp_path, dead_pid):
+    stamp_path = tmp_path / 'stamp'
+    (tmp_path / f'instant-mongo.{dead_pid}.abc').mkdir()
+    (tmp_path / f'instant-mongo.{dead_pid}.def').mkdir()
+    assert len(reap_orphans_throttled([tmp_path], stamp_path=stamp_path)) == 2
+    # the directories are deleted in the background
+    for t in enumerate_threads():
+        if t.name == 'instant_mongo_reaper':
+            t.join()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['stamp']
+    (tmp_path / f'instant-mongo.{dead_pid}.ghi').mkdir()
+    assert reap_orphans_throttled([tmp_path], stamp_path=stamp_path) is None
+    assert len(reap_orphans_throttled([tmp_path], interval=0, stamp_path=stamp_path)) == 1
@@ -0,0 +1,68 @@
+from asyncio import run
+
+from pymongo import WriteConcern
+from pytest import raises
+
+from instant_mongo import InstantMongoDB, SharedInstantMongoDB
+from instant_mongo.util import is_pid_alive
+
+
+def test_invalid_replica_set_options(tmp_path):
+    with raises(ValueError):
+        InstantMongoDB(replica_set_members=0)
+    with raises(ValueError):
+        InstantMongoDB(replica_set_members=2, replica_set_hidden=2)
+    with raises(ValueError):
+        SharedInstantMongoDB(data_dir=tmp_path / 'data', replica_set_members=3)
+    assert InstantMongoDB(replica_set_members=3).as_replica_set
+
+
+def test_replica_set_with_arbiter_and_hidden_member(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path, replica_set_members=3, replica_set_arbiters=1, replica_set_hidden=1) as im:
+        hosts = im.mongo_uri.split('//')[1].split('/')[0].split(',')
+        assert len(hosts) == 2
+        assert im.mongo_uri.endswith('replicaSet=test-rs')
+        hello = im.client.admin.command('hello')
+        assert sorted(hello['hosts']) == sorted(hosts)
+        assert len(hello['arbiters']) == 1
+        im.db.get_collection('test', write_concern=WriteConcern(w='majority')).insert_one({'foo': 'bar'})
+        assert im.db['test'].find_one()['foo'] == 'bar'
+        pids = [m.process.pid for m in im._rs_members]
+        data_dirs = [m.data_dir for m in im._rs_members]
+        assert {d.parent for d in data_dirs} == {im.data_dir.parent}
+    assert not any(is_pid_alive(pid) for pid in pids)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_step_down_and_kill_member(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path, replica_set_members=3) as im:
+        primary = im.wait_for_primary()
+        new_primary = im.step_down()
+        assert new_primary != primary
+        im.db['test'].insert_one({'n': 1})
+        im.kill_member(new_primary)
+        assert im.wait_for_primary() not in (primary, new_primary)
+        im.db['test'].insert_one({'n': 2})
+        with raises(RuntimeError):
+            im.start_member(primary)
+        im.start_member(new_primary)
+        im.wait_for_primary()
+
+
+def test_astart_replica_set_members(needs_mongod, tmp_path):
+    async def main():
+        async with InstantMongoDB(tmp_path, replica_set_members=2, replica_set_arbiters=1) as im:
+            assert im.mongo_uri.count(',') == 1
+            # sync client - AsyncMongoClient is not available in older pymongo versions
+            im.client.test.test.insert_one({'foo': 'bar'})
+            assert im.client.test.test.find_one()['foo'] == 'bar'
+
+    run(main())
+
+
+def test_astart_replica_set(needs_mongod, tmp_path):
+    async def main():
+        async with InstantMongoDB(tmp_path, as_replica_set=True) as im:
+            assert im.client.admin.command('hello')['setName'] == 'test-rs'
+
+    run(main())
@@ -0,0 +1,89 @@
+from multiprocessing import get_context
+
+from pytest import raises
+
+from instant_mongo import SharedInstantMongoDB
+from instant_mongo.util import is_pid_alive
+
+
+def test_shared_server_is_stopped_by_last_client(needs_mongod, tmp_path):
+    data_dir = tmp_path / 'shared'
+    im1 = SharedInstantMongoDB(data_dir=data_dir)
+    im2 = SharedInstantMongoDB(data_dir=data_dir)
+    im1.start()
+    try:
+        im2.start()
+        assert im1.port == im2.port
+        mongod_pid = im1._mongodb_process.pid
+        assert im2._mongodb_process.pid == mongod_pid
+        im1.get_new_test_db()['testcoll'].insert_one({'foo': 'bar'})
+        im1.stop()
+        assert is_pid_alive(mongod_pid)
+        im2.db['testcoll'].insert_one({'foo': 'bar'})
+    finally:
+        im1.stop()
+        im2.stop()
+    assert not is_pid_alive(mongod_pid)
+    assert not (tmp_path / 'shared.state.json').exists()
+
+
+def run_attached_client(data_dir, conn):
+    # runs in a separate process
+    with SharedInstantMongoDB(data_dir=data_dir) as im:
+        conn.send((im.port, im._mongodb_process.pid))
+        conn.recv()
+        im.db['testcoll'].insert_one({'foo': 'bar'})
+        conn.send(im.db['testcoll'].count_documents({}))
+        conn.recv()
+
+
+def test_shared_server_is_shared_between_processes(needs_mongod, tmp_path):
+    data_dir = tmp_path / 'shared'
+    ctx = get_context('spawn')
+    conn, child_conn = ctx.Pipe()
+    im = SharedInstantMongoDB(data_dir=data_dir)
+    im.start()
+    try:
+        child = ctx.Process(target=run_attached_client, args=(data_dir, child_conn))
+        child.start()
+        try:
+            assert conn.poll(60)
+            assert conn.recv() == (im.port, im._mongodb_process.pid)
+            mongod_pid = im._mongodb_process.pid
+            im.stop()
+            # the other process is still attached
+            assert is_pid_alive(mongod_pid)
+            conn.send('insert')
+            assert conn.poll(60)
+            assert conn.recv() == 1
+            conn.send('stop')
+        finally:
+            # the child stops as well if it is still waiting for a message
+            conn.close()
+            child.join(60)
+        assert child.exitcode == 0
+    finally:
+        im.stop()
+    assert not is_pid_alive(mongod_pid)
+    assert not (tmp_path / 'shared.state.json').exists()
+
+
+def test_shared_server_restarts_after_all_clients_left(needs_mongod, tmp_path):
+    data_dir = tmp_path / 'shared'
+    with SharedInstantMongoDB(data_dir=data_dir) as im:
+        first_pid = im._mongodb_process.pid
+    with SharedInstantMongoDB(data_dir=data_dir) as im:
+        assert im._mongodb_process.pid != first_pid
+        im.db['testcoll'].insert_one({'foo': 'bar'})
+
+
+def test_shared_requires_data_dir(tmp_path):
+    with raises(ValueError):
+        SharedInstantMongoDB()
+    with raises(ValueError):
+        SharedInstantMongoDB(tmp_path)
+
+
+def test_is_pid_alive():
+    from os import getpid
+    assert is_pid_alive(getpid())
@@ -0,0 +1,69 @@
+from pytest import fixture, raises
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.snapshot import list_snapshots, snapshot_db_name
+
+
+@fixture(scope='module')
+def instant_mongo(needs_mongod, tmp_path_factory):
+    with InstantMongoDB(tmp_path_factory.mktemp('instant-mongo-snapshot')) as im:
+        yield im
+
+
+@fixture
+def im(instant_mongo):
+    yield instant_mongo
+    instant_mongo.drop_everything()
+    for name in list_snapshots(instant_mongo.client):
+        instant_mongo.drop_snapshot(name)
+
+
+def test_snapshot_db_name():
+    assert snapshot_db_name('baseline').endswith('baseline')
+    with raises(ValueError):
+        snapshot_db_name('a.b')
+    with raises(ValueError):
+        snapshot_db_name('x' * 50)
+
+
+def test_snapshot_and_restore(im):
+    im.db['users'].insert_many([{'name': 'alice'}, {'name': 'bob'}])
+    im.db['users'].create_index('name', unique=True)
+    im.snapshot('baseline')
+    im.db['users'].delete_one({'name': 'alice'})
+    im.db['users'].insert_one({'name': 'carol'})
+    im.db['users'].drop_index('name_1')
+    im.db['orders'].insert_one({'total': 1})
+    im.restore('baseline')
+    assert sorted(d['name'] for d in im.db['users'].find()) == ['alice', 'bob']
+    assert im.db['users'].index_information()['name_1']['unique']
+    assert 'orders' not in im.db.list_collection_names()
+    # snapshot can be restored repeatedly
+    im.db['users'].delete_many({})
+    im.restore('baseline')
+    assert im.db['users'].count_documents({}) == 2
+
+
+def test_snapshot_selected_databases(im):
+    im.client['db1']['coll'].insert_one({'a': 1})
+    im.client['db2']['coll'].insert_one({'b': 1})
+    im.snapshot('only-db1', db_names=['db1'])
+    im.client['db1']['coll'].delete_many({})
+    im.client['db2']['coll'].delete_many({})
+    im.restore('only-db1')
+    assert im.client['db1']['coll'].count_documents({}) == 1
+    assert im.client['db2']['coll'].count_documents({}) == 0
+
+
+def test_snapshot_survives_drop_everything(im):
+    im.db['users'].insert_one({'name': 'alice'})
+    im.snapshot('baseline')
+    im.drop_everything()
+    assert list_snapshots(im.client) == ['baseline']
+    im.restore('baseline')
+    assert im.db['users'].count_documents({}) == 1
+
+
+def test_restore_unknown_snapshot(im):
+    with raises(KeyError):
+        im.restore('nonexistent')
@@ -0,0 +1,48 @@
+from pytest import raises
+
+from instant_mongo import InstantMongoDB
+from instant_mongo.write_tracker import written_namespaces
+
+
+def test_written_namespaces():
+    assert written_namespaces('insert', 'db', {'insert': 'c', 'documents': []}) == [('db', 'c')]
+    assert written_namespaces('find', 'db', {'find': 'c'}) == []
+    assert written_namespaces('aggregate', 'db', {'aggregate': 'c', 'pipeline': [{'$match': {}}]}) == []
+    assert written_namespaces('aggregate', 'db', {'aggregate': 'c', 'pipeline': [{'$out': 'd'}]}) == [('db', 'd')]
+    assert written_namespaces('aggregate', 'db', {'aggregate': 'c', 'pipeline': [{'$out': {'db': 'x', 'coll': 'd'}}]}) == [('x', 'd')]
+    assert written_namespaces('aggregate', 'db', {'aggregate': 'c', 'pipeline': [{'$merge': {'into': 'd'}}]}) == [('db', 'd')]
+    assert written_namespaces('renameCollection', 'admin', {'renameCollection': 'db.a', 'to': 'db.b'}) == [('db', 'b')]
+    assert written_namespaces('bulkWrite', 'admin', {'bulkWrite': 1, 'nsInfo': [{'ns': 'db.a'}, {'ns': 'x.b.c'}]}) == [
+        ('db', 'a'), ('x', 'b.c')]
+
+
+def test_track_writes(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path, track_writes=True) as im:
+        im.client['db1']['c1'].insert_one({'n': 1})
+        im.client['db1']['c2'].create_index('n')
+        im.client['db2']['c1'].find_one()
+        with im.get_client() as client:
+            client['db2']['c3'].update_one({'n': 1}, {'$set': {'n': 2}}, upsert=True)
+        im.client.admin.command('ping')
+        assert im.dirty_collections == [('db1', 'c1'), ('db1', 'c2'), ('db2', 'c3')]
+        im.cleanup_dirty()
+        assert im.dirty_collections == []
+        assert 'c1' not in im.client['db1'].list_collection_names()
+        assert 'c3' not in im.client['db2'].list_collection_names()
+
+        im.client['db1']['c1'].create_index('n')
+        im.client['db1']['c1'].insert_one({'n': 1})
+        assert im.clear_dirty_collections() == [('db1', 'c1')]
+        im.client['db1']['c1'].insert_one({'n': 2})
+        im.cleanup_dirty(strategy='truncate')
+        assert im.client['db1']['c1'].find_one() is None
+        assert 'n_1' in im.client['db1']['c1'].index_information()
+        assert im.dirty_collections == []
+
+
+def test_track_writes_not_enabled(needs_mongod, tmp_path):
+    with InstantMongoDB(tmp_path) as im:
+        with raises(RuntimeError):
+            im.dirty_collections
+        with raises(RuntimeError):
+            im.cleanup_dirty()